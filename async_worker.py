@@ -0,0 +1,218 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from job_store import open_store
+from config import load_config
+from worker import JobHandler
+from output_capture import CHUNK_SIZE
+from log_store import open_log_store
+from instrumentation import timed, QUEUE_WAIT_SECONDS
+from lease import get_lease_keeper
+from pytask import parse_task, get_pool
+import rusage
+
+# Upper bound on jobs leased per claim transaction
+CLAIM_LIMIT = 100
+
+
+class AsyncWorker(JobHandler):
+    """
+    Run up to `concurrency` jobs at once on a single asyncio event loop.
+
+    Subprocesses and timeouts are driven by the loop; every database call
+    (claims, state transitions, retries, DLQ moves) is funnelled through one
+    dedicated DB thread, so the process uses a single SQLite connection no
+    matter how many jobs are in flight.
+    """
+
+    def __init__(self, concurrency=100, queues=None):
+        self.worker_id = "async"
+        self.queues = queues
+        self.config = load_config()
+        self.store = open_store(config=self.config, group_commit=True)
+        self.logs = open_log_store(self.store)
+        self.concurrency = concurrency
+        self.processed = 0
+        self.stopping = False
+        self.db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flam-db")
+        # Heartbeats run on the keeper's own thread and connection, off the event loop
+        self.leases = get_lease_keeper(self.store.db_path, self.config)
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            # Platforms without loop signal handlers land here instead of in stop()
+            pass
+
+    def stop(self):
+        print("\n🛑 Shutting down async worker...")
+        self.stopping = True
+        self.store.wakeup.notify_local()
+
+    async def _db(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db, lambda: fn(*args, **kwargs))
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+        self.leases.ensure_running()
+        wakeup = self.store.wakeup
+        listening = wakeup.listen()
+        owner = f"async-{os.getpid()}"
+        running = set()
+        print(f"🧑‍🏭 Async worker started (concurrency={self.concurrency})...")
+
+        while not self.stopping:
+            free = self.concurrency - len(running)
+            if free <= 0:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            seen = wakeup.generation
+            jobs = await self._db(self.store.claim, owner, min(free, CLAIM_LIMIT), self.queues,
+                                  self.config.get("queue_limits"), self.config.get("lease_timeout", 60))
+            self.leases.add(j[0] for j in jobs)
+            if not jobs:
+                timeout = await self._db(self._idle_timeout, listening)
+                await loop.run_in_executor(None, wakeup.wait, timeout, seen)
+                continue
+
+            for job in jobs:
+                task = asyncio.create_task(self._run_job(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+        if running:
+            print(f"⏳ Waiting for {len(running)} running jobs...")
+            await asyncio.wait(running)
+        await self._db(self.store.flush)
+        self.db.shutdown()
+        print(f"🛑 Async worker stopped after {self.processed} jobs.")
+
+    async def _run_job(self, job):
+        job_id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_duration, last_exit_code = job
+        QUEUE_WAIT_SECONDS.observe(max(time.time() - max(created_at or 0, next_run_at or 0), 0))
+        if await self._db(self._use_cached_result, job_id):
+            self.leases.discard([job_id])
+            self.processed += 1
+            return
+        print(f"⚙️ Worker-{self.worker_id} executing: {command}")
+        timeout = self.config.get("timeout", 10)
+
+        capture = self._open_log(job_id)
+        start_time = time.time()
+        try:
+            task = parse_task(command)
+            if task is not None:
+                # The pool call blocks on a pipe, so it runs on the loop's default executor
+                pool_size = self.config.get("python_pool_size", 0)
+                with timed("python_task"):
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        None, lambda: get_pool(pool_size).run(task, capture, timeout))
+                await self._db(self._close_log, capture)
+                if result is None:
+                    # Killed after ignoring its timeout: wall time is all there is to record
+                    result = -1, "TimeoutExpired", None
+                exit_code, error, usage = result
+                if error == "TimeoutExpired":
+                    print(f"⏳ Job {job_id} timed out after {timeout}s")
+                await self._db(self._finish_job, job_id, attempts, max_retries, time.time() - start_time,
+                               exit_code, error=error, usage=usage)
+                return
+
+            with timed("spawn"):
+                floor = rusage.spawn_floor()
+                process, stdout, stderr = await _spawn(command)
+            readers = asyncio.gather(
+                _drain(stdout, capture.feed_stdout),
+                _drain(stderr, capture.feed_stderr)
+            )
+
+            try:
+                with timed("communicate"):
+                    usage = await _reap(process, timeout, floor)
+                    await readers
+            except subprocess.TimeoutExpired:
+                if os.name == "nt":
+                    process.send_signal(signal.CTRL_BREAK_EVENT)
+                else:
+                    process.terminate()
+                try:
+                    usage = await _reap(process, 2, floor)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    usage = await _reap(process, floor=floor)
+
+                await readers
+                print(f"⏳ Job {job_id} timed out after {timeout}s")
+                await self._db(self._close_log, capture)
+                await self._db(self._finish_job, job_id, attempts, max_retries, time.time() - start_time,
+                               process.returncode, error="TimeoutExpired", usage=usage)
+                return
+
+            await self._db(self._close_log, capture)
+            duration = time.time() - start_time
+            await self._db(self._finish_job, job_id, attempts, max_retries, duration, process.returncode, usage=usage)
+
+        except Exception as e:
+            duration = time.time() - start_time
+            capture.close()
+            await self._db(self._finish_job, job_id, attempts, max_retries, duration, -1, error=str(e))
+        finally:
+            self.leases.discard([job_id])
+            self.processed += 1
+
+
+async def _spawn(command):
+    """
+    Start a shell command; returns (process, stdout, stderr) with the output as asyncio streams.
+
+    On POSIX the child is a plain Popen, so _reap can take its rusage with
+    os.wait4; an asyncio subprocess is reaped by the loop's child watcher,
+    which throws that away. Windows has no rusage and keeps asyncio's.
+    """
+    if os.name == "nt":
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP
+        )
+        return process, process.stdout, process.stderr
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    loop = asyncio.get_running_loop()
+    streams = []
+    for pipe in (process.stdout, process.stderr):
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        streams.append(reader)
+    return process, *streams
+
+
+async def _reap(process, timeout=None, floor=None):
+    """Wait for a _spawn child and return its usage tuple (None on Windows); raises subprocess.TimeoutExpired."""
+    if isinstance(process, subprocess.Popen):
+        return await rusage.wait_async(process, timeout, floor)
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(process.pid, timeout) from None
+    return None
+
+
+async def _drain(stream, feed):
+    """Copy an asyncio stream into `feed` chunk by chunk until EOF."""
+    while True:
+        chunk = await stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        feed(chunk)
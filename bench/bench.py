@@ -0,0 +1,309 @@
+"""
+FLAM end-to-end benchmarks.
+
+Every scenario runs offline in its own temporary directory (fresh queue.db,
+config.json and logs/), with fixed sizes, so runs on the same machine are
+comparable.
+
+Usage:
+  python bench/bench.py                         # full run, prints JSON
+  python bench/bench.py --quick --out base.json
+  python bench/bench.py --compare base.json --threshold 0.2
+
+Metrics ending in "_per_s" are higher-is-better; everything else ("_ms",
+counts) is lower-is-better. --compare exits with status 1 if any metric regressed by more than the threshold.
+Metrics listed in BUDGETS also fail the run (status 1) when they exceed their budget, baseline or not.
+"""
+import argparse, contextlib, json, os, platform, sqlite3, statistics, subprocess, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from job_store import JobStore
+
+# Absolute ceilings, as "scenario.metric": limit. Scripts call `flam.py enqueue` once per job,
+# so a fresh process enqueueing into an existing queue.db must stay well under 200 ms; every
+# hot query must stay index-backed.
+BUDGETS = {
+    "startup.startup_enqueue_ms": 150,
+    "query_plans.unindexed_queries": 0,
+}
+
+
+@contextlib.contextmanager
+def scratch_dir():
+    """Run inside a fresh temporary directory with stdout silenced (jobs and workers print a lot)."""
+    old = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="flam-bench-") as d:
+        os.chdir(d)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                yield d
+        finally:
+            os.chdir(old)
+
+
+def wait_for(predicate, timeout, interval=0.01):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def bench_enqueue(sizes):
+    """Single-job enqueue rate (one commit per job) and bulk enqueue_many rate."""
+    n = sizes["enqueue"]
+    with scratch_dir():
+        store = JobStore()
+        start = time.perf_counter()
+        for i in range(n):
+            store.enqueue(f"echo {i}")
+        single = n / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in store.enqueue_many(f"echo {i}" for i in range(n * 10)):
+            pass
+        bulk = n * 10 / (time.perf_counter() - start)
+    return {"enqueue_per_s": single, "enqueue_many_per_s": bulk}
+
+
+def bench_claim(sizes):
+    """Median latency of claim(n=1) as the pending backlog grows."""
+    results = {}
+    samples = sizes["claim_samples"]
+    with scratch_dir():
+        store = JobStore()
+        depth = 0
+        for target in sizes["claim_depths"]:
+            for _ in store.enqueue_many(("true" for _ in range(target - depth)), chunk_size=10000):
+                pass
+            depth = target
+            timings = []
+            for _ in range(samples):
+                start = time.perf_counter()
+                jobs = store.claim("bench", 1)
+                timings.append((time.perf_counter() - start) * 1000)
+                store.release([j[0] for j in jobs])
+            results[f"claim_depth_{target}_ms"] = statistics.median(timings)
+    return results
+
+
+def bench_workers(sizes):
+    """End-to-end jobs/s for no-op commands across worker thread counts."""
+    from worker import Worker
+    results = {}
+    n = sizes["e2e_jobs"]
+    for count in sizes["worker_counts"]:
+        with scratch_dir():
+            store = JobStore()
+            for _ in store.enqueue_many("true" for _ in range(n)):
+                pass
+            stop = threading.Event()
+            workers = [Worker(i + 1, stop) for i in range(count)]
+            start = time.perf_counter()
+            for w in workers:
+                w.start()
+            wait_for(lambda: sum(w.processed for w in workers) >= n, timeout=600)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            store.wakeup.notify_local()
+            for w in workers:
+                w.join()
+            results[f"e2e_workers_{count}_per_s"] = n / elapsed
+    return results
+
+
+def bench_dlq(sizes):
+    """Throughput of 'flam.py dlq retry-all' over a full DLQ."""
+    from click.testing import CliRunner
+    n = sizes["dlq_jobs"]
+    with scratch_dir():
+        store = JobStore()
+        now = time.time()
+        store.conn.executemany(
+            "INSERT INTO dlq (id, command, attempts, max_retries, created_at, moved_at, error) VALUES (?, ?, 3, 3, ?, ?, ?)",
+            [(f"dlq-{i}", "false", now, now, "ExitCode:1") for i in range(n)]
+        )
+        store.conn.commit()
+        import flam
+        start = time.perf_counter()
+        result = CliRunner().invoke(flam.cli, ["dlq", "retry-all"])
+        elapsed = time.perf_counter() - start
+        if result.exit_code != 0:
+            raise RuntimeError(result.output)
+    return {"dlq_retry_all_per_s": n / elapsed}
+
+
+def bench_dashboard(sizes):
+    """Median uncached response time of each dashboard JSON endpoint over a populated queue."""
+    try:
+        import flask  # noqa: F401
+    except ImportError:
+        return {}
+    with scratch_dir():
+        store = JobStore()
+        for _ in store.enqueue_many("true" for _ in range(sizes["dashboard_jobs"])):
+            pass
+        now = time.time()
+        store.conn.executemany(
+            "INSERT INTO dlq (id, command, attempts, max_retries, created_at, moved_at, error) VALUES (?, ?, 3, 3, ?, ?, ?)",
+            [(f"dlq-{i}", "false", now, now, "ExitCode:1") for i in range(sizes["dashboard_jobs"] // 10)]
+        )
+        store.conn.commit()
+        import dashboard
+        # Every request rebuilds its snapshot: the queries are what's measured, not the cache
+        dashboard.cache.ttl = 0
+        client = dashboard.app.test_client()
+        results = {}
+        for name, url in (("summary", "/api/summary"), ("jobs", "/api/jobs?limit=50"),
+                          ("jobs_state", "/api/jobs?limit=50&state=pending"), ("dlq", "/api/dlq?limit=50")):
+            timings = []
+            for _ in range(20):
+                start = time.perf_counter()
+                if client.get(url).status_code != 200:
+                    raise RuntimeError(f"{url} failed")
+                timings.append((time.perf_counter() - start) * 1000)
+            results[f"dashboard_{name}_ms"] = statistics.median(timings)
+    return results
+
+
+def bench_startup(sizes):
+    """Median wall time of fresh `flam.py` processes (Python's own startup included)."""
+    flam = os.path.join(ROOT, "flam.py")
+    results = {}
+    with scratch_dir():
+        # The first run creates config.json and queue.db; the timed runs find them in place
+        subprocess.run([sys.executable, flam, "enqueue", "true"], check=True, stdout=subprocess.DEVNULL)
+        for name, args in (("python", ["-c", "pass"]), ("enqueue", [flam, "enqueue", "true"]), ("help", [flam, "--help"])):
+            timings = []
+            for _ in range(sizes["startup_runs"]):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL)
+                timings.append((time.perf_counter() - start) * 1000)
+            results[f"startup_{name}_ms"] = statistics.median(timings)
+    return results
+
+
+def bench_query_plans(sizes):
+    """Hot queries that lost their index (should always be 0)."""
+    with scratch_dir():
+        problems = JobStore().check_query_plans()
+    for name, plan in problems.items():
+        print(f"⚠️ {name} is not index-backed: {plan}", file=sys.stderr)
+    return {"unindexed_queries": len(problems)}
+
+
+SCENARIOS = {
+    "enqueue": bench_enqueue,
+    "claim": bench_claim,
+    "workers": bench_workers,
+    "dlq": bench_dlq,
+    "dashboard": bench_dashboard,
+    "query_plans": bench_query_plans,
+    "startup": bench_startup,
+}
+
+SIZES = {
+    "full": {"enqueue": 2000, "claim_depths": [1000, 10000, 100000, 1000000], "claim_samples": 200,
+             "e2e_jobs": 2000, "worker_counts": [1, 2, 4, 8], "dlq_jobs": 10000, "dashboard_jobs": 100000,
+             "startup_runs": 21},
+    "quick": {"enqueue": 500, "claim_depths": [1000, 10000], "claim_samples": 50,
+              "e2e_jobs": 300, "worker_counts": [1, 4], "dlq_jobs": 1000, "dashboard_jobs": 5000,
+              "startup_runs": 7},
+}
+
+
+def run(names, sizes):
+    results = {}
+    for name in names:
+        print(f"▶ {name}...", file=sys.stderr)
+        results[name] = SCENARIOS[name](sizes)
+    return {
+        "meta": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sizes": sizes,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print a comparison table and return the list of regressed metrics."""
+    regressions = []
+    for scenario, metrics in baseline["results"].items():
+        for metric, base in metrics.items():
+            new = current["results"].get(scenario, {}).get(metric)
+            if new is None:
+                continue
+            if metric.endswith("_per_s"):
+                change = (new - base) / base if base else 0
+                worse = new < base * (1 - threshold)
+            else:
+                change = (base - new) / base if base else -new
+                worse = new > base * (1 + threshold) if base else new > base
+            flag = "❌ REGRESSION" if worse else "ok"
+            print(f"{scenario:12} {metric:28} {base:12.3f} → {new:12.3f}  {change:+7.1%}  {flag}", file=sys.stderr)
+            if worse:
+                regressions.append(f"{scenario}.{metric}")
+    return regressions
+
+
+def over_budget(current):
+    """Print budgeted metrics and return the ones over budget."""
+    over = []
+    for key, limit in BUDGETS.items():
+        scenario, metric = key.split(".")
+        value = current["results"].get(scenario, {}).get(metric)
+        if value is None:
+            continue
+        ok = value <= limit
+        print(f"{scenario:12} {metric:28} {value:12.3f} ≤ {limit:<12}  {'ok' if ok else '❌ OVER BUDGET'}", file=sys.stderr)
+        if not ok:
+            over.append(key)
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FLAM benchmark suite")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes for a fast smoke run")
+    parser.add_argument("--out", help="Write results JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a saved results JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative regression (default 0.2)")
+    args = parser.parse_args()
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    results = run(args.scenarios or list(SCENARIOS), SIZES["quick" if args.quick else "full"])
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    over = over_budget(results)
+    if over:
+        print(f"❌ {len(over)} metric(s) over budget: {', '.join(over)}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+        print("✅ No regressions", file=sys.stderr)
+    if over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
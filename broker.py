@@ -0,0 +1,354 @@
+import hmac, http.client, json, os, socket, threading, time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from job_store import open_store, DB_PATH, DEFAULT_LEASE
+from config import load_config
+from log_store import LogStore, open_log_store
+from output_capture import CHUNK_SIZE
+from worker import JobHandler, Worker
+from instrumentation import timed, JOBS_TOTAL
+import instrumentation
+
+DEFAULT_PORT = 8765
+# Longest a claim is held open server-side waiting for work
+CLAIM_WAIT = 5
+
+
+def broker_token(config):
+    """The shared secret every broker request carries as "Authorization: Bearer <token>": $FLAM_BROKER_TOKEN, else config broker_token."""
+    return os.environ.get("FLAM_BROKER_TOKEN") or config.get("broker_token") or ""
+
+
+class Broker(JobHandler):
+    """
+    Owns queue.db on behalf of remote workers.
+
+    Each op_<name> method is one POST /<name> endpoint taking and returning
+    JSON. Requests run on the HTTP server's threads and share one JobStore
+    under a lock; outcomes go through the same JobHandler methods local
+    workers use, so retries, the DLQ, the result cache and logs behave
+    exactly the same.
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.worker_id = "broker"
+        self.config = load_config()
+        self.store = open_store(db_path, self.config, group_commit=True)
+        self.logs = open_log_store(self.store)
+        self.queues = None
+        self.lock = threading.Lock()
+
+    def op_enqueue(self, command, **options):
+        with self.lock:
+            return self.store.enqueue(command, **options)
+
+    def op_enqueue_many(self, jobs, chunk_size=1000):
+        with self.lock:
+            return list(self.store.enqueue_many(jobs, chunk_size))
+
+    def op_claim(self, worker_id, n=1, queues=None, lease=DEFAULT_LEASE, wait=0):
+        """Claim up to n jobs, holding the request open up to `wait` seconds until some are due."""
+        queues = [tuple(q) for q in queues] if queues else None
+        deadline = time.time() + min(wait, CLAIM_WAIT)
+        wakeup = self.store.wakeup
+        while True:
+            seen = wakeup.generation
+            with self.lock:
+                jobs = self.store.claim(worker_id, n, queues, self.config.get("queue_limits"), lease)
+                due = None if self.store.limited else self.store.next_due_at([q for q, _ in queues] if queues else None)
+            left = deadline - time.time()
+            if jobs or left <= 0:
+                return jobs
+            wakeup.wait(min(left, max(due - time.time(), 0.01)) if due is not None else left, seen)
+
+    def op_release(self, job_ids):
+        with self.lock:
+            self.store.release(job_ids)
+
+    def op_heartbeat(self, job_ids, lease=DEFAULT_LEASE):
+        with self.lock:
+            self.store.extend_leases(job_ids, lease)
+
+    def op_cached(self, job_id):
+        with self.lock:
+            return self._use_cached_result(job_id)
+
+    def op_finish(self, job_id, attempts, max_retries, duration, exit_code, error=None, usage=None):
+        with self.lock:
+            return self._finish_job(job_id, attempts, max_retries, duration, exit_code, error, usage)
+
+    def op_fail(self, job_id, attempts, max_retries, error):
+        with self.lock:
+            return self._handle_failure(job_id, attempts, max_retries, error)
+
+    def save_log(self, job_id, stream, length, compressed):
+        """Store an uploaded run log exactly as a local worker's _close_log would."""
+        if not job_id or os.path.basename(job_id) != job_id:
+            raise ValueError(f"invalid job id {job_id!r}")
+        # Not the active path itself: a worker sharing this directory is still reading that file
+        path = self.logs.active_path(job_id, compressed) + ".upload"
+        with open(path, "wb") as f:
+            while length > 0:
+                chunk = stream.read(min(CHUNK_SIZE, length))
+                if not chunk:
+                    raise ConnectionError("log upload ended early")
+                f.write(chunk)
+                length -= len(chunk)
+        with self.lock:
+            return self.logs.append(job_id, path, compressed)
+
+    def metrics(self):
+        with self.lock:
+            return instrumentation.render_queue_metrics(self.store) + instrumentation.render()
+
+
+class _BrokerRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps worker connections open between requests
+    protocol_version = "HTTP/1.1"
+
+    def _authorized(self):
+        sent = self.headers.get("Authorization", "")
+        if hmac.compare_digest(sent.encode(), f"Bearer {self.server.token}".encode()):
+            return True
+        # The request body is left unread; don't reuse this connection
+        self.close_connection = True
+        self._reply(401, {"error": "missing or wrong broker token"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path.split("?")[0] != "/metrics":
+            self._reply(404, {"error": "not found"})
+            return
+        body = self.server.broker.metrics().encode()
+        self._send(200, body, instrumentation.CONTENT_TYPE)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        broker = self.server.broker
+        length = int(self.headers.get("Content-Length", 0))
+        path, _, query = self.path.partition("?")
+        try:
+            if path.startswith("/log/"):
+                result = broker.save_log(path[len("/log/"):], self.rfile, length, "compressed=1" in query)
+            else:
+                body = json.loads(self.rfile.read(length) or b"{}")
+                op = getattr(broker, "op_" + path.strip("/"), None)
+                if op is None:
+                    self._reply(404, {"error": f"unknown endpoint {path}"})
+                    return
+                result = op(**body)
+        except Exception as e:
+            # The request body may be half-read; don't reuse this connection
+            self.close_connection = True
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        try:
+            self._reply(200, {"result": result})
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            # The worker went away during a long-poll; don't strand what it claimed until its lease expires
+            if path == "/claim" and result:
+                broker.op_release([j[0] for j in result])
+
+    def _reply(self, status, payload):
+        self._send(status, json.dumps(payload).encode(), "application/json")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, db_path=DB_PATH):
+    """A broker HTTP server for db_path, not yet serving; port 0 picks a free port (see server.server_address)."""
+    broker = Broker(db_path)
+    token = broker_token(broker.config)
+    if not token:
+        raise ValueError("the broker needs a shared token: set broker_token in config.json or FLAM_BROKER_TOKEN")
+    server = ThreadingHTTPServer((host, port), _BrokerRequestHandler)
+    server.daemon_threads = True
+    server.broker = broker
+    server.token = token
+    return server
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, db_path=DB_PATH):
+    """Run the broker until interrupted."""
+    from lease import get_lease_keeper
+    server = make_server(host, port, db_path)
+    broker = server.broker
+    # Enqueues from local CLIs and other processes wake long-polling claims
+    broker.store.wakeup.listen()
+    # Remote workers only heartbeat; expired leases are reaped here
+    get_lease_keeper(db_path, broker.config).ensure_running()
+    if broker.config.get("scheduler", 1):
+        from scheduler import Scheduler
+        Scheduler(broker.config, threading.Event(), db_path).start()
+    print(f"📡 FLAM broker serving {os.path.abspath(db_path)} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Broker stopped.")
+    finally:
+        server.server_close()
+
+
+class BrokerError(Exception):
+    pass
+
+
+class BrokerClient:
+    """JSON-over-HTTP client for a broker, reusing one keep-alive connection (one client per thread)."""
+
+    def __init__(self, address, token, timeout=CLAIM_WAIT + 30):
+        host, _, port = address.rpartition(":")
+        self.address = address
+        self.token = token
+        self.host = host or "127.0.0.1"
+        self.port = int(port or DEFAULT_PORT)
+        self.timeout = timeout
+        self.conn = None
+        # Claims never report limits to the worker; the broker waits on them itself
+        self.limited = False
+
+    def _request(self, path, body, content_type="application/json"):
+        # Always send a Content-Length (never chunked) so the broker can keep the connection open
+        headers = {"Content-Type": content_type, "Authorization": f"Bearer {self.token}",
+                   "Content-Length": str(os.fstat(body.fileno()).st_size if hasattr(body, "fileno") else len(body))}
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                self.conn.request("POST", path, body, headers)
+                resp = self.conn.getresponse()
+                payload = json.loads(resp.read())
+                break
+            except Exception as e:
+                self.conn.close()
+                self.conn = None
+                # The broker closed an idle keep-alive connection; reconnect once
+                if attempt or not isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)):
+                    raise
+        if resp.status != 200:
+            raise BrokerError(payload.get("error"))
+        return payload["result"]
+
+    def call(self, op, **body):
+        return self._request(f"/{op}", json.dumps(body).encode())
+
+    def enqueue(self, command, **options):
+        return self.call("enqueue", command=command, **options)
+
+    def claim(self, worker_id, n=1, queues=None, limits=None, lease=DEFAULT_LEASE, wait=0):
+        return self.call("claim", worker_id=worker_id, n=n, queues=queues, lease=lease, wait=wait)
+
+    def release(self, job_ids):
+        if job_ids:
+            self.call("release", job_ids=job_ids)
+
+    def extend_leases(self, job_ids, lease=DEFAULT_LEASE):
+        if job_ids:
+            self.call("heartbeat", job_ids=job_ids, lease=lease)
+
+    def upload_log(self, job_id, f, compressed=False):
+        return self._request(f"/log/{job_id}?compressed={int(compressed)}", f, "application/octet-stream")
+
+
+class RemoteWorker(Worker):
+    """A Worker that claims jobs and reports outcomes through a broker instead of opening queue.db."""
+
+    def __init__(self, worker_id, stop_event, broker, queues=None):
+        from lease import get_lease_keeper
+        # Skip Worker.__init__: it would open a local queue.db
+        threading.Thread.__init__(self, daemon=True)
+        self.worker_id = worker_id
+        self.queues = queues
+        self.stop_event = stop_event
+        self.config = load_config()
+        token = broker_token(self.config)
+        self.store = BrokerClient(broker, token)
+        # Only used for the local active/ files jobs stream into before upload
+        self.logs = LogStore(None)
+        self.leases = get_lease_keeper(f"broker://{broker}", self.config, lambda: BrokerClient(broker, token))
+        self.claimed = deque()
+        self.processed = 0
+
+    def run(self):
+        print(f"🧑‍🏭 Worker-{self.worker_id} started (broker {self.store.address})...")
+        self.leases.ensure_running()
+        while not self.stop_event.is_set():
+            try:
+                job = self._get_pending_job()
+            except (OSError, BrokerError) as e:
+                print(f"⚠️ Broker unavailable ({e}); retrying...")
+                self.stop_event.wait(self.config.get("poll_interval", 1))
+                continue
+            if job:
+                try:
+                    self._run_job(job)
+                    self.processed += 1
+                except (OSError, BrokerError) as e:
+                    # The run's outcome never reached the broker: hand the job back to be run again,
+                    # or, if the broker is still down, let its lease expire so the broker's reaper does
+                    print(f"⚠️ Broker unavailable while reporting job {job[0]} ({e}); it will be retried")
+                    try:
+                        self.store.release([job[0]])
+                    except (OSError, BrokerError):
+                        pass
+                    self.stop_event.wait(self.config.get("poll_interval", 1))
+                self.leases.discard([job[0]])
+
+        unstarted = [j[0] for j in self.claimed]
+        self.store.release(unstarted)
+        self.leases.discard(unstarted)
+        self.claimed.clear()
+        print(f"🛑 Worker-{self.worker_id} stopping (graceful)")
+
+    def _get_pending_job(self):
+        if not self.claimed:
+            jobs = self.store.claim(f"worker-{socket.gethostname()}-{os.getpid()}-{self.worker_id}",
+                                    self.config.get("claim_batch", 1), self.queues,
+                                    lease=self.config.get("lease_timeout", 60), wait=CLAIM_WAIT)
+            self.leases.add(j[0] for j in jobs)
+            self.claimed.extend(jobs)
+        return self.claimed.popleft() if self.claimed else None
+
+    def _close_log(self, capture):
+        with timed("save_logs"):
+            capture.close()
+            with open(capture.path, "rb") as f:
+                segment, offset, length = self.store.upload_log(capture.job_id, f, capture.compress)
+            os.remove(capture.path)
+        print(f"🗒️ Logs uploaded to {segment} ({length} bytes)")
+
+    def _finish_job(self, job_id, attempts, max_retries, duration, exit_code, error=None, usage=None):
+        outcome = self.store.call("finish", job_id=job_id, attempts=attempts, max_retries=max_retries,
+                                  duration=duration, exit_code=exit_code, error=error, usage=usage)
+        JOBS_TOTAL.inc(outcome=outcome)
+        print(f"{'✅' if outcome == 'completed' else '🔁' if outcome == 'retried' else '☠️'} "
+              f"Job {job_id} {outcome} after {duration:.2f}s")
+        return outcome
+
+    def _handle_failure(self, job_id, attempts, max_retries, error):
+        with timed("handle_failure"):
+            outcome = self.store.call("fail", job_id=job_id, attempts=attempts, max_retries=max_retries, error=error)
+        JOBS_TOTAL.inc(outcome=outcome)
+        print(f"{'🔁' if outcome == 'retried' else '☠️'} Job {job_id} {outcome} (error={error})")
+        return outcome
+
+    def _use_cached_result(self, job_id):
+        if not self.store.call("cached", job_id=job_id):
+            return False
+        JOBS_TOTAL.inc(outcome="cached")
+        print(f"♻️ Job {job_id} completed from a cached result")
+        return True
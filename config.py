@@ -7,7 +7,31 @@ DEFAULT_CONFIG = {
     "max_retries": 3,
     "backoff_base": 2,
     "poll_interval": 1,
-    "timeout": 10
+    "timeout": 10,
+    "claim_batch": 1,
+    "idle_timeout": 30,
+    "log_max_bytes": 10 * 1024 * 1024,
+    "log_gzip": False,
+    "retention_hours": 168,
+    "retention_interval": 0,
+    "gc_batch": 1000,
+    "gc_vacuum_pages": 1000,
+    "metrics_port": 0,
+    "result_cache_ttl": 3600,
+    "result_cache_max_entries": 10000,
+    "queue_limits": {},
+    "lease_timeout": 60,
+    "reap_interval": 30,
+    "python_pool_size": 0,
+    "shards": 1,
+    "shard_by": "job",
+    "shard_claim": "round_robin",
+    "group_commit_ms": 5,
+    "group_commit_max_writes": 1000,
+    "dashboard_cache_ttl": 2,
+    "dashboard_poll_interval": 1,
+    "scheduler": 1,
+    "broker_token": ""
 }
 
 def load_config():
@@ -15,7 +39,8 @@ def load_config():
         with open(CONFIG_PATH, "w") as f:
             json.dump(DEFAULT_CONFIG, f, indent=4)
     with open(CONFIG_PATH, "r") as f:
-        return json.load(f)
+        # Keys added after the file was written fall back to their defaults
+        return {**DEFAULT_CONFIG, **json.load(f)}
 
 def save_config(cfg):
     with open(CONFIG_PATH, "w") as f:
@@ -1,10 +1,16 @@
-from flask import Flask, render_template_string, redirect, url_for, request
-from job_store import JobStore
-from dlq import DLQ
+import hashlib, json, queue, threading, time
+from collections import deque
+from flask import Flask, Response, render_template_string, redirect, url_for, request
+from job_store import open_store, JOB_COLUMNS
+from dlq import open_dlq, DLQ_COLUMNS
+from config import load_config
+import instrumentation
 
 app = Flask(__name__)
-store = JobStore()
-dlq = DLQ()
+config = load_config()
+JOB_FIELDS = [c.strip() for c in JOB_COLUMNS.split(",")]
+DLQ_FIELDS = [c.strip() for c in DLQ_COLUMNS.split(",")]
+MAX_PAGE = 500
 
 TEMPLATE = """
 <!DOCTYPE html>
@@ -13,7 +19,6 @@ TEMPLATE = """
 <meta charset="UTF-8">
 <title> FLAM Monitoring Dashboard</title>
 <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-<meta http-equiv="refresh" content="10">
 <style>
 body {
   font-family: 'Segoe UI', sans-serif; margin: 0; background: #eef2f7;
@@ -56,15 +61,20 @@ button:hover { background: #2c3e50; }
 </style>
 </head>
 <body>
-<header><h1> FLAM Monitoring Dashboard</h1><p>Auto-refreshes every 10 seconds</p></header>
+<header><h1> FLAM Monitoring Dashboard</h1><p id="status">Connecting...</p></header>
 <div class="container">
 
 <div class="cards">
-  <div class="card total"><h2>{{summary.total}}</h2><p>Total Jobs</p></div>
-  <div class="card completed"><h2>{{summary.completed}}</h2><p>Completed</p></div>
-  <div class="card dead"><h2>{{summary.dead}}</h2><p>Dead</p></div>
-  <div class="card duration"><h2>{{summary.avg_duration}}</h2><p>Avg Duration (s)</p></div>
-  <div class="card rate"><h2>{{summary.success_rate}}%</h2><p>Success Rate</p></div>
+  <div class="card total"><h2 id="total">-</h2><p>Total Jobs</p></div>
+  <div class="card completed"><h2 id="completed">-</h2><p>Completed</p></div>
+  <div class="card dead"><h2 id="dead">-</h2><p>Dead</p></div>
+  <div class="card duration"><h2 id="avg_duration">-</h2><p>Avg Duration (s)</p></div>
+  <div class="card rate"><h2 id="success_rate">-</h2><p>Success Rate</p></div>
+</div>
+
+<div class="cards">
+  <div class="card duration"><h2 id="duration_pct">-</h2><p>Duration p50 / p95 / p99 (s)</p></div>
+  <div class="card total"><h2 id="queue_wait_pct">-</h2><p>Queue Wait p50 / p95 / p99 (s)</p></div>
 </div>
 
 <div class="chart-grid">
@@ -74,62 +84,344 @@ button:hover { background: #2c3e50; }
 
 <h2>🧾 Recent Jobs</h2>
 <table>
-<tr><th>ID</th><th>COMMAND</th><th>STATE</th><th>PRIORITY</th><th>ATTEMPTS</th><th>DURATION (s)</th></tr>
-{% for j in jobs %}
-<tr><td>{{j[0]}}</td><td>{{j[1]}}</td><td>{{j[2]}}</td><td>{{j[8]}}</td><td>{{j[3]}}</td><td>{{"%.3f"|format(j[9] or 0)}}</td></tr>
-{% endfor %}
+<thead><tr><th>ID</th><th>COMMAND</th><th>STATE</th><th>PRIORITY</th><th>ATTEMPTS</th><th>DURATION (s)</th></tr></thead>
+<tbody id="jobs"></tbody>
 </table>
+<button id="more-jobs" onclick="loadJobs(jobsNext)" hidden>Load more</button>
 
 <h2>☠️ Dead Letter Queue (DLQ)</h2>
 <table>
-<tr><th>ID</th><th>COMMAND</th><th>ERROR</th><th>MOVED AT</th><th>ACTION</th></tr>
-{% for d in dlq_rows %}
-<tr>
-<td>{{d[0]}}</td><td>{{d[1]}}</td><td>{{d[6]}}</td><td>{{d[5]}}</td>
-<td><form method="POST" action="{{url_for('retry_dlq',job_id=d[0])}}">
-<button type="submit">♻ Retry</button></form></td>
-</tr>
-{% endfor %}
+<thead><tr><th>ID</th><th>COMMAND</th><th>ERROR</th><th>MOVED AT</th><th>ACTION</th></tr></thead>
+<tbody id="dlq"></tbody>
 </table>
+<button id="more-dlq" onclick="loadDlq(dlqNext)" hidden>Load more</button>
 
 </div>
 
 <script>
-const pie = document.getElementById('pieChart');
-new Chart(pie,{
+const PAGE = 15;
+const pie = new Chart(document.getElementById('pieChart'), {
   type:'pie',
-  data:{labels:['Completed','Dead'],
-  datasets:[{data:[{{summary.completed}},{{summary.dead}}],
-  backgroundColor:['#27ae60','#e74c3c']}]}});
-const bar = document.getElementById('barChart');
-new Chart(bar,{
+  data:{labels:['Completed','Dead'], datasets:[{data:[0,0], backgroundColor:['#27ae60','#e74c3c']}]}});
+const bar = new Chart(document.getElementById('barChart'), {
   type:'bar',
   data:{labels:['Total','Completed','Dead'],
-  datasets:[{label:'Jobs Count',data:[{{summary.total}},{{summary.completed}},{{summary.dead}}],
-  backgroundColor:['#3498db','#2ecc71','#e74c3c']}]},
+  datasets:[{label:'Jobs Count', data:[0,0,0], backgroundColor:['#3498db','#2ecc71','#e74c3c']}]},
   options:{scales:{y:{beginAtZero:true}}}});
+let summary = {}, jobsNext = null, dlqNext = null;
+
+function pct(p) { return Object.values(p).map(v => v === null ? '-' : v.toFixed(2)).join(' / '); }
+function cell(row, text) { row.insertCell().textContent = text; }
+
+function showSummary(changes) {
+  Object.assign(summary, changes);
+  for (const k of ['total', 'completed', 'dead']) document.getElementById(k).textContent = summary[k];
+  document.getElementById('avg_duration').textContent = summary.avg_duration.toFixed(3);
+  document.getElementById('success_rate').textContent = summary.success_rate.toFixed(2) + '%';
+  document.getElementById('duration_pct').textContent = pct(summary.duration_pct);
+  document.getElementById('queue_wait_pct').textContent = pct(summary.queue_wait_pct);
+  pie.data.datasets[0].data = [summary.completed, summary.dead];
+  bar.data.datasets[0].data = [summary.total, summary.completed, summary.dead];
+  pie.update(); bar.update();
+  if ('dlq' in changes) loadDlq();
+}
+
+function jobRow(job, row) {
+  row = row || document.createElement('tr');
+  row.id = 'job-' + job.id;
+  row.replaceChildren();
+  for (const v of [job.id, job.command, job.state, job.priority, job.attempts, (job.last_duration || 0).toFixed(3)]) cell(row, v);
+  return row;
+}
+
+async function fetchJson(url) {
+  const resp = await fetch(url);
+  return resp.json();
+}
+
+async function loadJobs(after) {
+  const page = await fetchJson('/api/jobs?limit=' + PAGE + (after ? '&after=' + encodeURIComponent(after) : ''));
+  const body = document.getElementById('jobs');
+  if (!after) body.replaceChildren();
+  for (const job of page.jobs) body.appendChild(jobRow(job));
+  jobsNext = page.next;
+  document.getElementById('more-jobs').hidden = !jobsNext;
+}
+
+async function loadDlq(after) {
+  const page = await fetchJson('/api/dlq?limit=100' + (after ? '&after=' + encodeURIComponent(after) : ''));
+  const body = document.getElementById('dlq');
+  if (!after) body.replaceChildren();
+  for (const d of page.dlq) {
+    const row = body.insertRow();
+    for (const v of [d.id, d.command, d.error, new Date(d.moved_at * 1000).toLocaleString()]) cell(row, v);
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/retry/' + encodeURIComponent(d.id);
+    form.innerHTML = '<button type="submit">♻ Retry</button>';
+    row.insertCell().appendChild(form);
+  }
+  dlqNext = page.next;
+  document.getElementById('more-dlq').hidden = !dlqNext;
+}
+
+// Changed jobs update their row in place; jobs not shown yet are new and go on top
+function applyJobs(jobs) {
+  const body = document.getElementById('jobs');
+  for (const job of jobs) {
+    const row = document.getElementById('job-' + job.id);
+    if (row) jobRow(job, row);
+    else if (job.state === 'pending' && job.attempts === 0) body.prepend(jobRow(job));
+  }
+}
+
+const events = new EventSource('/api/events');
+events.addEventListener('snapshot', e => { summary = {}; showSummary(JSON.parse(e.data)); loadJobs(); });
+events.addEventListener('metrics', e => showSummary(JSON.parse(e.data)));
+events.addEventListener('jobs', e => applyJobs(JSON.parse(e.data)));
+events.addEventListener('resync', e => loadJobs());
+events.onopen = () => document.getElementById('status').textContent = 'Live';
+events.onerror = () => document.getElementById('status').textContent = 'Reconnecting...';
 </script>
 </body>
 </html>
 """
 
-@app.route("/")
-def index():
+# Reader connections, one per request at a time; the dev server starts a thread per request
+_readers = queue.SimpleQueue()
+
+
+class reader:
+    """Borrow a (store, dlq) pair of read connections for the duration of a with block."""
+
+    def __enter__(self):
+        try:
+            self.pair = _readers.get_nowait()
+        except queue.Empty:
+            self.pair = (open_store(config=config), open_dlq(config=config))
+        return self.pair
+
+    def __exit__(self, *exc):
+        _readers.put(self.pair)
+
+
+class SnapshotCache:
+    """
+    JSON bodies shared by every viewer for `ttl` seconds.
+
+    A snapshot is built by whichever request misses first while the others
+    asking for the same key wait for it, so N dashboards polling the same URL
+    run the queries about once per ttl. Each body carries a content ETag.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}   # key -> (expires, etag, body)
+        self.building = {}  # key -> lock held while that key is rebuilt
+
+    def get(self, key, build):
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry
+        with self.lock:
+            key_lock = self.building.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry
+            body = json.dumps(build(), separators=(",", ":")).encode()
+            entry = (time.monotonic() + self.ttl, hashlib.sha1(body).hexdigest(), body)
+            with self.lock:
+                if len(self.entries) > 1000:
+                    now = time.monotonic()
+                    self.entries = {k: e for k, e in self.entries.items() if e[0] > now}
+                self.entries[key] = entry
+        return entry
+
+
+cache = SnapshotCache(config.get("dashboard_cache_ttl", 2))
+
+
+def cached_json(build):
+    """Serve build()'s result from the snapshot cache; If-None-Match hits get an empty 304."""
+    _, etag, body = cache.get(request.full_path, build)
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+
+def summary_of(store):
     m = store.metrics()
-    summary = {
+    return {
         "total": m["total"], "completed": m["completed"], "dead": m["dead"],
-        "avg_duration": round(m["avg_duration"], 3), "success_rate": round(m["success_rate"], 2)
+        "avg_duration": m["avg_duration"], "success_rate": m["success_rate"], "states": m["states"],
+        "duration_pct": m["duration_pct"], "queue_wait_pct": m["queue_wait_pct"], "dlq": store.dlq_count()
     }
-    cur = store.conn.cursor()
-    cur.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT 15")
-    jobs = cur.fetchall()
-    dlq_rows = dlq.list_dlq()
-    return render_template_string(TEMPLATE, summary=summary, jobs=jobs, dlq_rows=dlq_rows)
+
+
+def build_summary():
+    with reader() as (store, _):
+        return summary_of(store)
+
+
+def job_dict(job):
+    return dict(zip(JOB_FIELDS, job))
+
+
+class EventFeed(threading.Thread):
+    """
+    One poller per dashboard process that turns database changes into server-sent events.
+
+    While anyone is listening it reads the summary and the jobs updated since
+    the previous poll every `interval` seconds and publishes only what changed:
+    'metrics' carries the summary keys whose value changed, 'jobs' the changed
+    jobs, and 'resync' replaces 'jobs' when too many changed to send. Events
+    are kept in a short ring buffer so a reconnecting viewer resumes from its
+    Last-Event-ID; otherwise it starts from a 'snapshot' of the summary.
+    """
+
+    # Write-behind commits can land with an updated_at slightly in the past
+    SLACK = 5
+    MAX_JOBS = 1000
+
+    def __init__(self, interval=1, backlog=256):
+        super().__init__(daemon=True, name="flam-dashboard-events")
+        self.interval = interval
+        self.events = deque(maxlen=backlog)  # (seq, event, data)
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.listeners = 0
+        self.summary = {}
+        self.since = time.time()
+        # Job id -> updated_at already published, within the slack window
+        self.sent = {}
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.listeners:
+                self.since = time.time()
+                continue
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"⚠️ Dashboard event poll failed: {e}")
+
+    def poll(self):
+        now = time.time()
+        with reader() as (store, _):
+            summary = summary_of(store)
+            jobs = store.changed_since(self.since - self.SLACK, self.MAX_JOBS)
+        # Compared in JSON form, where the percentile keys are strings
+        changed = {k: v for k, v in json.loads(json.dumps(summary)).items() if self.summary.get(k) != v}
+        self.summary.update(changed)
+        if changed:
+            self.publish("metrics", changed)
+        if len(jobs) >= self.MAX_JOBS:
+            self.sent.clear()
+            self.publish("resync", {})
+        else:
+            fresh = [j for j in jobs if self.sent.get(j[0]) != j[6]]
+            for job in fresh:
+                self.sent[job[0]] = job[6]
+            if fresh:
+                self.publish("jobs", [job_dict(j) for j in sorted(fresh, key=lambda j: j[6])])
+        self.sent = {k: t for k, t in self.sent.items() if t > now - 2 * self.SLACK}
+        self.since = now
+
+    def publish(self, event, data):
+        with self.cond:
+            self.seq += 1
+            self.events.append((self.seq, event, json.dumps(data, separators=(",", ":"))))
+            self.cond.notify_all()
+
+    def stream(self, last_id=None):
+        """SSE text for one viewer, forever; ends when the viewer disconnects."""
+        with self.cond:
+            self.listeners += 1
+            oldest = self.events[0][0] if self.events else self.seq + 1
+            resume = last_id is not None and oldest - 1 <= last_id <= self.seq
+            seq = last_id if resume else self.seq
+        try:
+            yield "retry: 3000\n\n"
+            if not resume:
+                yield f"id: {seq}\nevent: snapshot\ndata: {cache.get('/api/summary?', build_summary)[2].decode()}\n\n"
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.seq > seq, timeout=15)
+                    pending = [e for e in self.events if e[0] > seq]
+                if not pending:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                for seq, event, data in pending:
+                    yield f"id: {seq}\nevent: {event}\ndata: {data}\n\n"
+        finally:
+            with self.cond:
+                self.listeners -= 1
+
+
+feed = EventFeed(config.get("dashboard_poll_interval", 1))
+feed.start()
+
+
+def page_limit():
+    return max(1, min(request.args.get("limit", 50, type=int), MAX_PAGE))
+
+
+@app.route("/")
+def index():
+    return render_template_string(TEMPLATE)
+
+@app.route("/api/summary")
+def summary():
+    return cached_json(build_summary)
+
+@app.route("/api/jobs")
+def jobs():
+    """Newest first; pass the previous page's `next` as `after` for the following page."""
+    limit, after, state = page_limit(), request.args.get("after"), request.args.get("state")
+    def build():
+        with reader() as (store, _):
+            before = None
+            if after:
+                job = store.get_job(after)
+                if job is None:
+                    return {"jobs": [], "next": None}
+                before = (job[5], job[0])
+            rows = store.page_jobs(limit, before, state)
+        return {"jobs": [job_dict(j) for j in rows], "next": rows[-1][0] if len(rows) == limit else None}
+    return cached_json(build)
+
+@app.route("/api/dlq")
+def dead_letters():
+    """Oldest first, by (moved_at, id); paged like /api/jobs."""
+    limit, after = page_limit(), request.args.get("after")
+    def build():
+        with reader() as (_, dlq):
+            rows = dlq.list_dlq(limit=limit, after=after)
+        return {"dlq": [dict(zip(DLQ_FIELDS, d)) for d in rows], "next": rows[-1][0] if len(rows) == limit else None}
+    return cached_json(build)
+
+@app.route("/api/events")
+def events():
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    return Response(feed.stream(last_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics")
+def prometheus_metrics():
+    with reader() as (store, _):
+        body = instrumentation.render_queue_metrics(store) + instrumentation.render()
+    return Response(body, content_type=instrumentation.CONTENT_TYPE)
 
 @app.route("/retry/<job_id>", methods=["POST"])
 def retry_dlq(job_id):
     try:
-        dlq.retry_job(job_id)
+        with reader() as (_, dlq):
+            dlq.retry_job(job_id)
         print(f"♻ Retried DLQ job {job_id}")
         return redirect(url_for('index'))
     except Exception as e:
@@ -138,4 +430,4 @@ def retry_dlq(job_id):
 
 if __name__ == "__main__":
     print("🚀 FLAM Dashboard → http://localhost:5000")
-    app.run(port=5000, debug=False)
+    app.run(port=5000, debug=False, threaded=True)
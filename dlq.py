@@ -1,40 +1,128 @@
-import sqlite3, time
+import time
+from job_store import JobStore
 DB_PATH = "queue.db"
 
+DLQ_COLUMNS = "id, command, attempts, max_retries, created_at, moved_at, error"
+
+
+def dlq_filter(error=None, since=None, until=None, command_prefix=None, ids=None):
+    """
+    Build a WHERE clause (and its parameters) selecting DLQ rows.
+
+    error is a GLOB pattern ('ExitCode:*', '*Timeout*'); since/until bound
+    moved_at in epoch seconds; command_prefix matches the start of the command.
+    """
+    clauses, params = [], []
+    if error is not None:
+        clauses.append("error GLOB ?")
+        params.append(error)
+    if since is not None:
+        clauses.append("moved_at >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("moved_at < ?")
+        params.append(until)
+    if command_prefix:
+        clauses.append("substr(command, 1, ?) = ?")
+        params += [len(command_prefix), command_prefix]
+    if ids is not None:
+        clauses.append(f"id IN ({','.join('?' for _ in ids)})")
+        params += list(ids)
+    return " AND ".join(clauses) or "1", params
+
+
+def open_dlq(db_path=DB_PATH, config=None):
+    """The DLQ for db_path: a DLQ, or a ShardedDLQ spanning every shard when config "shards" is above 1."""
+    if config is None:
+        from config import load_config
+        config = load_config()
+    if config.get("shards", 1) > 1:
+        from shards import ShardedDLQ
+        return ShardedDLQ(db_path, config["shards"])
+    return DLQ(db_path)
+
+
 class DLQ:
-    def __init__(self, db_path=DB_PATH):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+    def __init__(self, db_path=DB_PATH, wakeup_path=None):
+        # Opened through JobStore so a new or older queue.db gets its schema created or migrated first
+        store = JobStore(db_path, wakeup_path)
+        self.conn = store.conn
+        self.wakeup = store.wakeup
 
-    def list_dlq(self):
-        cur = self.conn.cursor()
-        cur.execute("SELECT id, command, attempts, max_retries, created_at, moved_at, error FROM dlq")
-        return cur.fetchall()
+    def list_dlq(self, limit=None, after=None, **filters):
+        """One page of DLQ rows, oldest first; `after` is the last id of the previous page."""
+        return list(self.iter_dlq(limit=limit, after=after, **filters))
 
-    def retry_job(self, job_id):
+    def iter_dlq(self, limit=None, after=None, page_size=1000, **filters):
+        """Stream DLQ rows ordered by (moved_at, id), fetching page_size rows per query."""
+        cursor = (float("-inf"), "")
+        if after is not None:
+            cursor = self.cursor_of(after)
+            if cursor is None:
+                return
+        yield from self.iter_from(cursor, limit, page_size, **filters)
+
+    def cursor_of(self, job_id):
+        """(moved_at, id) keyset position of a DLQ entry, or None if it isn't here."""
+        return self.conn.execute("SELECT moved_at, id FROM dlq WHERE id=?", (job_id,)).fetchone()
+
+    def iter_from(self, cursor, limit=None, page_size=1000, **filters):
+        """iter_dlq() starting strictly after a (moved_at, id) cursor."""
+        where, params = dlq_filter(**filters)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            n = page_size if remaining is None else min(page_size, remaining)
+            rows = self.conn.execute(
+                f"SELECT {DLQ_COLUMNS} FROM dlq WHERE (moved_at, id) > (?, ?) AND {where} "
+                "ORDER BY moved_at, id LIMIT ?",
+                (*cursor, *params, n)
+            ).fetchall()
+            yield from rows
+            if len(rows) < n:
+                return
+            cursor = (rows[-1][5], rows[-1][0])
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def retry_where(self, **filters):
+        """Move every matching DLQ job back to pending in one transaction; returns how many moved."""
+        where, params = dlq_filter(**filters)
+        now = time.time()
         cur = self.conn.cursor()
-        cur.execute("SELECT * FROM dlq WHERE id=?", (job_id,))
-        job = cur.fetchone()
-        if not job:
-            print(f" No job found in DLQ with ID {job_id}")
-            return
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose row is still in `jobs` (normally as 'dead') are reset in place...
+            cur.execute(
+                f"UPDATE jobs SET state='pending', attempts=0, updated_at=?, next_run_at=0 "
+                f"WHERE id IN (SELECT id FROM dlq WHERE {where})",
+                (now, *params)
+            )
+            # ...and the rest (e.g. archived by gc) are recreated from the DLQ copy
+            cur.execute(
+                f"INSERT OR IGNORE INTO jobs (id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, "
+                f"priority, queue) "
+                f"SELECT id, command, 'pending', 0, max_retries, created_at, ?, 0, priority, queue FROM dlq WHERE {where}",
+                (now, *params)
+            )
+            cur.execute(f"DELETE FROM dlq WHERE {where}", params)
+            moved = cur.rowcount
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if moved:
+            self.wakeup.notify()
+        return moved
 
-        id_, command, attempts, max_retries, created_at, moved_at, error = job
-
-        cur.execute("SELECT id FROM jobs WHERE id=?", (id_,))
-        exists = cur.fetchone()
-
-        if exists:
-            cur.execute("""
-                UPDATE jobs
-                SET state='pending', attempts=0, updated_at=?, next_run_at=?
-                WHERE id=?
-            """, (time.time(), 0, id_))
-        else:
-            cur.execute("""
-                INSERT INTO jobs (id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority)
-                VALUES (?, ?, 'pending', 0, ?, ?, ?, 0, 1)
-            """, (id_, command, max_retries, created_at, time.time()))
-        cur.execute("DELETE FROM dlq WHERE id=?", (id_,))
+    def purge_where(self, **filters):
+        """Delete every matching DLQ entry in one transaction; returns how many were removed."""
+        where, params = dlq_filter(**filters)
+        cur = self.conn.execute(f"DELETE FROM dlq WHERE {where}", params)
         self.conn.commit()
+        return cur.rowcount
 
-        print(f"♻️ Retried DLQ job {id_} — moved back to queue.")
+    def retry_job(self, job_id):
+        if not self.retry_where(ids=[job_id]):
+            print(f" No job found in DLQ with ID {job_id}")
+            return
+        print(f"♻️ Retried DLQ job {job_id} — moved back to queue.")
@@ -1,13 +1,23 @@
-import click, time, uuid
-from tabulate import tabulate
-from job_store import JobStore
-from dlq import DLQ
+import click, time, json, os, sys
 from config import load_config, save_config
-from worker import Worker
 from datetime import datetime
-import threading
 
-store = JobStore()
+# Scripts run `flam.py enqueue` thousands of times, so startup stays lean:
+# workers, tabulate, the DLQ etc. are imported by the commands that use them,
+# and queue.db is opened on first use (never for --help or `config`).
+_store = None
+
+def get_store():
+    """The queue's JobStore, opened on first use."""
+    global _store
+    if _store is None:
+        from job_store import open_store
+        _store = open_store()
+    return _store
+
+def open_dlq():
+    from dlq import open_dlq
+    return open_dlq()
 
 @click.group()
 def cli():
@@ -15,11 +25,16 @@ def cli():
     pass
 
 @cli.command()
-@click.argument("command")
+@click.argument("command", required=False)
+@click.option("--python", "python_task", default=None, help="Run module:function in the worker's Python pool instead of a shell command")
+@click.option("--args", "task_args", default=None, help="JSON arguments for --python (object for kwargs, list for args)")
 @click.option("--max-retries", default=None, type=int, help="Max number of retries")
 @click.option("--priority", default=1, type=int, help="Job priority (1-5, higher = sooner)")
 @click.option("--run-at", default=None, help="Schedule time in UTC, format: YYYY-MM-DDTHH:MM:SSZ")
-def enqueue(command, max_retries, priority, run_at):
+@click.option("--idempotency-key", default=None, help="Enqueue at most one job per key")
+@click.option("--cache", is_flag=True, help="Reuse a recent successful run of the same command instead of executing")
+@click.option("--queue", default="default", help="Named queue to put the job on")
+def enqueue(command, python_task, task_args, max_retries, priority, run_at, idempotency_key, cache, queue):
     """
     Enqueue a new job with optional priority and scheduled time.
 
@@ -27,67 +42,189 @@ def enqueue(command, max_retries, priority, run_at):
       python flam.py enqueue "echo hello"
       python flam.py enqueue "echo urgent job" --priority 5
       python flam.py enqueue "echo delayed job" --run-at 2025-11-09T10:00:00Z
+      python flam.py enqueue "make report" --idempotency-key report-2025-11-09 --cache
+      python flam.py enqueue "./resize.sh big.png" --queue images
+      python flam.py enqueue --python mypkg.tasks:resize --args '{"path": "big.png"}'
     """
-    run_at_ts = 0
-    if run_at:
-        from datetime import datetime
+    try:
+        run_at_ts = parse_run_at(run_at)
+    except ValueError:
+        click.echo("❌ Invalid --run-at format. Use YYYY-MM-DDTHH:MM:SSZ (UTC).")
+        return
+    if (command is None) == (python_task is None):
+        click.echo("❌ Give either a COMMAND or --python module:function.")
+        return
+    if python_task:
+        from pytask import encode_task
         try:
-            run_at_ts = datetime.strptime(run_at, "%Y-%m-%dT%H:%M:%SZ").timestamp()
-        except ValueError:
-            click.echo("❌ Invalid --run-at format. Use YYYY-MM-DDTHH:MM:SSZ (UTC).")
+            command = encode_task(python_task, json.loads(task_args) if task_args else None)
+        except ValueError as e:
+            click.echo(f"❌ Invalid Python task: {e}")
             return
 
     cfg = load_config()
     mr = max_retries if max_retries is not None else cfg.get("max_retries", 3)
-    store.enqueue(command, max_retries=mr, priority=priority, run_at=run_at_ts)
+    get_store().enqueue(command, max_retries=mr, priority=priority, run_at=run_at_ts,
+                        idempotency_key=idempotency_key, cache=cache, queue=queue)
+
+def parse_run_at(run_at):
+    """Convert a YYYY-MM-DDTHH:MM:SSZ string (or a numeric timestamp) to epoch seconds."""
+    if not run_at:
+        return 0
+    if isinstance(run_at, (int, float)):
+        return float(run_at)
+    return datetime.strptime(run_at, "%Y-%m-%dT%H:%M:%SZ").timestamp()
+
+def parse_queues(spec):
+    """Parse 'a:3,b:1' (weight defaults to 1) into [("a", 3), ("b", 1)]; None means every queue."""
+    if not spec:
+        return None
+    queues = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if not name:
+            raise ValueError(spec)
+        queues.append((name, int(weight) if weight else 1))
+    return queues
+
+@cli.command("enqueue-batch")
+@click.argument("source", type=click.File("r"), default="-")
+@click.option("--max-retries", default=None, type=int, help="Default max retries for jobs that don't set one")
+@click.option("--priority", default=1, type=int, help="Default priority for jobs that don't set one")
+@click.option("--queue", default="default", help="Default queue for jobs that don't set one")
+@click.option("--chunk-size", default=1000, type=int, help="Jobs inserted per transaction")
+def enqueue_batch(source, max_retries, priority, queue, chunk_size):
+    """
+    Bulk-enqueue jobs from a file (or stdin), one job per line.
+
+    Lines are either plain commands or JSON objects with "command" (or
+    "python": "module:function" plus optional "args") and optional
+    "priority", "max_retries", "run_at", "idempotency_key", "cache" and
+    "queue" keys.
+
+    Examples:
+      python flam.py enqueue-batch jobs.txt
+      cat jobs.jsonl | python flam.py enqueue-batch
+    """
+    from pytask import encode_task
+    cfg = load_config()
+    mr = max_retries if max_retries is not None else cfg.get("max_retries", 3)
+
+    def parse_lines():
+        for lineno, line in enumerate(source, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    job = json.loads(line)
+                    if not isinstance(job, dict):
+                        raise ValueError("expected a JSON object")
+                    job["run_at"] = parse_run_at(job.get("run_at"))
+                    if "python" in job:
+                        if not isinstance(job["python"], str):
+                            raise ValueError('"python" must be a "module:function" string')
+                        if not isinstance(job.get("args", {}), (dict, list)):
+                            raise ValueError('"args" must be a JSON object or array')
+                        job["command"] = encode_task(job["python"], job.get("args"))
+                except ValueError as e:
+                    click.echo(f"⚠️ Skipping line {lineno}: {e}", err=True)
+                    continue
+                if "command" not in job:
+                    click.echo(f"⚠️ Skipping line {lineno}: missing \"command\" or \"python\"", err=True)
+                    continue
+                if not isinstance(job["command"], str) or not job["command"].strip():
+                    click.echo(f"⚠️ Skipping line {lineno}: \"command\" must be a non-empty string", err=True)
+                    continue
+            else:
+                job = {"command": line}
+            job.setdefault("max_retries", mr)
+            job.setdefault("priority", priority)
+            job.setdefault("queue", queue)
+            yield job
+
+    start = time.time()
+    count = 0
+    for job_id in get_store().enqueue_many(parse_lines(), chunk_size=chunk_size):
+        click.echo(job_id)
+        count += 1
+    elapsed = time.time() - start
+    rate = count / elapsed if elapsed > 0 else 0
+    click.echo(f"✅ Enqueued {count} jobs in {elapsed:.2f}s ({rate:.0f} rows/s)", err=True)
 
 @cli.command(name="list")
 @click.option("--state", default=None)
-def _list(state):
-    """List jobs (optionally by state)"""
-    rows = store.list_jobs(state)
-    if not rows:
-        click.echo("No jobs found.")
+@click.option("--priority", default=None, type=int, help="Only jobs with this priority")
+@click.option("--since", default=None, help="Created at or after this time (YYYY-MM-DDTHH:MM:SSZ)")
+@click.option("--until", default=None, help="Created before this time (YYYY-MM-DDTHH:MM:SSZ)")
+@click.option("--limit", default=0, type=int, help="Rows per page (0 streams every matching job)")
+@click.option("--after", default=None, help="Continue after this job ID (last ID of the previous page)")
+@click.option("--format", "fmt", type=click.Choice(["table", "jsonl", "csv"]), default="table")
+def _list(state, priority, since, until, limit, after, fmt):
+    """List jobs oldest first (optionally filtered), streaming rows as they are read"""
+    try:
+        filters = {"state": state, "priority": priority,
+                   "since": parse_run_at(since) if since else None, "until": parse_run_at(until) if until else None}
+    except ValueError:
+        click.echo("❌ Invalid --since/--until format. Use YYYY-MM-DDTHH:MM:SSZ (UTC).")
         return
+    from job_store import JOB_COLUMNS
+    rows = get_store().iter_jobs(limit=limit or None, after=after, **filters)
+    columns = [c.strip() for c in JOB_COLUMNS.split(",")]
+    shown, last = 0, None
 
-    def format_ts(ts):
-        try:
-            if not ts or ts == 0:
-                return ""
-            return datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
-        except:
-            return ts
-
-    formatted_rows = []
-    for r in rows:
-        id_, cmd, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_dur, last_exit = r
-        formatted_rows.append((
-            id_,
-            cmd,
-            state,
-            attempts,
-            max_retries,
-            format_ts(created_at),
-            format_ts(updated_at),
-            format_ts(next_run_at),
-            priority,
-            last_dur,
-            last_exit
-        ))
-
-    headers = [
-        "ID", "COMMAND", "STATE", "ATTEMPTS", "MAX_RETRIES",
-        "CREATED_AT (UTC)", "UPDATED_AT (UTC)", "NEXT_RUN_AT (UTC)",
-        "PRIORITY", "LAST_DUR", "LAST_EXIT"
-    ]
-    click.echo(tabulate(formatted_rows, headers=headers, tablefmt="github"))
+    if fmt == "jsonl":
+        for r in rows:
+            click.echo(json.dumps(dict(zip(columns, r))))
+            shown, last = shown + 1, r[0]
+    elif fmt == "csv":
+        import csv
+        out = csv.writer(sys.stdout)
+        out.writerow(columns)
+        for r in rows:
+            out.writerow(r)
+            shown, last = shown + 1, r[0]
+    else:
+        from tabulate import tabulate
+
+        def format_ts(ts):
+            try:
+                if not ts or ts == 0:
+                    return ""
+                return datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+            except:
+                return ts
+
+        headers = [
+            "ID", "COMMAND", "STATE", "ATTEMPTS", "MAX_RETRIES",
+            "CREATED_AT (UTC)", "UPDATED_AT (UTC)", "NEXT_RUN_AT (UTC)",
+            "PRIORITY", "LAST_DUR", "LAST_EXIT"
+        ]
+        # A small first block gets rows on screen at once; later blocks amortize tabulate
+        page, block = [], 50
+        for r in rows:
+            id_, cmd, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_dur, last_exit = r
+            page.append((id_, cmd, state, attempts, max_retries, format_ts(created_at), format_ts(updated_at),
+                         format_ts(next_run_at), priority, last_dur, last_exit))
+            if len(page) == block:
+                click.echo(tabulate(page, headers=headers if not shown else (), tablefmt="github"))
+                shown, last, page, block = shown + len(page), id_, [], 1000
+        if page:
+            click.echo(tabulate(page, headers=headers if not shown else (), tablefmt="github"))
+            shown, last = shown + len(page), page[-1][0]
+        if not shown:
+            click.echo("No jobs found.")
+
+    # Machine-readable output stays pure rows; the hint goes to stderr
+    if limit and shown == limit:
+        click.echo(f"... next page: --after {last}", err=fmt != "table")
 
 
 @cli.command()
 def status():
     """Show queue metrics and performance summary"""
-    m = store.metrics()
     from tabulate import tabulate
+    m = get_store().metrics()
     table = [
         ["total_jobs", m["total"]],
         ["completed", m["completed"]],
@@ -95,14 +232,109 @@ def status():
         ["avg_duration_s", round(m["avg_duration"], 3)],
         ["success_rate_%", round(m["success_rate"], 2)]
     ]
+    for name, key in (("duration", "duration_pct"), ("queue_wait", "queue_wait_pct")):
+        for q, v in m[key].items():
+            table.append([f"{name}_p{int(q * 100)}_s", "" if v is None else round(v, 3)])
     print(tabulate(table, headers=["metric", "value"], tablefmt="github"))
 
 @cli.command()
-@click.option("--count", default=1, help="Number of worker threads")
-def worker(count):
+@click.option("--since", default=None, help="Only runs finished at or after this time (YYYY-MM-DDTHH:MM:SSZ)")
+@click.option("--sort", type=click.Choice(["cpu", "wall", "rss", "io"]), default="cpu",
+              help="Rank by total CPU, total wall time, peak memory or total block I/O")
+@click.option("--limit", default=20, type=int, help="Command templates to show")
+def top(since, sort, limit):
+    """
+    Heaviest commands by CPU, memory and I/O, grouped by command template.
+
+    A run's max RSS includes memory it inherited: on Linux a shell job starts
+    from the worker's own peak at spawn (the image the child replaced on exec
+    counts), and a Python task from its pool process's peak. RSS FLOOR is the
+    largest such floor and AT FLOOR counts runs that never rose above it, which
+    used that much memory or less themselves.
+    """
+    from tabulate import tabulate
+    from rusage import top_commands
+    try:
+        since_ts = parse_run_at(since)
+    except ValueError:
+        click.echo("❌ Invalid --since format. Use YYYY-MM-DDTHH:MM:SSZ (UTC).")
+        return
+    ranked = top_commands(get_store().iter_usage(since_ts), sort, limit)
+    if not ranked:
+        click.echo("No runs with resource usage recorded yet.")
+        return
+
+    def pcts(group, metric, scale=1):
+        return " / ".join("-" if v is None else f"{v / scale:.2f}" for v in group.quantiles(metric).values())
+
+    table = []
+    for template, g in ranked:
+        table.append([
+            template if len(template) <= 60 else template[:57] + "...",
+            g.runs,
+            f"{g.cpu:.2f}",
+            pcts(g, "cpu"),
+            pcts(g, "wall"),
+            # Low means the command mostly waits (I/O, network, sleep) rather than computes
+            f"{100 * g.cpu / g.wall:.0f}" if g.wall else "-",
+            pcts(g, "rss", 1024) + f" / {g.max_rss_kb / 1024:.2f}",
+            pcts(g, "io"),
+            "-" if g.rss_floor_kb is None else f"{g.rss_floor_kb / 1024:.2f}",
+            f"{g.at_floor}/{g.runs}",
+        ])
+    headers = ["TEMPLATE", "RUNS", "CPU_S", "CPU p50/p95 (s)", "WALL p50/p95 (s)", "CPU%",
+               "RSS p50/p95/max (MiB)", "IO p50/p95 (blocks)", "RSS FLOOR (MiB)", "AT FLOOR"]
+    click.echo(tabulate(table, headers=headers, tablefmt="github"))
+
+@cli.command()
+@click.option("--count", "--threads", "count", default=1, help="Number of worker threads (per process with --processes)")
+@click.option("--processes", default=0, type=int, help="Run a supervisor with this many worker processes")
+@click.option("--async", "use_async", is_flag=True, help="Run jobs on an asyncio event loop instead of threads")
+@click.option("--concurrency", default=100, type=int, help="Max concurrent jobs with --async")
+@click.option("--queues", default=None, help="Queues to serve with weights, e.g. 'a:3,b:1' (default: all)")
+@click.option("--broker", default=None, help="Claim jobs from a `flam.py serve` broker at host:port instead of queue.db")
+def worker(count, processes, use_async, concurrency, queues, broker):
     """Start worker(s). Ctrl+C to stop gracefully."""
+    try:
+        queues = parse_queues(queues)
+    except ValueError:
+        click.echo("❌ Invalid --queues format. Use name:weight pairs, e.g. 'a:3,b:1'.")
+        return
+    if broker and (use_async or processes):
+        click.echo("❌ --broker runs threaded workers only; drop --async/--processes and start one worker per host.")
+        return
+    import threading
+    cfg = load_config()
+    if broker:
+        from broker import broker_token
+        if not broker_token(cfg):
+            click.echo("❌ --broker needs the broker's shared token: set broker_token in config.json or FLAM_BROKER_TOKEN.")
+            return
+    if processes > 0:
+        # Retention and the scheduler run in worker process 1: threads started here would be
+        # forked into every child mid-flight, locks and SQLite connection included
+        from supervisor import Supervisor
+        Supervisor(processes, count, queues=queues).run()
+        return
+    background_stop = threading.Event()
+    if not broker:
+        # A --broker worker has no queue.db to maintain; the broker fires schedules itself
+        from worker import start_background
+        start_background(cfg, background_stop)
+    if cfg.get("metrics_port", 0):
+        from instrumentation import start_sidecar
+        start_sidecar(cfg["metrics_port"])
+    if use_async:
+        from async_worker import AsyncWorker
+        AsyncWorker(concurrency, queues).run()
+        return
     stop_event = threading.Event()
-    workers = [Worker(i+1, stop_event) for i in range(count)]
+    if broker:
+        from broker import RemoteWorker
+        workers = [RemoteWorker(i+1, stop_event, broker, queues) for i in range(count)]
+    else:
+        from worker import Worker
+        workers = [Worker(i+1, stop_event, queues) for i in range(count)]
     for w in workers:
         w.start()
     try:
@@ -111,40 +343,294 @@ def worker(count):
     except KeyboardInterrupt:
         click.echo("\n🛑 Shutting down workers...")
         stop_event.set()
+        background_stop.set()
+        get_store().wakeup.notify_local()
         for w in workers:
             w.join()
         click.echo("🛑 All workers stopped.")
 
+@cli.command()
+@click.option("--host", default="127.0.0.1", help="Interface to listen on (default: this machine only)")
+@click.option("--port", default=8765, type=int)
+def serve(host, port):
+    """
+    Serve this queue.db to remote workers over HTTP (see `worker --broker`).
+
+    Every request must carry the shared token from broker_token in
+    config.json (or FLAM_BROKER_TOKEN). To reach workers on other hosts,
+    listen on the address they can reach on a trusted network; the token is
+    sent in clear text.
+    """
+    from broker import serve as serve_broker
+    try:
+        serve_broker(host, port)
+    except ValueError as e:
+        click.echo(f"❌ Cannot start: {e}.")
+
+@cli.command()
+@click.argument("job_id")
+@click.option("--tail", "tail_n", default=None, type=int, help="Only show the last N lines")
+@click.option("--follow", "-f", is_flag=True, help="Keep streaming output until the job finishes")
+def logs(job_id, tail_n, follow):
+    """Show a job's output from the log store."""
+    from log_store import open_log_store, tail_lines
+    store = get_store()
+    log_store = open_log_store(store)
+    out = sys.stdout.buffer
+
+    def show(chunks):
+        if tail_n is not None:
+            out.write(tail_lines(chunks, tail_n))
+            return
+        for chunk in chunks:
+            out.write(chunk)
+
+    active = log_store.active_path(job_id)
+    entry = log_store.lookup(job_id)
+    streamed = 0
+    if follow and os.path.exists(active):
+        # Job is running: the previous run's log isn't interesting
+        pass
+    else:
+        chunks = log_store.iter_chunks(job_id)
+        if chunks is None and not follow:
+            click.echo(f"No logs found for job {job_id}")
+            return
+        if chunks is not None:
+            show(chunks)
+    if not follow:
+        return
+
+    seen_rowid = entry[0] if entry else None
+    try:
+        while True:
+            if os.path.exists(active):
+                try:
+                    with open(active, "rb") as f:
+                        f.seek(streamed)
+                        data = f.read()
+                except FileNotFoundError:
+                    data = b""
+                out.write(data)
+                out.flush()
+                streamed += len(data)
+            else:
+                entry = log_store.lookup(job_id)
+                if entry and entry[0] != seen_rowid:
+                    # The run finished: print whatever the active file didn't have yet
+                    # (the stderr section and any truncated tail)
+                    seen_rowid = entry[0]
+                    skip = streamed
+                    for chunk in log_store.iter_chunks(job_id):
+                        if skip >= len(chunk):
+                            skip -= len(chunk)
+                            continue
+                        out.write(chunk[skip:])
+                        skip = 0
+                    out.flush()
+                    streamed = 0
+                job = store.get_job(job_id)
+                if job is None or job[2] in ("completed", "dead"):
+                    return
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+
+@cli.command("compact-logs")
+def compact_logs():
+    """Drop log segments that only hold purged jobs or superseded runs."""
+    from log_store import open_log_store
+    removed, freed = open_log_store(get_store()).compact()
+    click.echo(f"🧹 Removed {removed} log segments, freed {freed / 1024 / 1024:.1f} MiB")
+
+@cli.command()
+@click.option("--older-than", "older_than", default=None, type=float, help="Age in hours (default: retention_hours)")
+@click.option("--state", "states", multiple=True, default=["completed"], help="States to archive (repeatable)")
+@click.option("--vacuum", is_flag=True, help="Convert an older database to incremental vacuum with a full VACUUM (locks it while it runs)")
+def gc(older_than, states, vacuum):
+    """Archive old finished jobs, compact logs and reclaim database space."""
+    from retention import collect
+    cfg = load_config()
+    max_age = older_than * 3600 if older_than is not None else None
+    start = time.time()
+    stats = collect(get_store(), cfg, states=tuple(states), max_age=max_age, vacuum=vacuum)
+    click.echo(f"🧹 Archived {stats['archived']} jobs to archive/ in {time.time() - start:.2f}s, "
+               f"evicted {stats['cache_evicted']} cached results")
+    click.echo(f"🧹 Removed {stats['log_segments_removed']} log segments "
+               f"({stats['log_bytes_freed'] / 1024 / 1024:.1f} MiB), freed {stats['freed_pages']} DB pages, "
+               f"WAL checkpointed{' (busy)' if stats['wal_busy'] else ''}")
+    if stats["vacuum_needed"]:
+        click.echo("ℹ️ This database predates incremental vacuum, so no pages were freed. "
+                   "Run `flam.py gc --vacuum` once, while workers are idle, to convert it.")
+
+@cli.command()
+@click.option("--limit", default=1000, type=int, help="Most expired jobs to recover in one pass")
+def reap(limit):
+    """Recover processing jobs whose worker stopped heartbeating (retry or DLQ)."""
+    from lease import Reaper
+    n = Reaper(get_store(), load_config()).reap(limit)
+    click.echo(f"⏰ Recovered {n} jobs with expired leases." if n else "⏰ No expired leases.")
+
 # DLQ group
 @cli.group()
 def dlq():
     """DLQ commands"""
     pass
 
+def dlq_filters(f):
+    """Shared --error/--since/--until/--command-prefix options for DLQ commands."""
+    f = click.option("--command-prefix", default=None, help="Only jobs whose command starts with this")(f)
+    f = click.option("--until", default=None, help="Moved to the DLQ before this time (YYYY-MM-DDTHH:MM:SSZ)")(f)
+    f = click.option("--since", default=None, help="Moved to the DLQ at or after this time (YYYY-MM-DDTHH:MM:SSZ)")(f)
+    f = click.option("--error", default=None, help="Error GLOB pattern, e.g. 'ExitCode:*' or '*Timeout*'")(f)
+    return f
+
+def parse_dlq_filters(error, since, until, command_prefix):
+    """Filter kwargs for the DLQ methods, or None (after printing why) if a date is malformed."""
+    try:
+        return {
+            "error": error,
+            "since": parse_run_at(since) if since else None,
+            "until": parse_run_at(until) if until else None,
+            "command_prefix": command_prefix,
+        }
+    except ValueError:
+        click.echo("❌ Invalid --since/--until format. Use YYYY-MM-DDTHH:MM:SSZ (UTC).")
+        return None
+
 @dlq.command("list")
-def dlq_list():
-    jobs = DLQ().list_dlq()
-    if not jobs:
-        click.echo("☠️ DLQ is empty.")
+@click.option("--limit", default=50, type=int, help="Rows per page (0 streams the whole DLQ)")
+@click.option("--after", default=None, help="Continue after this job ID (last ID of the previous page)")
+@dlq_filters
+def dlq_list(limit, after, error, since, until, command_prefix):
+    """List DLQ jobs, oldest first, one page at a time."""
+    from tabulate import tabulate
+    filters = parse_dlq_filters(error, since, until, command_prefix)
+    if filters is None:
         return
+    rows = open_dlq().iter_dlq(limit=limit or None, after=after, **filters)
     headers = ["ID","COMMAND","ATTEMPTS","MAX_RETRIES","CREATED_AT","MOVED_AT","ERROR"]
-    click.echo(tabulate(jobs, headers=headers))
+    shown, last, page = 0, None, []
+    for row in rows:
+        page.append(row)
+        if len(page) == 1000:
+            # Stream large listings in blocks instead of holding the whole DLQ in memory
+            click.echo(tabulate(page, headers=headers if not shown else ()))
+            shown += len(page)
+            last = page[-1][0]
+            page = []
+    if page:
+        click.echo(tabulate(page, headers=headers if not shown else ()))
+        shown += len(page)
+        last = page[-1][0]
+    if not shown:
+        click.echo("☠️ DLQ is empty." if not after and not any(filters.values()) else "☠️ No matching DLQ jobs.")
+    elif limit and shown == limit:
+        click.echo(f"... next page: --after {last}")
 
 @dlq.command("retry")
 @click.argument("job_id")
 def dlq_retry(job_id):
-    DLQ().retry_job(job_id)
+    open_dlq().retry_job(job_id)
 
 @dlq.command("retry-all")
-def dlq_retry_all():
-    dlq = DLQ()
-    jobs = dlq.list_dlq()
-    if not jobs:
-        click.echo("☠️ DLQ is empty.")
+@dlq_filters
+def dlq_retry_all(error, since, until, command_prefix):
+    """Move every (matching) DLQ job back to the queue in one transaction."""
+    filters = parse_dlq_filters(error, since, until, command_prefix)
+    if filters is None:
+        return
+    moved = open_dlq().retry_where(**filters)
+    if not moved:
+        click.echo("☠️ No matching DLQ jobs.")
+        return
+    click.echo(f"♻️ Retried {moved} DLQ jobs — moved back to queue.")
+
+@dlq.command("purge")
+@dlq_filters
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation")
+def dlq_purge(error, since, until, command_prefix, yes):
+    """Permanently delete every (matching) DLQ job in one transaction."""
+    filters = parse_dlq_filters(error, since, until, command_prefix)
+    if filters is None:
+        return
+    if not yes and not click.confirm("Delete matching DLQ jobs? This cannot be undone"):
         return
-    for j in jobs:
-        dlq.retry_job(j[0])
-    click.echo(f"♻️ Retried {len(jobs)} DLQ jobs — moved back to queue.")
+    click.echo(f"🗑️ Purged {open_dlq().purge_where(**filters)} DLQ jobs.")
+
+@cli.group()
+def schedule():
+    """Recurring jobs (cron expressions, UTC)"""
+    pass
+
+@schedule.command("add")
+@click.argument("cron")
+@click.argument("command")
+@click.option("--max-retries", default=None, type=int, help="Max number of retries")
+@click.option("--priority", default=1, type=int, help="Job priority (1-5, higher = sooner)")
+@click.option("--queue", default="default", help="Named queue to put the jobs on")
+@click.option("--no-catchup", is_flag=True, help="After downtime fire once, not once per missed time")
+def schedule_add(cron, command, max_retries, priority, queue, no_catchup):
+    """
+    Enqueue COMMAND every time CRON (minute hour day month weekday, UTC) matches.
+
+    Running workers fire schedules; see the `scheduler` config key.
+
+    Examples:
+      python flam.py schedule add "*/5 * * * *" "./sync.sh"
+      python flam.py schedule add "0 3 * * mon-fri" "make report" --queue reports
+      python flam.py schedule add @hourly "python rotate.py" --no-catchup
+    """
+    from scheduler import Schedules, format_utc
+    cfg = load_config()
+    mr = max_retries if max_retries is not None else cfg.get("max_retries", 3)
+    try:
+        schedule_id, next_fire_at = Schedules(get_store()).add(cron, command, queue, priority, mr, not no_catchup)
+    except ValueError as e:
+        click.echo(f"❌ Invalid cron expression: {e}")
+        return
+    click.echo(f"🗓️ Schedule {schedule_id} added; first run at {format_utc(next_fire_at)}")
+
+@schedule.command("list")
+def schedule_list():
+    from tabulate import tabulate
+    from scheduler import Schedules, format_utc
+    rows = [(sid, cron, command, queue, priority, "active" if enabled else "paused", format_utc(next_fire_at),
+             format_utc(last_fire_at))
+            for sid, cron, command, queue, priority, enabled, next_fire_at, last_fire_at in Schedules(get_store()).list()]
+    if not rows:
+        click.echo("🗓️ No schedules.")
+        return
+    click.echo(tabulate(rows, headers=["ID", "CRON", "COMMAND", "QUEUE", "PRIORITY", "STATE", "NEXT_RUN", "LAST_RUN"]))
+
+@schedule.command("remove")
+@click.argument("schedule_id")
+def schedule_remove(schedule_id):
+    """Delete a schedule (jobs it already enqueued are kept)."""
+    from scheduler import Schedules
+    if Schedules(get_store()).remove(schedule_id):
+        click.echo(f"🗑️ Schedule {schedule_id} removed.")
+    else:
+        click.echo(f"❌ No schedule {schedule_id}.")
+
+@schedule.command("pause")
+@click.argument("schedule_id")
+def schedule_pause(schedule_id):
+    from scheduler import Schedules
+    if Schedules(get_store()).pause(schedule_id):
+        click.echo(f"⏸️ Schedule {schedule_id} paused.")
+    else:
+        click.echo(f"❌ No schedule {schedule_id}.")
+
+@schedule.command("resume")
+@click.argument("schedule_id")
+def schedule_resume(schedule_id):
+    """Re-enable a paused schedule; runs missed while paused are skipped."""
+    from scheduler import Schedules
+    if Schedules(get_store()).resume(schedule_id):
+        click.echo(f"▶️ Schedule {schedule_id} resumed.")
+    else:
+        click.echo(f"❌ No paused schedule {schedule_id}.")
 
 @cli.group()
 def config():
@@ -167,6 +653,13 @@ def config_set(key, value):
         cfg[key] = int(value)
     except:
         cfg[key] = value
+    if isinstance(cfg[key], str) and value.lstrip().startswith("{"):
+        # Dict-valued keys such as queue_limits: config set queue_limits '{"slow": 2}'
+        try:
+            cfg[key] = json.loads(value)
+        except ValueError:
+            click.echo(f"⚠️ Invalid JSON for {key}: {value}")
+            return
     save_config(cfg)
     click.echo(f"✅ Updated {key} to {value}")
 
@@ -0,0 +1,112 @@
+import atexit, os, queue, sqlite3, threading, time
+from concurrent.futures import Future
+from job_store import connect
+from instrumentation import timed, COMMITS_TOTAL, WRITES_TOTAL
+
+
+class GroupWriter(threading.Thread):
+    """
+    One connection per process and database that commits every thread's writes in groups.
+
+    Threads submit() functions of a connection. Write-behind writes return at
+    once and wait up to `latency` seconds for company; a write somebody waits
+    for (a claim, an enqueue) is committed straight away together with
+    everything queued before it. Each group is one BEGIN IMMEDIATE ... COMMIT,
+    and each write runs in its own savepoint so a failing write doesn't take
+    the others down.
+
+    Write-behind writes from the last `latency` seconds are lost if the
+    process dies; the jobs they finished are still 'processing' and are
+    recovered when their lease runs out.
+    """
+
+    def __init__(self, db_path, wakeup, latency=0.005, max_writes=1000):
+        super().__init__(daemon=True, name="flam-writer")
+        self.conn = connect(db_path)
+        self.wakeup = wakeup
+        self.latency = latency
+        self.max_writes = max_writes
+        self.writes = queue.SimpleQueue()
+
+    def submit(self, fn, wait=False, notify=False):
+        future = Future() if wait else None
+        self.writes.put((fn, future, notify))
+        return future.result() if future else None
+
+    def flush(self):
+        """Block until everything submitted so far is committed."""
+        if self.is_alive():
+            self.submit(lambda conn: None, wait=True)
+
+    def run(self):
+        while True:
+            group = [self.writes.get()]
+            deadline = time.monotonic() + self.latency
+            while group[-1][1] is None and len(group) < self.max_writes:
+                try:
+                    group.append(self.writes.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            # Whatever else is already queued rides along
+            while len(group) < self.max_writes:
+                try:
+                    group.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(group)
+
+    def _commit(self, group):
+        with timed("group_commit"):
+            while True:
+                try:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    break
+                except sqlite3.OperationalError as e:
+                    # Still locked after busy_timeout: keep the group and try again
+                    print(f"⚠️ Group commit waiting for the write lock: {e}")
+            results = []
+            for fn, future, notify in group:
+                self.conn.execute("SAVEPOINT write")
+                try:
+                    results.append((future, fn(self.conn), None))
+                except Exception as e:
+                    self.conn.execute("ROLLBACK TO write")
+                    results.append((future, None, e))
+                    if future is None:
+                        print(f"⚠️ Write-behind write failed: {e}")
+                self.conn.execute("RELEASE write")
+            try:
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                print(f"⚠️ Group commit of {len(group)} writes failed: {e}")
+                results = [(future, None, e) for future, _, _ in results]
+        COMMITS_TOTAL.inc()
+        WRITES_TOTAL.inc(len(group))
+        if any(notify for _, _, notify in group):
+            self.wakeup.notify()
+        for future, result, error in results:
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path, wakeup, config):
+    """Return this process's running GroupWriter for db_path."""
+    key = (os.path.abspath(db_path), os.getpid())
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = GroupWriter(db_path, wakeup, config.get("group_commit_ms", 5) / 1000,
+                                                 config.get("group_commit_max_writes", 1000))
+            writer.start()
+            # Write-behind writes still queued at a clean exit are committed first
+            atexit.register(writer.flush)
+        return writer
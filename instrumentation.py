@@ -0,0 +1,133 @@
+import bisect, threading, time
+from contextlib import contextmanager
+
+# Seconds; wide enough for both a SQLite commit and a slow job
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _labels(key):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}" if key else ""
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.lock = threading.Lock()
+        self.series = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # labels -> [per-bucket counts (last slot is +Inf), sum, count]
+        self.series = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_labels(key)} {count}")
+        return lines
+
+
+STEP_SECONDS = Histogram("flam_step_seconds", "Time spent in worker hot-path steps")
+QUEUE_WAIT_SECONDS = Histogram("flam_queue_wait_seconds", "Time from a job becoming due until a worker starts it")
+JOBS_TOTAL = Counter("flam_jobs_total", "Job runs finished by this process, by outcome")
+COMMITS_TOTAL = Counter("flam_group_commits_total", "SQLite transactions committed by this process's group-commit writers")
+WRITES_TOTAL = Counter("flam_group_commit_writes_total", "Writes (claims, state changes, log index rows...) in those commits")
+
+
+@contextmanager
+def timed(step):
+    """Record how long the enclosed block takes under flam_step_seconds{step=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STEP_SECONDS.observe(time.perf_counter() - start, step=step)
+
+
+def render():
+    """All metrics registered in this process, in Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def render_queue_metrics(store):
+    """Queue-wide gauges and quantiles read from a JobStore, in Prometheus text format."""
+    m = store.metrics()
+    lines = ["# HELP flam_jobs Jobs currently in each state", "# TYPE flam_jobs gauge"]
+    lines += [f'flam_jobs{{state="{state}"}} {n}' for state, n in sorted(m["states"].items())]
+    lines += ["# HELP flam_dlq_jobs Jobs in the dead letter queue", "# TYPE flam_dlq_jobs gauge",
+              f"flam_dlq_jobs {store.dlq_count()}"]
+    # Whole-queue percentiles from the stored sketches, so they cover every worker
+    for metric, key in (("duration", "duration_pct"), ("queue_wait", "queue_wait_pct")):
+        name = f"flam_job_{metric}_seconds"
+        lines += [f"# HELP {name} Job {metric.replace('_', ' ')} across all workers", f"# TYPE {name} summary"]
+        lines += [f'{name}{{quantile="{q}"}} {v}' for q, v in m[key].items() if v is not None]
+    return "\n".join(lines) + "\n"
+
+
+def start_sidecar(port, host="127.0.0.1"):
+    """Serve this process's metrics on http://host:port/metrics from a daemon thread."""
+    # Imported here: every `flam.py` command imports this module, few serve metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Worker metrics on http://{host}:{port}/metrics")
+    return server
@@ -1,16 +1,312 @@
-import sqlite3, time, uuid, os
+import sqlite3, time, uuid, hashlib
+from notify import get_wakeup
+import sketch
+from instrumentation import timed
 
 DB_PATH = "queue.db"
 
+JOB_COLUMNS = "id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_duration, last_exit_code"
+# Resource usage of a job's last run (see rusage.py), as small integers; NULL when unknown
+USAGE_COLUMNS = "cpu_user_ms, cpu_sys_ms, max_rss_kb, io_read_blocks, io_write_blocks, rss_floor_kb"
+USAGE_SET = ", ".join(f"{c.strip()}=?" for c in USAGE_COLUMNS.split(","))
+NO_USAGE = (None,) * len(USAGE_COLUMNS.split(","))
+
+# Indexes managed by JobStore. New databases get them in _create_tables and
+# existing queue.db files are migrated to them in _ensure_columns.
+# Bump SCHEMA_VERSION whenever these, the tables or their columns change.
+INDEXES = {
+    # Claim path: walked in priority order, next_run_at filtered from the index itself
+    "idx_jobs_claim": "CREATE INDEX IF NOT EXISTS idx_jobs_claim "
+                      "ON jobs(state, priority DESC, created_at, next_run_at)",
+    # Named queues: per-queue claim order and in-flight counts (queue, 'processing')
+    "idx_jobs_queue_claim": "CREATE INDEX IF NOT EXISTS idx_jobs_queue_claim "
+                            "ON jobs(queue, state, priority DESC, created_at, next_run_at)",
+    # list_jobs(state), per-state counts and page_jobs(state=...) keyset pages
+    "idx_jobs_state_created_id": "CREATE INDEX IF NOT EXISTS idx_jobs_state_created_id ON jobs(state, created_at, id)",
+    # list_jobs() and page_jobs() (the dashboard's jobs table)
+    "idx_jobs_created_id": "CREATE INDEX IF NOT EXISTS idx_jobs_created_id ON jobs(created_at, id)",
+    # next_due_at(): earliest scheduled pending job, so idle workers know how long to sleep
+    "idx_jobs_due": "CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(state, next_run_at)",
+    # Reaper: processing jobs whose lease has run out
+    "idx_jobs_lease": "CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(state, lease_expires_at)",
+    # Retention (retention.py): finished jobs by age
+    "idx_jobs_state_updated": "CREATE INDEX IF NOT EXISTS idx_jobs_state_updated ON jobs(state, updated_at)",
+    # enqueue(idempotency_key=...): duplicates collapse at insert time
+    "idx_jobs_idempotency": "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_idempotency "
+                            "ON jobs(idempotency_key) WHERE idempotency_key IS NOT NULL",
+    # Result cache eviction by age
+    "idx_result_cache_created": "CREATE INDEX IF NOT EXISTS idx_result_cache_created ON result_cache(created_at)",
+    # DLQ paging (keyset on moved_at, id) and time-range filters
+    "idx_dlq_moved": "CREATE INDEX IF NOT EXISTS idx_dlq_moved ON dlq(moved_at, id)",
+    # DLQ filters by exact error or error prefix (GLOB 'ExitCode:*')
+    "idx_dlq_error": "CREATE INDEX IF NOT EXISTS idx_dlq_error ON dlq(error)",
+    # LogStore.lookup() and compaction
+    "idx_log_index_job": "CREATE INDEX IF NOT EXISTS idx_log_index_job ON log_index(job_id)",
+    "idx_log_index_segment": "CREATE INDEX IF NOT EXISTS idx_log_index_segment ON log_index(segment)",
+}
+
+# Per-state counters and duration totals maintained by triggers in the same
+# transaction as every jobs write, so metrics() never scans the jobs table.
+METRICS_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS job_counts (state TEXT PRIMARY KEY, n INTEGER NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS job_stats (id INTEGER PRIMARY KEY CHECK (id = 1), "
+    "duration_sum REAL NOT NULL DEFAULT 0, duration_count INTEGER NOT NULL DEFAULT 0)",
+    # Quantile sketches (see sketch.py): 'duration' and 'queue_wait' samples per log bucket
+    "CREATE TABLE IF NOT EXISTS metric_buckets (metric TEXT NOT NULL, bucket INTEGER NOT NULL, "
+    "n INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (metric, bucket))",
+    """CREATE TRIGGER IF NOT EXISTS trg_jobs_insert AFTER INSERT ON jobs BEGIN
+        INSERT INTO job_counts (state, n) VALUES (NEW.state, 1)
+            ON CONFLICT(state) DO UPDATE SET n = n + 1;
+        UPDATE job_stats SET
+            duration_sum = duration_sum + MAX(COALESCE(NEW.last_duration, 0), 0),
+            duration_count = duration_count + (COALESCE(NEW.last_duration, 0) > 0);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_jobs_delete AFTER DELETE ON jobs BEGIN
+        UPDATE job_counts SET n = n - 1 WHERE state = OLD.state;
+        UPDATE job_stats SET
+            duration_sum = duration_sum - MAX(COALESCE(OLD.last_duration, 0), 0),
+            duration_count = duration_count - (COALESCE(OLD.last_duration, 0) > 0);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_jobs_state AFTER UPDATE OF state ON jobs
+    WHEN OLD.state IS NOT NEW.state BEGIN
+        UPDATE job_counts SET n = n - 1 WHERE state = OLD.state;
+        INSERT INTO job_counts (state, n) VALUES (NEW.state, 1)
+            ON CONFLICT(state) DO UPDATE SET n = n + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS trg_jobs_duration AFTER UPDATE OF last_duration ON jobs
+    WHEN OLD.last_duration IS NOT NEW.last_duration BEGIN
+        UPDATE job_stats SET
+            duration_sum = duration_sum - MAX(COALESCE(OLD.last_duration, 0), 0)
+                                        + MAX(COALESCE(NEW.last_duration, 0), 0),
+            duration_count = duration_count - (COALESCE(OLD.last_duration, 0) > 0)
+                                            + (COALESCE(NEW.last_duration, 0) > 0);
+    END""",
+]
+
+SAMPLE_SQL = ("INSERT INTO metric_buckets (metric, bucket, n) VALUES (?, ?, 1) "
+              "ON CONFLICT(metric, bucket) DO UPDATE SET n = n + 1")
+
+# The unary + keeps the planner from picking idx_jobs_due (range on next_run_at,
+# then sort) over the claim index, which yields rows already in priority order.
+# Both claim queries also return the job's queue after JOB_COLUMNS, for per-queue limits.
+CLAIM_SQL = (
+    f"SELECT {JOB_COLUMNS}, queue FROM jobs "
+    "WHERE state='pending' AND +next_run_at <= ? "
+    "ORDER BY priority DESC, created_at ASC LIMIT ?"
+)
+
+# One named queue, in the same order; OFFSET skips rows already taken this claim
+QUEUE_CLAIM_SQL = (
+    f"SELECT {JOB_COLUMNS}, queue FROM jobs "
+    "WHERE queue=? AND state='pending' AND +next_run_at <= ? "
+    "ORDER BY priority DESC, created_at ASC LIMIT ? OFFSET ?"
+)
+
+# A row whose idempotency_key is already taken (idx_jobs_idempotency) is skipped; any
+# other constraint failure, e.g. a NULL command, raises instead of vanishing like OR IGNORE
+ENQUEUE_SQL = """
+    INSERT INTO jobs (id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority,
+                      idempotency_key, cache_key, queue)
+    VALUES (?, ?, 'pending', 0, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING"""
+
+# Seconds a claimed job stays leased without a heartbeat (config: lease_timeout)
+DEFAULT_LEASE = 60
+
+# Result cache evictions run once per this many cache writes per connection
+CACHE_EVICT_EVERY = 256
+
+
+def cache_key_for(command):
+    """Result-cache key of a command: identical command strings share cached results."""
+    return hashlib.sha1(command.encode()).hexdigest()
+
+
+def job_row(job):
+    """ENQUEUE_SQL parameters for a command string or an enqueue_many() dict, with a new job id."""
+    if isinstance(job, str):
+        job = {"command": job}
+    now = time.time()
+    return (str(uuid.uuid4()), job["command"], job.get("max_retries", 3), now, now,
+            job.get("run_at") or 0, job.get("priority", 1), job.get("idempotency_key"),
+            cache_key_for(job["command"]) if job.get("cache") else None,
+            job.get("queue") or "default")
+
+
+# Stored in the database's PRAGMA user_version once it is created or migrated;
+# opening a database already at this version skips the migration probes.
+SCHEMA_VERSION = 5
+
+# Every state a job can be in; changed_since() names them all so idx_jobs_state_updated applies
+STATES = ("pending", "processing", "completed", "failed", "dead")
+
+# Hot queries that must stay index-backed, checked by JobStore.check_query_plans()
+HOT_QUERIES = {
+    "claim": (CLAIM_SQL, (0, 1)),
+    "claim_queue": (QUEUE_CLAIM_SQL, ("default", 0, 1, 0)),
+    "expired_leases": (f"SELECT {JOB_COLUMNS}, worker_id FROM jobs WHERE state='processing' AND lease_expires_at < ? LIMIT ?",
+                       (0, 1)),
+    "queue_in_flight": ("SELECT COUNT(*) FROM jobs WHERE queue=? AND state='processing'", ("default",)),
+    "jobs_from": (f"SELECT {JOB_COLUMNS} FROM jobs WHERE (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?",
+                  (0, "", 1)),
+    "jobs_from_state": (f"SELECT {JOB_COLUMNS} FROM jobs WHERE state=? AND (created_at, id) > (?, ?) "
+                        "ORDER BY created_at, id LIMIT ?", ("pending", 0, "", 1)),
+    "count_by_state": ("SELECT COUNT(*) FROM jobs WHERE state=?", ("completed",)),
+    "next_due": ("SELECT MIN(next_run_at) FROM jobs WHERE state='pending'", ()),
+    "jobs_page": (f"SELECT {JOB_COLUMNS} FROM jobs WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+                  (0, "", 1)),
+    "jobs_page_state": (f"SELECT {JOB_COLUMNS} FROM jobs WHERE state=? AND (created_at, id) < (?, ?) "
+                        "ORDER BY created_at DESC, id DESC LIMIT ?", ("pending", 0, "", 1)),
+    "changed_since": (f"SELECT {JOB_COLUMNS} FROM jobs WHERE state IN ({','.join('?' for _ in STATES)}) AND updated_at > ? LIMIT ?",
+                      (*STATES, 0, 1)),
+    "usage_since": (f"SELECT command, last_duration, {USAGE_COLUMNS} FROM jobs "
+                    f"WHERE state IN ({','.join('?' for _ in STATES)}) AND updated_at >= ? AND cpu_user_ms IS NOT NULL",
+                    (*STATES, 0)),
+    "retention": (f"SELECT {JOB_COLUMNS} FROM jobs WHERE state IN (?) AND updated_at < ? LIMIT ?", ("completed", 0, 1)),
+    "schedules_due": ("SELECT id FROM schedules WHERE enabled=1 AND next_fire_at <= ? ORDER BY next_fire_at LIMIT ?",
+                      (0, 1)),
+    "next_fire": ("SELECT MIN(next_fire_at) FROM schedules WHERE enabled=1", ()),
+    "dlq_page": ("SELECT id FROM dlq WHERE (moved_at, id) > (?, ?) ORDER BY moved_at, id LIMIT ?", (0, "", 1)),
+    "dlq_by_error": ("SELECT id FROM dlq WHERE error GLOB ?", ("ExitCode:*",)),
+}
+
+# Write lock waits (ms) before "database is locked"
+BUSY_TIMEOUT_MS = 10000
+
+
+def connect(db_path):
+    """
+    A SQLite connection with the pragmas every FLAM connection uses.
+
+    In WAL mode synchronous=NORMAL only syncs at checkpoints: a power cut can
+    lose the last few commits but never corrupts the database, and jobs whose
+    completion was lost are recovered when their lease runs out.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+
+def enable_wal(conn):
+    """
+    Switch a database to WAL mode, waiting for other openers doing the same.
+
+    The switch needs an exclusive lock, and while a new file is still in
+    rollback-journal mode SQLite reports "database is locked" at once, without
+    the busy timeout, if another opener holds its write lock.
+    """
+    deadline = time.monotonic() + BUSY_TIMEOUT_MS / 1000
+    while True:
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            return
+        except sqlite3.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+def open_store(db_path=DB_PATH, config=None, group_commit=False):
+    """
+    The store for db_path: a JobStore, or a ShardedJobStore when config "shards" is above 1.
+
+    With group_commit (and group_commit_ms above 0) writes go through this
+    process's GroupWriter for the database instead of committing one by one.
+    """
+    if config is None:
+        from config import load_config
+        config = load_config()
+    if config.get("shards", 1) > 1:
+        from shards import ShardedJobStore
+        store = ShardedJobStore(db_path, config["shards"], config.get("shard_by", "job"),
+                                config.get("shard_claim", "round_robin"))
+    else:
+        store = JobStore(db_path)
+    if group_commit and config.get("group_commit_ms", 5) > 0:
+        from group_commit import get_writer
+        for shard in getattr(store, "shards", [store]):
+            shard.writer = get_writer(shard.db_path, shard.wakeup, config)
+    return store
+
+
+def job_filter(state=None, priority=None, since=None, until=None):
+    """
+    Build a WHERE clause (and its parameters) selecting jobs.
+
+    since/until bound created_at in epoch seconds.
+    """
+    clauses, params = [], []
+    if state is not None:
+        clauses.append("state = ?")
+        params.append(state)
+    if priority is not None:
+        clauses.append("priority = ?")
+        params.append(priority)
+    if since is not None:
+        clauses.append("created_at >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("created_at < ?")
+        params.append(until)
+    return " AND ".join(clauses) or "1", params
+
+
+def summarize(counts, duration_sum, duration_count, duration_buckets, wait_buckets):
+    """The metrics() dict from per-state counts, duration totals and sketch buckets."""
+    total = sum(counts.values())
+    completed = counts.get("completed", 0)
+    dead = counts.get("dead", 0)
+    avg_dur = duration_sum / duration_count if duration_count else 0
+    success_rate = (completed / (completed + dead)) * 100 if (completed + dead) > 0 else 0
+    qs = (0.5, 0.95, 0.99)
+    return {
+        "total": total,
+        "completed": completed,
+        "dead": dead,
+        "avg_duration": avg_dur,
+        "success_rate": success_rate,
+        "states": counts,
+        "duration_pct": sketch.quantiles(duration_buckets, qs),
+        "queue_wait_pct": sketch.quantiles(wait_buckets, qs)
+    }
+
+
 class JobStore:
-    def __init__(self, db_path=DB_PATH):
-        need_init = not os.path.exists(db_path)
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.conn.execute('PRAGMA journal_mode=WAL;')
-        if need_init:
-            self._create_tables()
-        else:
-            self._ensure_columns()
+    def __init__(self, db_path=DB_PATH, wakeup_path=None):
+        self.db_path = db_path
+        # Shards of one queue share the wakeup of the queue's main path
+        self.wakeup = get_wakeup(wakeup_path or db_path)
+        self._cache_writes = 0
+        # Smooth weighted round-robin credit per queue, carried across claim() calls
+        self._queue_credit = {}
+        # Whether the last claim left due jobs behind because of queue limits
+        self.limited = False
+        # GroupWriter taking this store's writes (see open_store); None commits them directly
+        self.writer = None
+        # Reads use this connection, which is never shared with another worker thread
+        self.conn = connect(db_path)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            # Already migrated (and in WAL mode, which persists): one header read instead of
+            # table_info probes and a write transaction on every open
+            return
+        # Lets `flam.py gc` return freed pages with incremental_vacuum; only takes effect
+        # before the first table is created, and neither pragma can run inside a transaction
+        self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL;')
+        enable_wal(self.conn)
+        # Processes opening a new queue.db together: the first creates the schema under
+        # the write lock, the others find it (and the version) already there
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='jobs'").fetchone():
+                    self._ensure_columns()
+                else:
+                    self._create_tables()
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
 
     def _create_tables(self):
         self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
@@ -24,7 +320,19 @@ class JobStore:
             next_run_at REAL DEFAULT 0,
             priority INTEGER DEFAULT 1,
             last_duration REAL DEFAULT 0,
-            last_exit_code INTEGER DEFAULT NULL
+            last_exit_code INTEGER DEFAULT NULL,
+            worker_id TEXT DEFAULT NULL,
+            leased_at REAL DEFAULT NULL,
+            idempotency_key TEXT DEFAULT NULL,
+            cache_key TEXT DEFAULT NULL,
+            queue TEXT NOT NULL DEFAULT 'default',
+            lease_expires_at REAL DEFAULT NULL,
+            cpu_user_ms INTEGER DEFAULT NULL,
+            cpu_sys_ms INTEGER DEFAULT NULL,
+            max_rss_kb INTEGER DEFAULT NULL,
+            io_read_blocks INTEGER DEFAULT NULL,
+            io_write_blocks INTEGER DEFAULT NULL,
+            rss_floor_kb INTEGER DEFAULT NULL
         )''')
         self.conn.execute('''CREATE TABLE IF NOT EXISTS dlq (
             id TEXT PRIMARY KEY,
@@ -33,9 +341,16 @@ class JobStore:
             max_retries INTEGER,
             created_at REAL,
             moved_at REAL,
-            error TEXT
+            error TEXT,
+            queue TEXT NOT NULL DEFAULT 'default',
+            priority INTEGER DEFAULT 1
         )''')
-        self.conn.commit()
+        self._create_log_index()
+        self._create_result_cache()
+        self._create_schedules()
+        self._ensure_metrics()
+        self._ensure_indexes()
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
 
     def _ensure_columns(self):
         cur = self.conn.cursor()
@@ -45,7 +360,19 @@ class JobStore:
             "priority": "ALTER TABLE jobs ADD COLUMN priority INTEGER DEFAULT 1",
             "next_run_at": "ALTER TABLE jobs ADD COLUMN next_run_at REAL DEFAULT 0",
             "last_duration": "ALTER TABLE jobs ADD COLUMN last_duration REAL DEFAULT 0",
-            "last_exit_code": "ALTER TABLE jobs ADD COLUMN last_exit_code INTEGER DEFAULT NULL"
+            "last_exit_code": "ALTER TABLE jobs ADD COLUMN last_exit_code INTEGER DEFAULT NULL",
+            "worker_id": "ALTER TABLE jobs ADD COLUMN worker_id TEXT DEFAULT NULL",
+            "leased_at": "ALTER TABLE jobs ADD COLUMN leased_at REAL DEFAULT NULL",
+            "idempotency_key": "ALTER TABLE jobs ADD COLUMN idempotency_key TEXT DEFAULT NULL",
+            "cache_key": "ALTER TABLE jobs ADD COLUMN cache_key TEXT DEFAULT NULL",
+            "queue": "ALTER TABLE jobs ADD COLUMN queue TEXT NOT NULL DEFAULT 'default'",
+            "lease_expires_at": "ALTER TABLE jobs ADD COLUMN lease_expires_at REAL DEFAULT NULL",
+            "cpu_user_ms": "ALTER TABLE jobs ADD COLUMN cpu_user_ms INTEGER DEFAULT NULL",
+            "cpu_sys_ms": "ALTER TABLE jobs ADD COLUMN cpu_sys_ms INTEGER DEFAULT NULL",
+            "max_rss_kb": "ALTER TABLE jobs ADD COLUMN max_rss_kb INTEGER DEFAULT NULL",
+            "io_read_blocks": "ALTER TABLE jobs ADD COLUMN io_read_blocks INTEGER DEFAULT NULL",
+            "io_write_blocks": "ALTER TABLE jobs ADD COLUMN io_write_blocks INTEGER DEFAULT NULL",
+            "rss_floor_kb": "ALTER TABLE jobs ADD COLUMN rss_floor_kb INTEGER DEFAULT NULL"
         }
         for col, stmt in expected.items():
             if col not in cols:
@@ -53,53 +380,520 @@ class JobStore:
                     self.conn.execute(stmt)
                 except Exception:
                     pass
-        self.conn.commit()
+        if "lease_expires_at" not in cols:
+            # Jobs left 'processing' by workers from before leases get one lease from their last update
+            self.conn.execute("UPDATE jobs SET lease_expires_at = COALESCE(leased_at, updated_at, 0) + ? "
+                              "WHERE state='processing'", (DEFAULT_LEASE,))
+        # The claim index filters on next_run_at <= ?, which never matches NULL
+        self.conn.execute("UPDATE jobs SET next_run_at=0 WHERE next_run_at IS NULL")
+        dlq_cols = [r[1] for r in self.conn.execute("PRAGMA table_info(dlq)").fetchall()]
+        if "queue" not in dlq_cols:
+            # DLQ retries recreate archived jobs on their own queue and priority
+            self.conn.execute("ALTER TABLE dlq ADD COLUMN queue TEXT NOT NULL DEFAULT 'default'")
+            self.conn.execute("ALTER TABLE dlq ADD COLUMN priority INTEGER DEFAULT 1")
+            self.conn.execute("UPDATE dlq SET (queue, priority) = (SELECT queue, priority FROM jobs WHERE jobs.id = dlq.id) "
+                              "WHERE id IN (SELECT id FROM jobs)")
+        self._create_log_index()
+        self._create_result_cache()
+        self._create_schedules()
+        self._ensure_metrics()
+        self._ensure_indexes()
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _create_log_index(self):
+        # job_id -> location of each run's output in the segmented log store (log_store.py)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS log_index (
+            job_id TEXT NOT NULL,
+            segment TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            compressed INTEGER DEFAULT 0,
+            created_at REAL
+        )''')
+
+    def _create_result_cache(self):
+        # Latest successful run per cache key (see cached_result / cache_result)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS result_cache (
+            key TEXT PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            exit_code INTEGER,
+            duration REAL,
+            created_at REAL
+        )''')
+
+    def _create_schedules(self):
+        # Recurring jobs (scheduler.py); only the main database's table is used
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS schedules (
+            id TEXT PRIMARY KEY,
+            cron TEXT NOT NULL,
+            command TEXT NOT NULL,
+            queue TEXT NOT NULL DEFAULT 'default',
+            priority INTEGER DEFAULT 1,
+            max_retries INTEGER DEFAULT 3,
+            catchup INTEGER DEFAULT 1,
+            enabled INTEGER DEFAULT 1,
+            next_fire_at REAL NOT NULL,
+            last_fire_at REAL DEFAULT NULL,
+            created_at REAL
+        )''')
+        # The scheduler's timer: earliest next fire first, paused schedules left out
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_due ON schedules(next_fire_at) WHERE enabled=1")
+
+    def _ensure_metrics(self):
+        cur = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='job_stats'")
+        backfill = cur.fetchone() is None
+        for stmt in METRICS_SCHEMA:
+            self.conn.execute(stmt)
+        if backfill:
+            # First run against an existing queue.db: seed the counters from the table once.
+            # Runs in the schema transaction, and replaces rather than adds, so it can't double-count.
+            self.conn.execute("DELETE FROM job_counts")
+            self.conn.execute("INSERT INTO job_counts (state, n) SELECT state, COUNT(*) FROM jobs GROUP BY state")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO job_stats (id, duration_sum, duration_count) "
+                "SELECT 1, COALESCE(SUM(last_duration), 0), COUNT(*) FROM jobs WHERE last_duration > 0"
+            )
+            self.conn.execute("DELETE FROM metric_buckets WHERE metric='duration'")
+            cur = self.conn.execute("SELECT last_duration FROM jobs WHERE last_duration > 0")
+            self.conn.executemany(SAMPLE_SQL, (("duration", sketch.bucket_of(d)) for (d,) in cur.fetchall()))
+
+    def _ensure_indexes(self):
+        cur = self.conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx_jobs_%'")
+        for (name,) in cur.fetchall():
+            if name not in INDEXES:
+                self.conn.execute(f"DROP INDEX IF EXISTS {name}")
+        for stmt in INDEXES.values():
+            self.conn.execute(stmt)
+
+    def check_query_plans(self):
+        """Return {query_name: plan} for hot queries that scan the table or sort in a temp b-tree."""
+        problems = {}
+        for name, (sql, params) in HOT_QUERIES.items():
+            plan = [r[3] for r in self.conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            uses_index = any("USING" in step and "INDEX" in step for step in plan)
+            if not uses_index or any("TEMP B-TREE" in step for step in plan):
+                problems[name] = plan
+        return problems
 
-    def enqueue(self, command, max_retries=3, priority=1, run_at=0):
+    def enqueue(self, command, max_retries=3, priority=1, run_at=0, idempotency_key=None, cache=False, queue="default"):
+        """
+        Insert a pending job and return its id.
+
+        A job with the same idempotency_key already in the table wins: nothing
+        is inserted and its id is returned instead. cache=True lets workers
+        reuse a recent successful run of the same command (see cached_result).
+        """
         job_id = str(uuid.uuid4())
         now = time.time()
-        self.conn.execute("""
-            INSERT INTO jobs (id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority)
-            VALUES (?, ?, 'pending', 0, ?, ?, ?, ?, ?)""",
-            (job_id, command, max_retries, now, now, run_at or 0, priority))
-        self.conn.commit()
+        row = (job_id, command, max_retries, now, now, run_at or 0, priority,
+               idempotency_key, cache_key_for(command) if cache else None, queue)
+        if self.write(lambda conn: conn.execute(ENQUEUE_SQL, row).rowcount, wait=True, notify=True) == 0:
+            existing = self._ids_for_keys([idempotency_key])[idempotency_key]
+            print(f"Job already enqueued with idempotency key {idempotency_key}: {existing}")
+            return existing
         print(f"Job enqueued successfully: {job_id}")
         return job_id
 
-    def update_job_state(self, job_id, state, last_duration=None, last_exit_code=None):
+    def enqueue_many(self, jobs, chunk_size=1000):
+        """
+        Insert jobs in chunked transactions and yield each job id once its chunk is committed.
+
+        `jobs` may be any iterable of command strings or dicts with keys
+        command, max_retries, priority, run_at, idempotency_key, cache and
+        queue; it is consumed lazily. Duplicate idempotency keys yield the
+        existing id.
+        """
+        chunk = []
+        for job in jobs:
+            chunk.append(job_row(job))
+            if len(chunk) >= chunk_size:
+                yield from self._insert_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._insert_chunk(chunk)
+
+    def _insert_chunk(self, chunk):
+        if self.write(lambda conn: conn.executemany(ENQUEUE_SQL, chunk).rowcount, wait=True, notify=True) == len(chunk):
+            return [row[0] for row in chunk]
+        # Some rows collapsed into jobs that already hold their idempotency key
+        existing = self._ids_for_keys([row[7] for row in chunk if row[7] is not None])
+        return [existing.get(row[7], row[0]) if row[7] is not None else row[0] for row in chunk]
+
+    def _ids_for_keys(self, keys):
+        placeholders = ",".join("?" for _ in keys)
+        cur = self.conn.execute(f"SELECT idempotency_key, id FROM jobs WHERE idempotency_key IN ({placeholders})", keys)
+        return dict(cur.fetchall())
+
+    def cached_result(self, job_id, ttl):
+        """(job_id, exit_code, duration) of a successful run cached for this job's command within ttl seconds, or None."""
+        cur = self.conn.execute(
+            "SELECT r.job_id, r.exit_code, r.duration FROM jobs j JOIN result_cache r ON r.key = j.cache_key "
+            "WHERE j.id=? AND r.created_at > ?",
+            (job_id, time.time() - ttl)
+        )
+        return cur.fetchone()
+
+    def write(self, fn, wait=False, notify=False):
+        """
+        Run fn(conn) in a write transaction and return its result.
+
+        With a GroupWriter the call is queued and committed together with
+        other threads' writes; unless wait=True it returns None at once
+        (write-behind). notify wakes idle workers once it is committed.
+        """
+        if self.writer is not None:
+            return self.writer.submit(fn, wait, notify)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(self.conn)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if notify:
+            self.wakeup.notify()
+        return result
+
+    def flush(self):
+        """Wait until every write-behind write from this process is committed."""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def complete_from_cache(self, job_id, source_job_id, exit_code, notify=False):
+        """Mark a job completed from a cached run, pointing its logs at the cached run's output."""
+        now = time.time()
+
+        def complete(conn):
+            conn.execute(
+                "INSERT INTO log_index (job_id, segment, offset, length, compressed, created_at) "
+                "SELECT ?, segment, offset, length, compressed, ? FROM log_index WHERE job_id=? "
+                "ORDER BY rowid DESC LIMIT 1",
+                (job_id, now, source_job_id)
+            )
+            conn.execute("UPDATE jobs SET state='completed', updated_at=?, last_duration=0, last_exit_code=? WHERE id=?",
+                         (now, exit_code, job_id))
+        self.write(complete, notify=notify)
+
+    def cache_result(self, job_id, duration, max_entries=10000, ttl=3600):
+        """
+        Record a successful run of a cacheable job.
+
+        Every CACHE_EVICT_EVERY writes, entries older than ttl and all but the
+        newest max_entries are evicted.
+        """
+        now = time.time()
+
+        def record(conn):
+            cur = conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, job_id, exit_code, duration, created_at) "
+                "SELECT cache_key, id, 0, ?, ? FROM jobs WHERE id=? AND cache_key IS NOT NULL",
+                (duration, now, job_id)
+            )
+            if cur.rowcount:
+                self._cache_writes += 1
+                if self._cache_writes % CACHE_EVICT_EVERY == 0:
+                    self._evict_cache(conn, max_entries, ttl)
+        self.write(record)
+
+    def evict_cache(self, max_entries, ttl):
+        """Drop cached results older than ttl seconds, then all but the newest max_entries; returns rows removed."""
+        return self.write(lambda conn: self._evict_cache(conn, max_entries, ttl), wait=True)
+
+    def _evict_cache(self, conn, max_entries, ttl):
+        removed = conn.execute("DELETE FROM result_cache WHERE created_at <= ?", (time.time() - ttl,)).rowcount
+        removed += conn.execute(
+            "DELETE FROM result_cache WHERE key IN "
+            "(SELECT key FROM result_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        ).rowcount
+        return removed
+
+    def update_job_state(self, job_id, state, last_duration=None, last_exit_code=None, usage=None, notify=False):
+        """Set a job's state (and its run's duration, exit code and usage); notify wakes idle workers once committed."""
+        with timed("update_job_state"):
+            self.write(lambda conn: self._set_state(conn, job_id, state, last_duration, last_exit_code, usage),
+                       notify=notify)
+
+    def _set_state(self, conn, job_id, state, last_duration=None, last_exit_code=None, usage=None):
         now = time.time()
         if last_duration is None:
-            self.conn.execute("UPDATE jobs SET state=?, updated_at=? WHERE id=?", (state, now, job_id))
+            conn.execute("UPDATE jobs SET state=?, updated_at=? WHERE id=?", (state, now, job_id))
         else:
-            self.conn.execute("UPDATE jobs SET state=?, updated_at=?, last_duration=?, last_exit_code=? WHERE id=?",
-                              (state, now, last_duration, last_exit_code, job_id))
-        self.conn.commit()
+            conn.execute(f"UPDATE jobs SET state=?, updated_at=?, last_duration=?, last_exit_code=?, {USAGE_SET} WHERE id=?",
+                         (state, now, last_duration, last_exit_code, *(usage or NO_USAGE), job_id))
+            conn.execute(SAMPLE_SQL, ("duration", sketch.bucket_of(last_duration)))
 
-    def list_jobs(self, state=None):
-        cur = self.conn.cursor()
-        cols = "id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_duration, last_exit_code"
-        if state:
-            cur.execute(f"SELECT {cols} FROM jobs WHERE state=? ORDER BY created_at ASC", (state,))
+    def _move_to_dlq(self, conn, job_id, error):
+        conn.execute(
+            "INSERT OR REPLACE INTO dlq (id, command, attempts, max_retries, created_at, moved_at, error, queue, priority) "
+            "SELECT id, command, attempts, max_retries, created_at, ?, ?, queue, priority FROM jobs WHERE id=?",
+            (time.time(), error, job_id)
+        )
+        self._set_state(conn, job_id, "dead")
+
+    def move_to_dlq(self, job_id, error, notify=False):
+        """Copy a job into the DLQ and mark it dead, in one transaction; notify as for update_job_state."""
+        self.write(lambda conn: self._move_to_dlq(conn, job_id, error), notify=notify)
+
+    def _schedule_retry(self, conn, job_id, attempts, next_run_at):
+        conn.execute(
+            "UPDATE jobs SET state=?, attempts=?, updated_at=?, next_run_at=? WHERE id=?",
+            ("pending", attempts, time.time(), next_run_at, job_id)
+        )
+
+    def schedule_retry(self, job_id, attempts, next_run_at):
+        """Put a failed job back to pending, due again at next_run_at."""
+        # notify: idle workers may be sleeping past the new next_run_at
+        self.write(lambda conn: self._schedule_retry(conn, job_id, attempts, next_run_at), notify=True)
+
+    def remove_from_dlq(self, job_id):
+        self.write(lambda conn: conn.execute("DELETE FROM dlq WHERE id=?", (job_id,)))
+
+    def dlq_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM dlq").fetchone()[0]
+
+    def record_run(self, job_id, last_duration, last_exit_code, usage=None):
+        """Store a failed run's duration, exit code and resource usage without changing its state."""
+        def record(conn):
+            conn.execute(
+                f"UPDATE jobs SET last_duration=?, last_exit_code=?, {USAGE_SET} WHERE id=?",
+                (last_duration, last_exit_code, *(usage or NO_USAGE), job_id)
+            )
+            conn.execute(SAMPLE_SQL, ("duration", sketch.bucket_of(last_duration)))
+        self.write(record)
+
+    def claim(self, worker_id, n=1, queues=None, limits=None, lease=DEFAULT_LEASE):
+        """
+        Atomically move up to n due pending jobs to 'processing' and return them.
+
+        queues is an optional list of (name, weight): only those queues are
+        served and the n slots are shared between them in proportion to their
+        weights (smooth weighted round-robin, carried across calls), with slots
+        a queue can't fill handed to the others. Without it every queue is
+        served in plain priority order. limits maps queue names to the most jobs
+        that may be processing in that queue at once, across all workers.
+        Claimed jobs are leased for `lease` seconds (see extend_leases).
+        """
+        with timed("claim"):
+            # write() runs inside BEGIN IMMEDIATE: the write lock is taken up front, so two
+            # workers can never select the same rows before either marks them as processing.
+            return self.write(lambda conn: self._claim(conn, worker_id, n, queues, limits or {}, lease), wait=True)
+
+    def _claim(self, conn, worker_id, n, queues, limits, lease):
+        now = time.time()
+        cur = conn.cursor()
+        # Counted under the write lock, so limits hold across workers
+        room = {q: max(limit - cur.execute("SELECT COUNT(*) FROM jobs WHERE queue=? AND state='processing'",
+                                           (q,)).fetchone()[0], 0)
+                for q, limit in limits.items()}
+        if queues:
+            jobs = self._select_weighted(cur, now, n, queues, room)
+        else:
+            jobs = self._select_any(cur, now, n, room)
+        if jobs:
+            cur.executemany(
+                "UPDATE jobs SET state='processing', worker_id=?, leased_at=?, lease_expires_at=?, updated_at=? "
+                "WHERE id=?",
+                [(str(worker_id), now, now + lease, now, j[0]) for j in jobs]
+            )
+            # Queue wait: from when the job became due (created or retry time) until now
+            cur.executemany(SAMPLE_SQL, [
+                ("queue_wait", sketch.bucket_of(now - max(j[5] or 0, j[7] or 0))) for j in jobs
+            ])
+        return [(j[0], j[1], "processing") + tuple(j[3:11]) for j in jobs]
+
+    def _select_any(self, cur, now, n, room):
+        """Due jobs from every queue in priority order, skipping queues that are at their limit."""
+        full = [q for q, r in room.items() if r <= 0]
+        if full:
+            sql = CLAIM_SQL.replace("WHERE ", f"WHERE queue NOT IN ({','.join('?' for _ in full)}) AND ", 1)
+            rows = cur.execute(sql, (*full, now, n)).fetchall()
         else:
-            cur.execute(f"SELECT {cols} FROM jobs ORDER BY created_at ASC")
+            rows = cur.execute(CLAIM_SQL, (now, n)).fetchall()
+        jobs, left = [], dict(room)
+        for row in rows:
+            queue = row[11]
+            if queue in left:
+                if left[queue] <= 0:
+                    continue
+                left[queue] -= 1
+            jobs.append(row)
+        self.limited = bool(full) or len(jobs) < len(rows)
+        return jobs
+
+    def _select_weighted(self, cur, now, n, queues, room):
+        """Share n slots between (name, weight) queues by smooth weighted round-robin."""
+        cap = {q: min(room.get(q, n), n) for q, w in queues if w > 0}
+        self.limited = any(c <= 0 for c in cap.values())
+        quota = dict.fromkeys(cap, 0)
+        credit = self._queue_credit
+        weights = {q: w for q, w in queues if q in cap}
+        for _ in range(n):
+            open_queues = [q for q in cap if quota[q] < cap[q]]
+            if not open_queues:
+                break
+            total = sum(weights[q] for q in open_queues)
+            for q in open_queues:
+                credit[q] = credit.get(q, 0) + weights[q]
+            best = max(open_queues, key=lambda q: credit[q])
+            credit[best] -= total
+            quota[best] += 1
+
+        jobs, taken = [], {}
+        for q, k in quota.items():
+            if k:
+                rows = cur.execute(QUEUE_CLAIM_SQL, (q, now, k, 0)).fetchall()
+                taken[q] = len(rows)
+                jobs.extend(rows)
+        # Work-conserving: slots an empty queue couldn't use go to queues that still have jobs
+        for q, k in quota.items():
+            short = n - len(jobs)
+            if short <= 0:
+                break
+            if taken.get(q, 0) < k or cap[q] <= taken.get(q, 0):
+                continue
+            rows = cur.execute(QUEUE_CLAIM_SQL, (q, now, min(short, cap[q] - taken.get(q, 0)), taken.get(q, 0))).fetchall()
+            jobs.extend(rows)
+        return jobs
+
+    def release(self, job_ids):
+        """Return claimed-but-unstarted jobs to the pending state."""
+        if not job_ids:
+            return
+        now = time.time()
+        self.write(lambda conn: conn.executemany(
+            "UPDATE jobs SET state='pending', worker_id=NULL, leased_at=NULL, lease_expires_at=NULL, updated_at=? "
+            "WHERE id=? AND state='processing'",
+            [(now, job_id) for job_id in job_ids]
+        ), notify=True)
+
+    def extend_leases(self, job_ids, lease=DEFAULT_LEASE):
+        """Heartbeat: push the lease of every still-processing job in job_ids `lease` seconds ahead."""
+        if not job_ids:
+            return
+        expires = time.time() + lease
+
+        def extend(conn):
+            for i in range(0, len(job_ids), 500):
+                chunk = job_ids[i:i + 500]
+                conn.execute(
+                    f"UPDATE jobs SET lease_expires_at=? WHERE state='processing' AND id IN ({','.join('?' for _ in chunk)})",
+                    (expires, *chunk)
+                )
+        self.write(extend)
+
+    def expired_leases(self, limit=1000):
+        """Processing jobs whose lease ran out, as JOB_COLUMNS tuples followed by worker_id."""
+        cur = self.conn.execute(HOT_QUERIES["expired_leases"][0], (time.time(), limit))
         return cur.fetchall()
 
+    def take_expired(self, job_id, backoff_base=2, error="LeaseExpired"):
+        """
+        Retry (with backoff) or dead-letter a job whose lease expired, in one transaction.
+
+        Returns (outcome, attempts) with outcome "retried" or "dead", or None
+        if the lease was renewed or another reaper took the job first. Taking
+        the job and moving it commit together, so a reaper that dies can't
+        leave it 'processing' with no lease for anyone to find.
+        """
+        now = time.time()
+
+        def take(conn):
+            row = conn.execute(
+                "SELECT attempts, max_retries FROM jobs WHERE id=? AND state='processing' AND lease_expires_at < ?",
+                (job_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            attempts = row[0] + 1
+            if attempts > row[1]:
+                self._move_to_dlq(conn, job_id, error)
+                return "dead", attempts
+            self._schedule_retry(conn, job_id, attempts, now + backoff_base ** attempts)
+            return "retried", attempts
+        # notify: the retry may be due before idle workers next look, and a dead job frees a queue slot
+        return self.write(take, wait=True, notify=True)
+
+    def next_due_at(self, queues=None):
+        """Return the earliest next_run_at among pending jobs (in `queues`, if given), or None if nothing is pending."""
+        if not queues:
+            cur = self.conn.execute("SELECT MIN(next_run_at) FROM jobs WHERE state='pending'")
+        else:
+            cur = self.conn.execute(
+                f"SELECT MIN(next_run_at) FROM jobs WHERE state='pending' AND queue IN ({','.join('?' for _ in queues)})",
+                list(queues)
+            )
+        return cur.fetchone()[0]
+
+    def get_job(self, job_id):
+        cur = self.conn.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id=?", (job_id,))
+        return cur.fetchone()
+
+    def page_jobs(self, limit=50, before=None, state=None):
+        """Newest-first page of jobs; `before` is (created_at, id) of the last row of the previous page."""
+        name = "jobs_page_state" if state else "jobs_page"
+        params = (*((state,) if state else ()), *(before or (float("inf"), "")), limit)
+        return self.conn.execute(HOT_QUERIES[name][0], params).fetchall()
+
+    def changed_since(self, since, limit=1000):
+        """Up to `limit` jobs updated after `since`, in no particular order."""
+        return self.conn.execute(HOT_QUERIES["changed_since"][0], (*STATES, since, limit)).fetchall()
+
+    def list_jobs(self, state=None):
+        return list(self.iter_jobs(state=state))
+
+    def iter_usage(self, since=0):
+        """(command, last_duration, *usage) of every job whose last run, finished at or after `since`, has usage."""
+        return self.conn.execute(HOT_QUERIES["usage_since"][0], (*STATES, since))
+
+    def iter_jobs(self, limit=None, after=None, page_size=1000, **filters):
+        """Stream jobs ordered by (created_at, id), fetching page_size rows per query; `after` is a job id."""
+        cursor = (float("-inf"), "")
+        if after is not None:
+            cursor = self.cursor_of(after)
+            if cursor is None:
+                return
+        yield from self.iter_from(cursor, limit, page_size, **filters)
+
+    def cursor_of(self, job_id):
+        """(created_at, id) keyset position of a job, or None if it isn't here."""
+        return self.conn.execute("SELECT created_at, id FROM jobs WHERE id=?", (job_id,)).fetchone()
+
+    def iter_from(self, cursor, limit=None, page_size=1000, **filters):
+        """iter_jobs() starting strictly after a (created_at, id) cursor."""
+        where, params = job_filter(**filters)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            n = page_size if remaining is None else min(page_size, remaining)
+            # One short statement per page: no read transaction is held open while the caller prints
+            rows = self.conn.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE (created_at, id) > (?, ?) AND {where} "
+                "ORDER BY created_at, id LIMIT ?",
+                (*cursor, *params, n)
+            ).fetchall()
+            yield from rows
+            if len(rows) < n:
+                return
+            cursor = (rows[-1][5], rows[-1][0])
+            if remaining is not None:
+                remaining -= len(rows)
+
     def metrics(self):
+        return summarize(*self.raw_metrics())
+
+    def raw_metrics(self):
+        """(counts by state, duration_sum, duration_count, duration buckets, queue_wait buckets), for summarize()."""
         cur = self.conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM jobs")
-        total = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM jobs WHERE state='completed'")
-        completed = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(*) FROM jobs WHERE state='dead'")
-        dead = cur.fetchone()[0]
-        cur.execute("SELECT AVG(last_duration) FROM jobs WHERE last_duration>0")
-        avg_dur = cur.fetchone()[0] or 0
-        success_rate = (completed / (completed + dead)) * 100 if (completed + dead) > 0 else 0
-        return {
-            "total": total,
-            "completed": completed,
-            "dead": dead,
-            "avg_duration": avg_dur,
-            "success_rate": success_rate
-        }
+        cur.execute("SELECT state, n FROM job_counts")
+        counts = dict(cur.fetchall())
+        cur.execute("SELECT duration_sum, duration_count FROM job_stats WHERE id=1")
+        dur_sum, dur_count = cur.fetchone() or (0, 0)
+        return counts, dur_sum, dur_count, self.sketch_buckets("duration"), self.sketch_buckets("queue_wait")
+
+    def sketch_buckets(self, metric):
+        cur = self.conn.execute("SELECT bucket, n FROM metric_buckets WHERE metric=? ORDER BY bucket", (metric,))
+        return cur.fetchall()
 
+    def percentiles(self, metric, qs=(0.5, 0.95, 0.99)):
+        """p50/p95/p99 (by default) of a sketched metric, in seconds; None when there are no samples."""
+        return sketch.quantiles(self.sketch_buckets(metric), qs)
@@ -0,0 +1,100 @@
+import os, threading, time
+from job_store import open_store
+from instrumentation import JOBS_TOTAL
+
+
+class Reaper:
+    """
+    Return jobs whose lease expired (their worker died or hung) to the queue.
+
+    Expired jobs are retried with backoff or moved to the DLQ exactly like a
+    failed run, but each is taken and moved in one transaction
+    (JobStore.take_expired) rather than through the write-behind failure path.
+    """
+
+    def __init__(self, store, config):
+        self.store = store
+        self.config = config
+
+    def reap(self, limit=1000):
+        """Handle up to `limit` expired jobs; returns how many were reaped."""
+        reaped = 0
+        for job in self.store.expired_leases(limit):
+            job_id = job[0]
+            taken = self.store.take_expired(job_id, self.config.get("backoff_base", 2))
+            # Another reaper (or a late heartbeat) may have got there first
+            if taken is None:
+                continue
+            outcome, attempts = taken
+            JOBS_TOTAL.inc(outcome=outcome)
+            if outcome == "dead":
+                print(f"☠️ Job {job_id} lease expired (worker {job[11]}) — moved to DLQ after {attempts - 1} retries")
+            else:
+                print(f"⏰ Job {job_id} lease expired (worker {job[11]}) — retrying (attempt {attempts})")
+            reaped += 1
+        return reaped
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    Per-process heartbeat: extends the leases of every job this process holds.
+
+    Workers add() job ids when they claim them and discard() them when the
+    run is recorded. Every lease_timeout / 3 seconds the keeper pushes their
+    lease_expires_at forward, and every reap_interval seconds it also reaps
+    expired leases left behind by dead workers. With open_store (a callable
+    returning something with extend_leases, e.g. a broker client) it only
+    heartbeats; reaping is left to whoever owns the database.
+    """
+
+    def __init__(self, db_path, config, open_store=None):
+        super().__init__(daemon=True, name="flam-lease")
+        self.db_path = db_path
+        self.config = config
+        self.open_store = open_store
+        self.held = set()
+        self.lock = threading.Lock()
+
+    def ensure_running(self):
+        with self.lock:
+            if self.ident is None:
+                self.start()
+
+    def add(self, job_ids):
+        with self.lock:
+            self.held.update(job_ids)
+
+    def discard(self, job_ids):
+        with self.lock:
+            self.held.difference_update(job_ids)
+
+    def run(self):
+        store = self.open_store() if self.open_store else open_store(self.db_path, self.config, group_commit=True)
+        reaper = None if self.open_store else Reaper(store, self.config)
+        lease = self.config.get("lease_timeout", 60)
+        reap_interval = self.config.get("reap_interval", 30) if reaper else 0
+        next_reap = time.time() + reap_interval
+        while True:
+            time.sleep(lease / 3)
+            with self.lock:
+                held = list(self.held)
+            try:
+                store.extend_leases(held, lease)
+                if reap_interval > 0 and time.time() >= next_reap:
+                    next_reap = time.time() + reap_interval
+                    reaper.reap()
+            except Exception as e:
+                print(f"⚠️ Lease heartbeat failed: {e}")
+
+
+_keepers = {}
+_keepers_lock = threading.Lock()
+
+
+def get_lease_keeper(db_path, config, open_store=None):
+    """Return the LeaseKeeper for a database path (or broker address, with open_store) in this process."""
+    key = (db_path if open_store else os.path.abspath(db_path), os.getpid())
+    with _keepers_lock:
+        if key not in _keepers:
+            _keepers[key] = LeaseKeeper(db_path, config, open_store)
+        return _keepers[key]
@@ -0,0 +1,306 @@
+import atexit, gzip, mmap, os, threading, time, zlib
+from collections import deque
+
+LOG_DIR = "logs"
+SEGMENT_BYTES = 64 * 1024 * 1024
+# Records at least this large are read through mmap instead of read()
+MMAP_THRESHOLD = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class SegmentWriter:
+    """
+    The append side of the log store for one process.
+
+    Each process appends to its own segment (named with its pid) so writers
+    never share a file; threads in the process serialize on a lock. Open
+    segments end in .open and are renamed to .seg once sealed, which tells
+    compaction they will not grow any more.
+    """
+
+    def __init__(self, seg_dir, segment_bytes):
+        self.seg_dir = seg_dir
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.name = None
+        self.seq = 0
+        atexit.register(self.seal)
+
+    def _roll(self):
+        self._seal()
+        os.makedirs(self.seg_dir, exist_ok=True)
+        self.seq += 1
+        self.name = f"seg-{int(time.time())}-{os.getpid()}-{self.seq:04d}"
+        self.file = open(os.path.join(self.seg_dir, self.name + ".open"), "ab")
+
+    def seal(self):
+        with self.lock:
+            self._seal()
+
+    def _seal(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        path = os.path.join(self.seg_dir, self.name)
+        try:
+            os.replace(path + ".open", path + ".seg")
+        except OSError:
+            # Log directory removed underneath us; nothing left to seal
+            pass
+
+    def append(self, src_path):
+        """Copy a finished log file onto the end of the current segment; return (segment, offset, length)."""
+        with self.lock:
+            if self.file is None or self.file.tell() >= self.segment_bytes:
+                self._roll()
+            offset = self.file.tell()
+            with open(src_path, "rb") as src:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.file.write(chunk)
+            self.file.flush()
+            return self.name, offset, self.file.tell() - offset
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def _get_writer(seg_dir, segment_bytes):
+    seg_dir = os.path.abspath(seg_dir)
+    with _writers_lock:
+        if seg_dir not in _writers:
+            _writers[seg_dir] = SegmentWriter(seg_dir, segment_bytes)
+        return _writers[seg_dir]
+
+
+class LogStore:
+    """
+    Append-only segmented job log store.
+
+    Running jobs stream into logs/active/<job_id>.log; when a run finishes the
+    file is appended to a rolling segment under logs/segments/ and indexed in
+    the log_index table (job_id -> segment, offset, length). Logs written
+    before segments existed (logs/<job_id>.log) are still readable.
+    """
+
+    def __init__(self, conn, log_dir=LOG_DIR, segment_bytes=SEGMENT_BYTES, write=None):
+        self.conn = conn
+        # JobStore.write, so index rows join the store's group commits
+        self.write = write
+        self.log_dir = log_dir
+        self.active_dir = os.path.join(log_dir, "active")
+        self.seg_dir = os.path.join(log_dir, "segments")
+        self.segment_bytes = segment_bytes
+
+    def active_path(self, job_id, compress=False):
+        os.makedirs(self.active_dir, exist_ok=True)
+        return os.path.join(self.active_dir, f"{job_id}.log" + (".gz" if compress else ""))
+
+    def append(self, job_id, path, compressed=False):
+        """Move a finished run's log file into the current segment and index it."""
+        writer = _get_writer(self.seg_dir, self.segment_bytes)
+        segment, offset, length = writer.append(path)
+        row = (job_id, segment, offset, length, int(compressed), time.time())
+
+        def index(conn):
+            conn.execute(
+                "INSERT INTO log_index (job_id, segment, offset, length, compressed, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                row
+            )
+        write = self._write_for(job_id)
+        if write is not None:
+            write(index)
+        else:
+            conn = self._conn_for(job_id)
+            index(conn)
+            conn.commit()
+        os.remove(path)
+        return segment, offset, length
+
+    def lookup(self, job_id):
+        """Return (rowid, segment, offset, length, compressed) of the latest run's log, or None."""
+        cur = self._conn_for(job_id).execute(
+            "SELECT rowid, segment, offset, length, compressed FROM log_index WHERE job_id=? ORDER BY rowid DESC LIMIT 1",
+            (job_id,)
+        )
+        return cur.fetchone()
+
+    def _conn_for(self, job_id):
+        """Connection holding job_id's log_index rows."""
+        return self.conn
+
+    def _write_for(self, job_id):
+        return self.write
+
+    def _conns(self):
+        """Every connection with a log_index pointing into these segments."""
+        return [self.conn]
+
+    def _segment_path(self, segment):
+        path = os.path.join(self.seg_dir, segment)
+        return path + ".seg" if os.path.exists(path + ".seg") else path + ".open"
+
+    def _legacy_path(self, job_id):
+        for path in (os.path.join(self.log_dir, f"{job_id}.log"), os.path.join(self.log_dir, f"{job_id}.log.gz")):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def iter_chunks(self, job_id):
+        """Yield the latest log for job_id as raw (decompressed) byte chunks; None if there is no log."""
+        entry = self.lookup(job_id)
+        if entry:
+            _, segment, offset, length, compressed = entry
+            return self._iter_record(self._segment_path(segment), offset, length, compressed)
+        legacy = self._legacy_path(job_id)
+        if legacy:
+            return self._iter_file(legacy, legacy.endswith(".gz"))
+        return None
+
+    def _iter_record(self, path, offset, length, compressed):
+        with open(path, "rb") as f:
+            if length >= MMAP_THRESHOLD:
+                # mmap pages the record in on demand instead of copying it through read()
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    view = memoryview(mm)
+                    try:
+                        yield from _maybe_inflate(
+                            (bytes(view[i:min(i + CHUNK_SIZE, offset + length)])
+                             for i in range(offset, offset + length, CHUNK_SIZE)),
+                            compressed
+                        )
+                    finally:
+                        view.release()
+            else:
+                f.seek(offset)
+                yield from _maybe_inflate([f.read(length)], compressed)
+
+    def _iter_file(self, path, compressed):
+        opener = gzip.open if compressed else open
+        with opener(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def tail(self, job_id, n):
+        """Return the last n lines of a job's latest log as bytes, or None if there is no log."""
+        chunks = self.iter_chunks(job_id)
+        return None if chunks is None else tail_lines(chunks, n)
+
+    def compact(self, min_dead_ratio=0.5):
+        """
+        Drop log records of purged jobs and superseded runs, and reclaim their segments.
+
+        Sealed segments with no live records are deleted; those where at least
+        min_dead_ratio of the bytes are dead have their live records copied
+        into the current segment first. Returns (segments_removed, bytes_freed).
+        """
+        if not os.path.isdir(self.seg_dir):
+            return 0, 0
+        conns = self._conns()
+        for conn in conns:
+            # A record is live if its job still exists and it is that job's latest run
+            conn.execute("""
+                DELETE FROM log_index
+                WHERE job_id NOT IN (SELECT id FROM jobs) AND job_id NOT IN (SELECT id FROM dlq)
+                   OR rowid NOT IN (SELECT MAX(rowid) FROM log_index GROUP BY job_id)""")
+            conn.commit()
+
+        removed, freed = 0, 0
+        writer = _get_writer(self.seg_dir, self.segment_bytes)
+        for fname in sorted(os.listdir(self.seg_dir)):
+            segment, ext = os.path.splitext(fname)
+            if ext == ".open" and not _writer_gone(segment):
+                continue
+            if segment == writer.name:
+                continue
+            path = os.path.join(self.seg_dir, fname)
+            size = os.path.getsize(path)
+            live = [(conn, *row) for conn in conns for row in conn.execute(
+                "SELECT rowid, offset, length FROM log_index WHERE segment=?", (segment,)
+            )]
+            live_bytes = sum(r[3] for r in live)
+            if live and (size - live_bytes) < size * min_dead_ratio:
+                continue
+            for conn, rowid, offset, length in live:
+                new_segment, new_offset, _ = self._copy_record(writer, path, offset, length)
+                conn.execute("UPDATE log_index SET segment=?, offset=? WHERE rowid=?",
+                             (new_segment, new_offset, rowid))
+            for conn in conns:
+                conn.commit()
+            os.remove(path)
+            removed += 1
+            freed += size - live_bytes
+        return removed, freed
+
+    def _copy_record(self, writer, path, offset, length):
+        with writer.lock:
+            if writer.file is None or writer.file.tell() >= writer.segment_bytes:
+                writer._roll()
+            new_offset = writer.file.tell()
+            with open(path, "rb") as src:
+                src.seek(offset)
+                left = length
+                while left:
+                    chunk = src.read(min(CHUNK_SIZE, left))
+                    if not chunk:
+                        break
+                    writer.file.write(chunk)
+                    left -= len(chunk)
+            writer.file.flush()
+            return writer.name, new_offset, length
+
+
+def tail_lines(chunks, n):
+    """Return the last n lines from an iterable of byte chunks, holding only n lines in memory."""
+    lines = deque(maxlen=n)
+    partial = b""
+    for chunk in chunks:
+        parts = (partial + chunk).split(b"\n")
+        partial = parts.pop()
+        lines.extend(parts)
+    if partial:
+        lines.append(partial)
+    return b"\n".join(lines) + b"\n" if lines else b""
+
+
+def _maybe_inflate(chunks, compressed):
+    if not compressed:
+        yield from chunks
+        return
+    inflater = zlib.decompressobj(wbits=31)
+    for chunk in chunks:
+        data = inflater.decompress(chunk)
+        if data:
+            yield data
+    rest = inflater.flush()
+    if rest:
+        yield rest
+
+
+def _writer_gone(segment):
+    """True if the process that opened this segment is no longer running."""
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on Windows
+        return False
+    try:
+        os.kill(int(segment.split("-")[2]), 0)
+    except (IndexError, ValueError, ProcessLookupError):
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def open_log_store(store):
+    """LogStore indexed in `store`'s database (in each shard's, for a ShardedJobStore)."""
+    if hasattr(store, "shards"):
+        from shards import ShardedLogStore
+        return ShardedLogStore(store)
+    return LogStore(store.conn, write=store.write)
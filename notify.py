@@ -0,0 +1,116 @@
+import atexit, os, socket, threading
+
+class Wakeup:
+    """
+    Wake idle workers as soon as new work may be ready.
+
+    Workers in the same process wait on a condition variable. Other processes
+    are reached through Unix datagram sockets in <db_path>.wakeup/, one per
+    listening process; where AF_UNIX is unavailable only same-process
+    notifications work and workers fall back to polling.
+    """
+
+    def __init__(self, db_path):
+        self.sock_dir = db_path + ".wakeup"
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.sock = None
+        self.sock_path = None
+
+    @property
+    def cross_process(self):
+        return self.sock is not None
+
+    def listen(self):
+        """Start receiving wakeups from other processes (idempotent)."""
+        with self.cond:
+            if self.sock is not None or not hasattr(socket, "AF_UNIX"):
+                return self.sock is not None
+            try:
+                os.makedirs(self.sock_dir, exist_ok=True)
+                path = os.path.join(self.sock_dir, f"{os.getpid()}.sock")
+                if os.path.exists(path):
+                    os.unlink(path)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.bind(path)
+            except OSError:
+                return False
+            self.sock, self.sock_path = sock, path
+        atexit.register(self.close)
+        threading.Thread(target=self._recv_loop, daemon=True).start()
+        return True
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            self.sock.close()
+            os.unlink(self.sock_path)
+        except OSError:
+            pass
+        self.sock = None
+
+    def _recv_loop(self):
+        while self.sock is not None:
+            try:
+                self.sock.recv(64)
+            except OSError:
+                return
+            self.notify_local()
+
+    def notify_local(self):
+        """Wake waiting workers in this process only (used for shutdown)."""
+        with self.cond:
+            self.generation += 1
+            self.cond.notify_all()
+
+    def notify(self):
+        """Wake waiting workers in this process and in every listening process."""
+        self.notify_local()
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            names = os.listdir(self.sock_dir)
+        except OSError:
+            return
+        out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        out.setblocking(False)
+        try:
+            for name in names:
+                path = os.path.join(self.sock_dir, name)
+                if path == self.sock_path:
+                    continue
+                try:
+                    out.sendto(b"!", path)
+                except BlockingIOError:
+                    # Receiver's buffer is full of wakeups already
+                    pass
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Listener died without cleaning up
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                except OSError:
+                    pass
+        finally:
+            out.close()
+
+    def wait(self, timeout, since):
+        """Block until notified after generation `since`, or until timeout seconds pass."""
+        with self.cond:
+            if self.generation == since:
+                self.cond.wait(timeout)
+            return self.generation != since
+
+
+_wakeups = {}
+_wakeups_lock = threading.Lock()
+
+def get_wakeup(db_path):
+    """Return the process-wide Wakeup for a database path."""
+    key = os.path.abspath(db_path)
+    with _wakeups_lock:
+        if key not in _wakeups:
+            _wakeups[key] = Wakeup(db_path)
+        return _wakeups[key]
@@ -0,0 +1,117 @@
+import gzip
+import tempfile
+import threading
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamCap:
+    """
+    Keep the first and last `limit // 2` bytes of one output stream.
+
+    The head goes straight to `sink` as it arrives; only the tail window is
+    held in memory, so memory stays bounded by `limit` however much is fed.
+    A limit of 0 means unlimited (everything goes to the sink).
+    """
+
+    def __init__(self, sink, limit):
+        self.sink = sink
+        self.head_left = limit - limit // 2 if limit else None
+        self.tail_limit = limit // 2 if limit else 0
+        self.tail = bytearray()
+        self.dropped = 0
+        self.total = 0
+
+    def feed(self, chunk):
+        self.total += len(chunk)
+        if self.head_left is None:
+            self.sink.write(chunk)
+            return
+        if self.head_left > 0:
+            head, chunk = chunk[:self.head_left], chunk[self.head_left:]
+            self.sink.write(head)
+            self.head_left -= len(head)
+        if chunk:
+            self.tail += chunk
+            excess = len(self.tail) - self.tail_limit
+            if excess > 0:
+                del self.tail[:excess]
+                self.dropped += excess
+
+    def finish(self, out):
+        """Write the truncation marker and the kept tail to `out`."""
+        if self.dropped:
+            out.write(f"\n[... {self.dropped} bytes truncated ...]\n".encode())
+        out.write(self.tail)
+        self.tail = bytearray()
+
+
+class OutputCapture:
+    """
+    Stream a job's stdout and stderr into a log file while it runs.
+
+    Output is never decoded; stdout is written in place and stderr is spooled
+    to a temporary file and appended under a "[stderr]" marker on close, giving
+    the same layout as the old buffered logs.
+    """
+
+    def __init__(self, job_id, path, max_bytes=0, compress=False):
+        self.job_id = job_id
+        self.path = path
+        self.compress = compress
+        self.file = gzip.open(self.path, "wb") if compress else open(self.path, "wb")
+        self.spool = tempfile.TemporaryFile()
+        self.stdout = StreamCap(self.file, max_bytes)
+        self.stderr = StreamCap(self.spool, max_bytes)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def feed_stdout(self, chunk):
+        with self.lock:
+            self.stdout.feed(chunk)
+
+    def feed_stderr(self, chunk):
+        with self.lock:
+            self.stderr.feed(chunk)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return self.path
+            self.closed = True
+            self.stdout.finish(self.file)
+            if self.stderr.total:
+                self.file.write(b"\n[stderr]\n")
+                self.spool.seek(0)
+                while True:
+                    chunk = self.spool.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.file.write(chunk)
+                self.stderr.finish(self.file)
+            self.spool.close()
+            self.file.close()
+        return self.path
+
+
+def pump(pipe, feed):
+    """Copy a binary pipe into `feed` chunk by chunk until EOF."""
+    try:
+        while True:
+            chunk = pipe.read1(CHUNK_SIZE) if hasattr(pipe, "read1") else pipe.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            feed(chunk)
+    finally:
+        pipe.close()
+
+
+def start_pumps(process, capture):
+    """Start daemon threads draining a Popen's stdout/stderr into `capture`."""
+    threads = [
+        threading.Thread(target=pump, args=(process.stdout, capture.feed_stdout), daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, capture.feed_stderr), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+    return threads
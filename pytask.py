@@ -0,0 +1,193 @@
+import importlib, io, json, multiprocessing, os, queue, signal, sys, threading, time, traceback
+from output_capture import CHUNK_SIZE
+
+# Python task jobs are stored as ordinary commands with this prefix, so list,
+# DLQ copies and retries carry them unchanged: "@python mypkg.tasks:resize {"w": 100}"
+PREFIX = "@python "
+
+
+def encode_task(target, args=None):
+    """Command string for a Python task job; target is "module:function"."""
+    module, _, func = target.partition(":")
+    if not module or not func:
+        raise ValueError(f"Python task must look like module:function, got {target!r}")
+    return f"{PREFIX}{target} {json.dumps(args if args is not None else {})}"
+
+
+def parse_task(command):
+    """Return (target, args) for a Python task command, or None for a shell command."""
+    if not command.startswith(PREFIX):
+        return None
+    target, _, args = command[len(PREFIX):].strip().partition(" ")
+    return target, json.loads(args) if args.strip() else {}
+
+
+class _PipeStream(io.TextIOBase):
+    """sys.stdout/sys.stderr replacement that ships output to the parent in chunks."""
+
+    def __init__(self, conn, kind):
+        self.conn = conn
+        self.kind = kind
+        self.buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self.buf += s.encode("utf-8", "replace")
+        if len(self.buf) >= CHUNK_SIZE:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+        if self.buf:
+            self.conn.send((self.kind, bytes(self.buf)))
+            self.buf.clear()
+
+
+def _call(funcs, target, args):
+    fn = funcs.get(target)
+    if fn is None:
+        module, _, name = target.partition(":")
+        # Imports stay cached in this long-lived process across tasks
+        fn = funcs[target] = getattr(importlib.import_module(module), name)
+    return fn(*args) if isinstance(args, list) else fn(**args)
+
+
+# Grace after `timeout` before a task that ignored its TaskTimeout has its process killed
+KILL_GRACE = 2
+
+
+class TaskTimeout(BaseException):
+    """Raised inside a task that runs past the timeout; not an Exception, so task code's `except Exception` lets it through."""
+
+
+def _on_alarm(signum, frame):
+    raise TaskTimeout()
+
+
+def _arm(seconds):
+    # Platforms without setitimer (Windows) rely on the parent killing the process
+    if hasattr(signal, "setitimer"):
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+
+
+def _serve(conn):
+    """Pool process: run tasks from `conn` until the parent goes away."""
+    import rusage
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGALRM, _on_alarm)
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    funcs = {}
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    while True:
+        try:
+            target, args, timeout = conn.recv()
+        except EOFError:
+            return
+        out, err = _PipeStream(conn, "out"), _PipeStream(conn, "err")
+        sys.stdout, sys.stderr = out, err
+        exit_code, error = 0, None
+        before = rusage.self_usage()
+        try:
+            _arm(timeout)
+            try:
+                result = _call(funcs, target, args)
+            finally:
+                _arm(0)
+            if isinstance(result, int) and not isinstance(result, bool):
+                exit_code = result
+        except TaskTimeout:
+            # Interrupted here rather than killed by the parent, so the run's usage is still reported
+            exit_code, error = -signal.SIGALRM, "TimeoutExpired"
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException as e:
+            traceback.print_exc()
+            exit_code, error = 1, f"{type(e).__name__}: {e}"
+        finally:
+            sys.stdout, sys.stderr = real_stdout, real_stderr
+        out.flush()
+        err.flush()
+        conn.send(("done", (exit_code, error, rusage.since(before))))
+
+
+class TaskPool:
+    """
+    Long-lived preforked processes that run Python task jobs.
+
+    Each process imports task modules once and keeps them, so a short task
+    costs one round trip over a pipe instead of a fork/exec of a shell.
+    Callers from any thread borrow an idle process per task. A task that
+    runs past its timeout is interrupted inside its process; a process that
+    doesn't finish the task even then, or dies, is killed and replaced.
+    """
+
+    def __init__(self, size):
+        methods = multiprocessing.get_all_start_methods()
+        # Fresh interpreters rather than forks of a threaded worker holding SQLite connections
+        self.ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(self._spawn())
+
+    def _spawn(self):
+        parent, child = self.ctx.Pipe()
+        proc = self.ctx.Process(target=_serve, args=(child,), name="flam-pytask", daemon=True)
+        proc.start()
+        child.close()
+        return proc, parent
+
+    def _replace(self, proc, conn):
+        proc.terminate()
+        proc.join(2)
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+        conn.close()
+        self.idle.put(self._spawn())
+
+    def run(self, task, capture, timeout):
+        """
+        Run (target, args), streaming its output into `capture`.
+
+        Returns (exit_code, error, usage); error is "TimeoutExpired" for a
+        task interrupted at `timeout` seconds. Returns None if the task
+        ignored that for KILL_GRACE more seconds and its process was killed.
+        """
+        proc, conn = self.idle.get()
+        deadline = time.monotonic() + timeout + (KILL_GRACE if hasattr(signal, "setitimer") else 0)
+        try:
+            conn.send((*task, timeout))
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0 or not conn.poll(left):
+                    self._replace(proc, conn)
+                    return None
+                kind, payload = conn.recv()
+                if kind == "out":
+                    capture.feed_stdout(payload)
+                elif kind == "err":
+                    capture.feed_stderr(payload)
+                else:
+                    self.idle.put((proc, conn))
+                    return payload
+        except (EOFError, OSError) as e:
+            # The task took its process down with it (os._exit, segfault, OOM kill)
+            self._replace(proc, conn)
+            return -1, f"TaskProcessDied: {str(e) or type(e).__name__}", None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(size=0):
+    """Return this process's TaskPool, starting `size` (default: CPU count) processes on first use."""
+    with _pools_lock:
+        pool = _pools.get(os.getpid())
+        if pool is None:
+            pool = _pools[os.getpid()] = TaskPool(size or os.cpu_count() or 1)
+        return pool
@@ -0,0 +1,109 @@
+import gzip, json, os, threading, time
+from job_store import open_store, JOB_COLUMNS
+
+ARCHIVE_DIR = "archive"
+COLUMN_NAMES = [c.strip() for c in JOB_COLUMNS.split(",")]
+
+
+def archive_jobs(store, max_age, states=("completed",), batch_size=1000, archive_dir=ARCHIVE_DIR, stop=None):
+    """
+    Move finished jobs last updated more than max_age seconds ago out of `jobs`.
+
+    Rows are appended to archive/jobs-YYYY-MM-DD.jsonl.gz and deleted in
+    batches of batch_size. Each batch is written and fsynced before the write
+    lock is taken, so the lock is only held for the short DELETE and workers
+    are never locked out by file I/O. A job that changed in between stays in
+    `jobs`, and a crash before the DELETE archives its batch again on the next
+    pass, so a job can appear in the archive more than once; its last line is
+    the current one. Returns the number of jobs archived.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = time.time() - max_age
+    placeholders = ",".join("?" for _ in states)
+    archived = 0
+    while stop is None or not stop.is_set():
+        rows = store.conn.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE state IN ({placeholders}) AND updated_at < ? LIMIT ?",
+            (*states, cutoff, batch_size)
+        ).fetchall()
+        if rows:
+            path = os.path.join(archive_dir, f"jobs-{time.strftime('%Y-%m-%d')}.jsonl.gz")
+            # Each batch is its own gzip member; concatenated members read back as one stream
+            with gzip.open(path, "ab") as f:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(COLUMN_NAMES, row))).encode() + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # Rechecked under the lock: a job retried or updated since the SELECT isn't deleted
+            archived += store.write(lambda conn: conn.executemany(
+                f"DELETE FROM jobs WHERE id=? AND state IN ({placeholders}) AND updated_at < ?",
+                [(r[0], *states, cutoff) for r in rows]
+            ).rowcount, wait=True)
+        if len(rows) < batch_size:
+            break
+    return archived
+
+
+def reclaim_space(store, pages=1000, vacuum=False):
+    """
+    Give up to `pages` free pages back to the OS, then checkpoint and truncate the WAL.
+
+    Databases created before incremental auto-vacuum was enabled can't free
+    pages until a full VACUUM converts them. That rewrites the whole file
+    under an exclusive lock, so it only runs when asked (vacuum=True, i.e.
+    `flam.py gc --vacuum`); otherwise "vacuum_needed" reports it.
+    """
+    conn = store.conn
+    freed = 0
+    incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    if not incremental and vacuum:
+        print("🧹 Enabling incremental auto-vacuum (one-time full VACUUM)...")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        incremental = True
+    if incremental:
+        freed = min(conn.execute("PRAGMA freelist_count").fetchone()[0], pages)
+        # executescript steps the pragma to completion; execute() would free a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"freed_pages": freed, "wal_pages": wal_pages, "wal_busy": bool(busy), "vacuum_needed": not incremental}
+
+
+def collect(store, config, states=("completed",), max_age=None, stop=None, vacuum=False):
+    """
+    Archive old jobs, evict stale cached results, compact logs and reclaim database space (on every shard).
+
+    vacuum=True lets reclaim_space() run its one-time full VACUUM; never set
+    it from a background pass.
+    """
+    from log_store import open_log_store
+    if max_age is None:
+        max_age = config.get("retention_hours", 168) * 3600
+    shards = getattr(store, "shards", [store])
+    archived = sum(archive_jobs(shard, max_age, states, config.get("gc_batch", 1000), stop=stop) for shard in shards)
+    evicted = store.evict_cache(config.get("result_cache_max_entries", 10000), config.get("result_cache_ttl", 3600))
+    segments, freed_bytes = open_log_store(store).compact()
+    spaces = [reclaim_space(shard, config.get("gc_vacuum_pages", 1000), vacuum) for shard in shards]
+    space = {"freed_pages": sum(s["freed_pages"] for s in spaces), "wal_pages": sum(s["wal_pages"] for s in spaces),
+             "wal_busy": any(s["wal_busy"] for s in spaces), "vacuum_needed": any(s["vacuum_needed"] for s in spaces)}
+    return {"archived": archived, "cache_evicted": evicted, "log_segments_removed": segments, "log_bytes_freed": freed_bytes, **space}
+
+
+class RetentionThread(threading.Thread):
+    """Run collect() every retention_interval seconds inside a worker process."""
+
+    def __init__(self, config, stop_event):
+        super().__init__(daemon=True)
+        self.config = config
+        self.stop_event = stop_event
+
+    def run(self):
+        store = open_store(config=self.config)
+        interval = self.config.get("retention_interval", 0)
+        while not self.stop_event.wait(interval):
+            try:
+                stats = collect(store, self.config, stop=self.stop_event)
+                if stats["archived"]:
+                    print(f"🧹 Retention: archived {stats['archived']} jobs, freed {stats['freed_pages']} pages")
+            except Exception as e:
+                print(f"⚠️ Retention pass failed: {e}")
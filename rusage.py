@@ -0,0 +1,217 @@
+import asyncio, os, re, subprocess, sys, time
+import sketch
+from pytask import PREFIX
+
+try:
+    import resource
+except ImportError:
+    # Windows: no rusage; runs are recorded without usage
+    resource = None
+
+# A run's usage is a tuple in the order of job_store.USAGE_COLUMNS:
+# (cpu_user_ms, cpu_sys_ms, max_rss_kb, io_read_blocks, io_write_blocks, rss_floor_kb)
+#
+# rss_floor_kb is the part of max_rss_kb the run didn't allocate itself: the
+# pool process's peak before a Python task, or the worker's own peak when it
+# spawned a shell job (see spawn_floor). A run's own peak is only known when
+# max_rss_kb is above the floor; at the floor it used that much or less.
+
+# Growth of the worker between spawn_floor() and the child's exec stays under this
+FLOOR_SLACK_KB = 1024
+
+
+def _max_rss_kb(ru):
+    # ru_maxrss is kilobytes on Linux but bytes on macOS
+    return ru.ru_maxrss // 1024 if sys.platform == "darwin" else ru.ru_maxrss
+
+
+def from_rusage(ru, floor=None):
+    """Usage tuple from a struct_rusage, with `floor` as its rss_floor_kb."""
+    return (round(ru.ru_utime * 1000), round(ru.ru_stime * 1000), _max_rss_kb(ru), ru.ru_inblock, ru.ru_oublock,
+            floor)
+
+
+def spawn_floor():
+    """
+    Smallest max RSS a shell job spawned now can report, in KiB (None where it doesn't apply).
+
+    On Linux exec records the peak RSS of the image it replaces, and a child
+    forked (or vforked) from the worker starts with the worker's, so wait4
+    reports at least the worker's own peak so far.
+    """
+    if resource is None or not sys.platform.startswith("linux"):
+        return None
+    return _max_rss_kb(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def at_floor(rss_kb, floor_kb):
+    """Whether a run's max RSS is just its inherited floor, i.e. it used that much or less itself."""
+    return floor_kb is not None and rss_kb is not None and rss_kb <= floor_kb + FLOOR_SLACK_KB
+
+
+def self_usage():
+    """This process's rusage so far (see since()), or None without the resource module."""
+    return resource.getrusage(resource.RUSAGE_SELF) if resource else None
+
+
+def since(before):
+    """
+    Usage of this process since a self_usage() snapshot.
+
+    Max RSS can't be taken apart per task: it is the process's peak so far,
+    so the peak at the snapshot is its floor.
+    """
+    if before is None:
+        return None
+    now = from_rusage(resource.getrusage(resource.RUSAGE_SELF))
+    then = from_rusage(before)
+    return now[0] - then[0], now[1] - then[1], now[2], now[3] - then[3], now[4] - then[4], then[2]
+
+
+def wait(process, timeout=None, floor=None):
+    """
+    Popen.wait() that also returns the child's usage tuple (None where os.wait4 is missing).
+
+    The child is reaped with os.wait4, which hands back the kernel's accounting
+    for that one child and every descendant it waited for, so concurrent jobs
+    on other threads don't mix in. With a timeout it polls with Popen.wait's
+    own backoff and raises subprocess.TimeoutExpired the same way. `floor` is
+    the spawn_floor() taken before the child was started.
+    """
+    if not hasattr(os, "wait4") or process.returncode is not None:
+        process.wait(timeout)
+        return None
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.0005
+    while True:
+        pid, status, ru = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return from_rusage(ru, floor)
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+        delay = min(delay * 2, left, 0.05)
+        time.sleep(delay)
+
+
+async def wait_async(process, timeout=None, floor=None):
+    """
+    wait() for a Popen child that awaits its exit instead of blocking the event loop.
+
+    On Linux the exit is watched through a pidfd on the loop itself, so a
+    running job doesn't hold a thread; elsewhere wait() runs on the loop's
+    default executor. The child is reaped with os.wait4 either way, so it
+    must not be an asyncio subprocess, whose child watcher reaps it first.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(process.pid) if hasattr(os, "wait4") and process.returncode is None else None
+    except (AttributeError, OSError):
+        # No pidfd_open (before Linux 5.3, or not Linux)
+        pidfd = None
+    if pidfd is None:
+        return await loop.run_in_executor(None, wait, process, timeout, floor)
+    try:
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await asyncio.wait_for(exited, timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(process.args, timeout) from None
+        finally:
+            loop.remove_reader(pidfd)
+    finally:
+        os.close(pidfd)
+    # Readable pidfd: the child has exited, so this doesn't block
+    return wait(process, floor=floor)
+
+
+# Parts of a command that vary between runs of the same job kind
+_VARYING = [
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "'?'"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<uuid>"),
+    (re.compile(r"\b\d+(\.\d+)?\b"), "N"),
+]
+
+
+def template_of(command):
+    """
+    Group key for a command: quoted strings, UUIDs and numbers are replaced.
+
+    "sleep 2 && echo 'hi'" -> "sleep N && echo '?'"; Python tasks group by
+    module:function, whatever their arguments.
+    """
+    if command.startswith(PREFIX):
+        return PREFIX + command[len(PREFIX):].strip().split(" ", 1)[0]
+    for pattern, replacement in _VARYING:
+        command = pattern.sub(replacement, command)
+    return command
+
+
+class _Group:
+    def __init__(self):
+        self.runs = 0
+        self.wall = self.cpu = self.io = 0.0
+        # Per-metric sketch buckets (bucket -> count) and largest value seen
+        self.sketches = {"wall": {}, "cpu": {}, "rss": {}, "io": {}}
+        self.peaks = {"wall": 0, "cpu": 0, "rss": 0, "io": 0}
+        # Largest inherited RSS floor seen, and runs whose max RSS was just that floor
+        self.rss_floor_kb = None
+        self.at_floor = 0
+
+    @property
+    def max_rss_kb(self):
+        return self.peaks["rss"]
+
+    def add(self, wall, cpu, rss_kb, io, floor_kb=None):
+        self.runs += 1
+        if floor_kb is not None:
+            self.rss_floor_kb = max(self.rss_floor_kb or 0, floor_kb)
+            self.at_floor += at_floor(rss_kb, floor_kb)
+        self.wall += wall
+        self.cpu += cpu
+        self.io += io
+        for metric, value in (("wall", wall), ("cpu", cpu), ("rss", rss_kb), ("io", io)):
+            bucket = sketch.bucket_of(value)
+            buckets = self.sketches[metric]
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+            self.peaks[metric] = max(self.peaks[metric], value)
+
+    def quantiles(self, metric, qs=(0.5, 0.95)):
+        # A bucket's representative value can sit up to 1% above the largest value in it
+        return {q: None if v is None else min(v, self.peaks[metric])
+                for q, v in sketch.quantiles(sorted(self.sketches[metric].items()), qs).items()}
+
+
+SORT_KEYS = {
+    "cpu": lambda g: g.cpu,
+    "wall": lambda g: g.wall,
+    "rss": lambda g: g.max_rss_kb,
+    "io": lambda g: g.io,
+}
+
+
+def top_commands(rows, sort="cpu", limit=20):
+    """
+    Aggregate (command, duration, *usage) rows by command template.
+
+    Returns [(template, group)] for the `limit` heaviest templates by `sort`
+    (total CPU, total wall time, peak RSS or total block I/O). Memory is
+    bounded by the number of templates, not rows. Peak RSS includes each
+    run's inherited floor, which groups report separately.
+    """
+    groups, templates = {}, {}
+    for command, duration, user_ms, sys_ms, rss_kb, io_read, io_write, floor_kb in rows:
+        template = templates.get(command)
+        if template is None:
+            template = template_of(command)
+            # Repeated commands skip the regexes; the memo is capped for queues of unique commands
+            if len(templates) < 10000:
+                templates[command] = template
+        group = groups.get(template)
+        if group is None:
+            group = groups[template] = _Group()
+        group.add(duration or 0, ((user_ms or 0) + (sys_ms or 0)) / 1000, rss_kb or 0, (io_read or 0) + (io_write or 0),
+                  floor_kb)
+    return sorted(groups.items(), key=lambda item: SORT_KEYS[sort](item[1]), reverse=True)[:limit]
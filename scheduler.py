@@ -0,0 +1,222 @@
+import threading, time, uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from job_store import open_store, DB_PATH
+
+# Most jobs one fire_due() pass materializes; a longer backlog continues on the next pass
+FIRE_BATCH = 500
+
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+MONTHS = {name: i for i, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1)}
+WEEKDAYS = {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+
+
+def _parse_field(text, lo, hi, names=None):
+    """Values of one cron field: '*', 'a', 'a-b', any of them with '/step', comma separated."""
+    values = set()
+    for part in text.lower().split(","):
+        span, _, step = part.partition("/")
+        if span == "*":
+            start, end = lo, hi
+        else:
+            first, _, last = span.partition("-")
+            start = names[first] if names and first in names else int(first)
+            end = (names[last] if names and last in names else int(last)) if last else (hi if step else start)
+        step = int(step) if step else 1
+        if not lo <= start <= end <= hi or step < 1:
+            raise ValueError(f"{part!r} is outside {lo}-{hi}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class Cron:
+    """A five-field cron expression (minute hour day-of-month month day-of-week), evaluated in UTC."""
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = MACROS.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"{expr!r} needs 5 fields (minute hour day month weekday)")
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, MONTHS)
+        # 0 and 7 are both Sunday
+        self.weekdays = frozenset(d % 7 for d in _parse_field(fields[4], 0, 7, WEEKDAYS))
+        # As in cron: when both day fields are restricted, a day matching either one fires
+        self.any_day = fields[2].startswith("*")
+        self.any_weekday = fields[4].startswith("*")
+        self.next_after(time.time())
+
+    def _day_matches(self, t):
+        in_month = t.day in self.days
+        in_week = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, ts):
+        """The first matching minute strictly after epoch seconds ts."""
+        t = datetime.fromtimestamp((int(ts) // 60 + 1) * 60, timezone.utc)
+        # Field by field, skipping whole months/days/hours that can't match
+        limit = t.year + 8
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t.timestamp()
+        raise ValueError(f"{self.expr!r} never fires")
+
+
+@lru_cache(maxsize=4096)
+def parse_cron(expr):
+    """Cron for expr, raising ValueError if it is malformed or never fires; parsed once per process."""
+    return Cron(expr)
+
+
+def format_utc(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") if ts else "-"
+
+
+class Schedules:
+    """
+    Recurring jobs, kept in the schedules table of the queue's main database.
+
+    Every schedule stores its next fire time. fire_due() enqueues a job for
+    each fire that is due and then moves next_fire_at past it, so a worker
+    that was down for a while fires what it missed when it comes back (or
+    just once, for schedules added with catchup=False).
+    """
+
+    def __init__(self, store):
+        self.store = store
+        # With shards, schedules live in shard 0; their jobs are placed like any other enqueue
+        self.db = getattr(store, "shards", [store])[0]
+
+    def add(self, cron, command, queue="default", priority=1, max_retries=3, catchup=True):
+        """Insert a schedule; returns (id, first fire time). Raises ValueError for a bad cron expression."""
+        next_fire_at = parse_cron(cron).next_after(time.time())
+        schedule_id = str(uuid.uuid4())
+        row = (schedule_id, cron, command, queue, priority, max_retries, int(catchup), next_fire_at, time.time())
+        self.db.write(lambda conn: conn.execute(
+            "INSERT INTO schedules (id, cron, command, queue, priority, max_retries, catchup, next_fire_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+        ), wait=True)
+        return schedule_id, next_fire_at
+
+    def list(self):
+        cur = self.db.conn.execute(
+            "SELECT id, cron, command, queue, priority, enabled, next_fire_at, last_fire_at FROM schedules ORDER BY created_at"
+        )
+        return cur.fetchall()
+
+    def remove(self, schedule_id):
+        """Delete a schedule; jobs it already fired stay queued. Returns whether it existed."""
+        return self.db.write(lambda conn: conn.execute(
+            "DELETE FROM schedules WHERE id=?", (schedule_id,)).rowcount == 1, wait=True)
+
+    def pause(self, schedule_id):
+        return self.db.write(lambda conn: conn.execute(
+            "UPDATE schedules SET enabled=0 WHERE id=?", (schedule_id,)).rowcount == 1, wait=True)
+
+    def resume(self, schedule_id):
+        """Re-enable a schedule from its next fire after now; times missed while paused are skipped."""
+        row = self.db.conn.execute("SELECT cron FROM schedules WHERE id=?", (schedule_id,)).fetchone()
+        if row is None:
+            return False
+        next_fire_at = parse_cron(row[0]).next_after(time.time())
+        return self.db.write(lambda conn: conn.execute(
+            "UPDATE schedules SET enabled=1, next_fire_at=? WHERE id=? AND enabled=0",
+            (next_fire_at, schedule_id)).rowcount == 1, wait=True)
+
+    def next_fire_at(self):
+        """Earliest next fire time among enabled schedules, or None."""
+        return self.db.conn.execute("SELECT MIN(next_fire_at) FROM schedules WHERE enabled=1").fetchone()[0]
+
+    def fire_due(self, now=None, limit=FIRE_BATCH):
+        """
+        Enqueue up to `limit` due fires as jobs; returns how many were enqueued.
+
+        Only schedules whose next_fire_at has passed are read (idx_schedules_due).
+        Each fire's job carries the idempotency key schedule:<id>:<fire time>,
+        and next_fire_at is only advanced after the jobs are committed, by a
+        compare-and-set on its old value. A crash in between re-fires the same
+        times, which collapse into the jobs already inserted; schedulers in
+        other processes racing for the same fire do the same, and only one of
+        them advances the schedule.
+        """
+        now = time.time() if now is None else now
+        rows = self.db.conn.execute(
+            "SELECT id, cron, command, queue, priority, max_retries, catchup, next_fire_at FROM schedules "
+            "WHERE enabled=1 AND next_fire_at <= ? ORDER BY next_fire_at LIMIT ?", (now, limit)
+        ).fetchall()
+        jobs, advances = [], []
+        for schedule_id, cron, command, queue, priority, max_retries, catchup, fire_at in rows:
+            cron = parse_cron(cron)
+            if catchup:
+                fires, t = [], fire_at
+                while t <= now and len(jobs) + len(fires) < limit:
+                    fires.append(t)
+                    t = cron.next_after(t)
+                if not fires:
+                    break
+            else:
+                fires, t = [fire_at], cron.next_after(now)
+            jobs.extend({"command": command, "queue": queue, "priority": priority, "max_retries": max_retries,
+                         "run_at": f, "idempotency_key": f"schedule:{schedule_id}:{int(f)}"} for f in fires)
+            advances.append((t, fires[-1], schedule_id, fire_at))
+        if not jobs:
+            return 0
+        for _ in self.store.enqueue_many(jobs):
+            pass
+        self.db.write(lambda conn: conn.executemany(
+            "UPDATE schedules SET next_fire_at=?, last_fire_at=? WHERE id=? AND next_fire_at=?", advances
+        ), wait=True)
+        return len(jobs)
+
+
+class Scheduler(threading.Thread):
+    """
+    Fire due schedules from inside a worker process (config: scheduler).
+
+    Sleeps until the earliest next_fire_at, waking at least every
+    poll_interval seconds to notice schedules added in the meantime. Each
+    wake is one lookup in idx_schedules_due; the schedules that aren't due
+    are never read. Any number of workers may run one.
+    """
+
+    def __init__(self, config, stop_event, db_path=DB_PATH):
+        super().__init__(daemon=True, name="flam-scheduler")
+        self.config = config
+        self.stop_event = stop_event
+        self.db_path = db_path
+
+    def run(self):
+        schedules = Schedules(open_store(self.db_path, self.config))
+        poll = self.config.get("poll_interval", 1)
+        while not self.stop_event.is_set():
+            try:
+                fired = schedules.fire_due()
+                if fired:
+                    print(f"🗓️ Scheduler enqueued {fired} jobs")
+                next_fire_at = schedules.next_fire_at()
+            except Exception as e:
+                print(f"⚠️ Scheduler pass failed: {e}")
+                next_fire_at = None
+            wait = poll if next_fire_at is None else min(poll, max(next_fire_at - time.time(), 0))
+            self.stop_event.wait(wait)
@@ -0,0 +1,303 @@
+import heapq, itertools, os, random, time, zlib
+import sketch
+from job_store import JobStore, DB_PATH, DEFAULT_LEASE, cache_key_for, job_row, summarize
+from log_store import LogStore
+from dlq import DLQ
+from notify import get_wakeup
+
+
+def shard_paths(db_path, count):
+    """queue.db, queue.shard1.db, ... for `count` shards, plus any higher shards left by a larger count."""
+    root, ext = os.path.splitext(db_path)
+    paths = [db_path] + [f"{root}.shard{i}{ext}" for i in range(1, count)]
+    # Lowering `shards` must not strand jobs: leftover shards are still claimed from and listed
+    while os.path.exists(f"{root}.shard{len(paths)}{ext}"):
+        paths.append(f"{root}.shard{len(paths)}{ext}")
+    return paths
+
+
+def _per_job(name, forget=False):
+    """A method forwarding JobStore.<name>(job_id, ...) to the shard holding job_id."""
+    def method(self, job_id, *args, **kwargs):
+        shard = self.shard_of(job_id)
+        if forget:
+            self._owner.pop(job_id, None)
+        return None if shard is None else getattr(shard, name)(job_id, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = f"JobStore.{name}() on the shard holding job_id."
+    return method
+
+
+class ShardedJobStore:
+    """
+    The JobStore interface over several SQLite files, so writes to different shards never wait on each other.
+
+    Shard 0 is db_path itself and shard i is <root>.shard<i><ext>; each is a
+    complete JobStore (jobs, DLQ, result cache, log index, metrics). New jobs
+    go to a shard chosen by shard_by:
+
+      "job"    spread evenly; jobs with an idempotency key, or cache=True,
+               are placed by hashing the key (or command) so duplicates meet
+      "queue"  by hashing the queue name, so each queue (and its limits and
+               weights) lives in exactly one shard
+
+    claim() walks the shards from the next one in turn ("round_robin") or
+    from a fixed shard per worker ("affinity"), moving on until it has n
+    jobs. Calls about one job go to the shard that holds it.
+    """
+
+    def __init__(self, db_path=DB_PATH, count=2, shard_by="job", claim_order="round_robin"):
+        self.db_path = db_path
+        self.shards = [JobStore(path, wakeup_path=db_path) for path in shard_paths(db_path, count)]
+        # Only the first `count` shards take new jobs
+        self.count = count
+        self.shard_by = shard_by
+        self.claim_order = claim_order
+        self.wakeup = self.shards[0].wakeup
+        self.limited = False
+        self._next = random.randrange(len(self.shards))
+        # Shard of each job claimed through this store, so its outcome needn't be searched for
+        self._owner = {}
+
+    def _target(self, idempotency_key, cache_key, queue):
+        if self.shard_by == "queue":
+            key = queue or "default"
+        elif idempotency_key is not None:
+            key = "key:" + idempotency_key
+        elif cache_key is not None:
+            key = cache_key
+        else:
+            return self.shards[random.randrange(self.count)]
+        return self.shards[zlib.crc32(key.encode()) % self.count]
+
+    def shard_of(self, job_id):
+        """Shard holding job_id in its jobs table or DLQ, or None."""
+        shard = self._owner.get(job_id)
+        if shard is not None:
+            return shard
+        for shard in self.shards:
+            if shard.conn.execute("SELECT 1 FROM jobs WHERE id=? UNION ALL SELECT 1 FROM dlq WHERE id=?",
+                                  (job_id, job_id)).fetchone():
+                return shard
+        return None
+
+    def enqueue(self, command, max_retries=3, priority=1, run_at=0, idempotency_key=None, cache=False, queue="default"):
+        shard = self._target(idempotency_key, cache_key_for(command) if cache else None, queue)
+        return shard.enqueue(command, max_retries, priority, run_at, idempotency_key, cache, queue)
+
+    def enqueue_many(self, jobs, chunk_size=1000):
+        chunk = []
+        for job in jobs:
+            chunk.append(job_row(job))
+            if len(chunk) >= chunk_size:
+                yield from self._insert_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._insert_chunk(chunk)
+
+    def _insert_chunk(self, chunk):
+        """One transaction per shard the chunk touches; ids come back in input order."""
+        by_shard = {}
+        for i, row in enumerate(chunk):
+            by_shard.setdefault(self._target(row[7], row[8], row[9]), []).append(i)
+        ids = [None] * len(chunk)
+        for shard, positions in by_shard.items():
+            for i, job_id in zip(positions, shard._insert_chunk([chunk[i] for i in positions])):
+                ids[i] = job_id
+        return ids
+
+    def claim(self, worker_id, n=1, queues=None, limits=None, lease=DEFAULT_LEASE):
+        """
+        JobStore.claim() shard by shard until n jobs are claimed.
+
+        Queue weights and limits apply within each shard; with shard_by
+        "queue" that is the same as across the whole queue.
+        """
+        k = len(self.shards)
+        if self.claim_order == "affinity":
+            start = zlib.crc32(str(worker_id).encode()) % k
+        else:
+            start = self._next
+            self._next = (start + 1) % k
+        names = [q for q, _ in queues] if queues else None
+        jobs, limited = [], False
+        now = time.time()
+        for i in range(k):
+            shard = self.shards[(start + i) % k]
+            due = shard.next_due_at(names)
+            # An index-only read; skips taking the write lock of a shard with nothing due
+            if due is None or due > now:
+                continue
+            claimed = shard.claim(worker_id, n - len(jobs), queues, limits, lease)
+            for job in claimed:
+                self._owner[job[0]] = shard
+            jobs.extend(claimed)
+            limited = limited or shard.limited
+            if len(jobs) >= n:
+                break
+        self.limited = limited
+        return jobs
+
+    def _group(self, job_ids):
+        """job_ids by the shard that claimed them here; ids claimed elsewhere go to every shard."""
+        groups, unknown = {}, []
+        for job_id in job_ids:
+            shard = self._owner.get(job_id)
+            if shard is None:
+                unknown.append(job_id)
+            else:
+                groups.setdefault(shard, []).append(job_id)
+        if unknown:
+            # A conditional UPDATE per shard is cheaper than locating each job first
+            for shard in self.shards:
+                groups.setdefault(shard, []).extend(unknown)
+        return groups
+
+    def release(self, job_ids):
+        for shard, ids in self._group(job_ids).items():
+            shard.release(ids)
+        for job_id in job_ids:
+            self._owner.pop(job_id, None)
+
+    def extend_leases(self, job_ids, lease=DEFAULT_LEASE):
+        for shard, ids in self._group(job_ids).items():
+            shard.extend_leases(ids, lease)
+
+    def expired_leases(self, limit=1000):
+        jobs = []
+        for shard in self.shards:
+            jobs.extend(shard.expired_leases(limit - len(jobs)))
+            if len(jobs) >= limit:
+                break
+        return jobs
+
+    get_job = _per_job("get_job")
+    take_expired = _per_job("take_expired")
+    cached_result = _per_job("cached_result")
+    cache_result = _per_job("cache_result")
+    record_run = _per_job("record_run")
+    remove_from_dlq = _per_job("remove_from_dlq")
+    # After these the job is out of this worker's hands
+    complete_from_cache = _per_job("complete_from_cache", forget=True)
+    update_job_state = _per_job("update_job_state", forget=True)
+    move_to_dlq = _per_job("move_to_dlq", forget=True)
+    schedule_retry = _per_job("schedule_retry", forget=True)
+
+    def next_due_at(self, queues=None):
+        due = [d for d in (shard.next_due_at(queues) for shard in self.shards) if d is not None]
+        return min(due) if due else None
+
+    def list_jobs(self, state=None):
+        return list(self.iter_jobs(state=state))
+
+    def iter_usage(self, since=0):
+        return itertools.chain.from_iterable(shard.iter_usage(since) for shard in self.shards)
+
+    def iter_jobs(self, limit=None, after=None, page_size=1000, **filters):
+        cursor = (float("-inf"), "")
+        if after is not None:
+            cursor = self.cursor_of(after)
+            if cursor is None:
+                return iter(())
+        return self.iter_from(cursor, limit, page_size, **filters)
+
+    def cursor_of(self, job_id):
+        shard = self.shard_of(job_id)
+        return None if shard is None else shard.cursor_of(job_id)
+
+    def iter_from(self, cursor, limit=None, page_size=1000, **filters):
+        merged = heapq.merge(*(shard.iter_from(cursor, limit, page_size, **filters) for shard in self.shards),
+                             key=lambda j: (j[5], j[0]))
+        return itertools.islice(merged, limit)
+
+    def page_jobs(self, limit=50, before=None, state=None):
+        merged = heapq.merge(*(shard.page_jobs(limit, before, state) for shard in self.shards),
+                             key=lambda j: (j[5], j[0]), reverse=True)
+        return list(itertools.islice(merged, limit))
+
+    def changed_since(self, since, limit=1000):
+        jobs = []
+        for shard in self.shards:
+            jobs.extend(shard.changed_since(since, limit - len(jobs)))
+            if len(jobs) >= limit:
+                break
+        return jobs
+
+    def metrics(self):
+        return summarize(*self.raw_metrics())
+
+    def raw_metrics(self):
+        counts, dur_sum, dur_count, durations, waits = {}, 0, 0, [], []
+        for shard in self.shards:
+            c, s, n, d, w = shard.raw_metrics()
+            for state, k in c.items():
+                counts[state] = counts.get(state, 0) + k
+            dur_sum, dur_count = dur_sum + s, dur_count + n
+            durations.append(d)
+            waits.append(w)
+        return counts, dur_sum, dur_count, sketch.merge(*durations), sketch.merge(*waits)
+
+    def sketch_buckets(self, metric):
+        return sketch.merge(*(shard.sketch_buckets(metric) for shard in self.shards))
+
+    def percentiles(self, metric, qs=(0.5, 0.95, 0.99)):
+        return sketch.quantiles(self.sketch_buckets(metric), qs)
+
+    def dlq_count(self):
+        return sum(shard.dlq_count() for shard in self.shards)
+
+    def evict_cache(self, max_entries, ttl):
+        """JobStore.evict_cache() on every shard; max_entries applies per shard."""
+        return sum(shard.evict_cache(max_entries, ttl) for shard in self.shards)
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def check_query_plans(self):
+        return {f"{shard.db_path}:{name}": plan
+                for shard in self.shards for name, plan in shard.check_query_plans().items()}
+
+
+class ShardedLogStore(LogStore):
+    """LogStore whose index rows live in their job's shard; segment files are shared by all shards."""
+
+    def __init__(self, store, **kwargs):
+        super().__init__(None, **kwargs)
+        self.store = store
+
+    def _conn_for(self, job_id):
+        return (self.store.shard_of(job_id) or self.store.shards[0]).conn
+
+    def _write_for(self, job_id):
+        return (self.store.shard_of(job_id) or self.store.shards[0]).write
+
+    def _conns(self):
+        return [shard.conn for shard in self.store.shards]
+
+
+class ShardedDLQ(DLQ):
+    """
+    DLQ commands across every shard.
+
+    Pages merge the shards in (moved_at, id) order; retry_where() and
+    purge_where() run one transaction per shard.
+    """
+
+    def __init__(self, db_path=DB_PATH, count=2):
+        self.parts = [DLQ(path, wakeup_path=db_path) for path in shard_paths(db_path, count) if os.path.exists(path)]
+        self.wakeup = get_wakeup(db_path)
+
+    def cursor_of(self, job_id):
+        return next(filter(None, (part.cursor_of(job_id) for part in self.parts)), None)
+
+    def iter_from(self, cursor, limit=None, page_size=1000, **filters):
+        merged = heapq.merge(*(part.iter_from(cursor, limit, page_size, **filters) for part in self.parts),
+                             key=lambda row: (row[5], row[0]))
+        return itertools.islice(merged, limit)
+
+    def retry_where(self, **filters):
+        return sum(part.retry_where(**filters) for part in self.parts)
+
+    def purge_where(self, **filters):
+        return sum(part.purge_where(**filters) for part in self.parts)
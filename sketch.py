@@ -0,0 +1,51 @@
+import math
+
+# Log-bucketed quantile sketch (DDSketch-style). A value v lands in bucket
+# ceil(log(v) / log(GAMMA)); every value in a bucket is within RELATIVE_ACCURACY
+# of the bucket's representative value, so quantiles are accurate to ~1% while
+# the number of buckets only grows with the log of the value range.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Values below this (including 0) share the lowest bucket
+MIN_VALUE = 1e-4
+
+
+def bucket_of(value):
+    return math.ceil(math.log(max(value, MIN_VALUE)) / LOG_GAMMA)
+
+
+def value_of(bucket):
+    """Representative value of a bucket (midpoint in relative terms)."""
+    return 2 * GAMMA ** bucket / (GAMMA + 1)
+
+
+def merge(*sketches):
+    """Combine (bucket, count) lists from several sketches into one, sorted by bucket."""
+    total = {}
+    for buckets in sketches:
+        for bucket, n in buckets:
+            total[bucket] = total.get(bucket, 0) + n
+    return sorted(total.items())
+
+
+def quantiles(buckets, qs=(0.5, 0.95, 0.99)):
+    """
+    Estimate quantiles from (bucket, count) pairs sorted by bucket.
+
+    Returns {q: value} with None for every q when the sketch is empty.
+    """
+    buckets = list(buckets)
+    total = sum(n for _, n in buckets)
+    if total == 0:
+        return {q: None for q in qs}
+    result = {}
+    for q in qs:
+        rank = q * (total - 1)
+        seen = 0
+        for bucket, n in buckets:
+            seen += n
+            if seen > rank:
+                result[q] = value_of(bucket)
+                break
+    return result
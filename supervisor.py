@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from worker import Worker, start_background
+from config import load_config
+from instrumentation import start_sidecar
+
+
+def run_worker_process(slot, threads, stop, processed, queues=None):
+    """Child entry point: run `threads` Worker threads until the supervisor sets `stop`."""
+    # Ctrl+C reaches the whole process group; let the supervisor decide when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parent = os.getppid()
+    config = load_config()
+    port = config.get("metrics_port", 0)
+    if port:
+        # Each child gets its own port so every process can be scraped separately
+        start_sidecar(port + slot)
+    stop_event = threading.Event()
+    if slot == 1:
+        # One child runs retention and the scheduler, and brings them back when it is restarted
+        start_background(config, stop_event)
+    workers = [Worker(f"{slot}.{i+1}", stop_event, queues) for i in range(threads)]
+    for w in workers:
+        w.start()
+    while not stop.value:
+        time.sleep(0.5)
+        processed.value = sum(w.processed for w in workers)
+        if os.getppid() != parent:
+            # Supervisor was killed outright; don't linger as an orphan
+            break
+    stop_event.set()
+    workers[0].store.wakeup.notify_local()
+    for w in workers:
+        w.join()
+    processed.value = sum(w.processed for w in workers)
+
+
+class Supervisor:
+    """Run P worker processes with T Worker threads each, restarting children that die."""
+
+    def __init__(self, processes, threads, report_interval=10, restart_delay=1, queues=None):
+        self.processes = processes
+        self.threads = threads
+        self.queues = queues
+        self.report_interval = report_interval
+        self.restart_delay = restart_delay
+        self.ctx = multiprocessing.get_context()
+        # A plain shared flag rather than an Event: Event.set() can block forever
+        # waiting on a child that was SIGKILLed while sleeping on it.
+        self.stop = self.ctx.Value("b", 0)
+        self.children = {}
+        # Jobs finished by earlier incarnations of a slot, so restarts don't reset its count
+        self.carried = {}
+
+    def _spawn(self, slot):
+        processed = self.ctx.Value("q", 0)
+        proc = self.ctx.Process(
+            target=run_worker_process,
+            args=(slot, self.threads, self.stop, processed, self.queues),
+            name=f"flam-worker-{slot}",
+        )
+        proc.start()
+        self.children[slot] = (proc, processed)
+        print(f"🚀 Worker process {slot} started (pid={proc.pid}, threads={self.threads})")
+
+    def _processed(self, slot):
+        return self.carried.get(slot, 0) + self.children[slot][1].value
+
+    def run(self):
+        for slot in range(1, self.processes + 1):
+            self._spawn(slot)
+        started = time.time()
+        last_report, last_counts = started, {slot: 0 for slot in self.children}
+        try:
+            while True:
+                time.sleep(0.5)
+                for slot, (proc, processed) in list(self.children.items()):
+                    if not proc.is_alive():
+                        print(f"💥 Worker process {slot} (pid={proc.pid}) exited with code {proc.exitcode} — restarting")
+                        self.carried[slot] = self.carried.get(slot, 0) + processed.value
+                        time.sleep(self.restart_delay)
+                        self._spawn(slot)
+                now = time.time()
+                if now - last_report >= self.report_interval:
+                    self._report(now - last_report, last_counts)
+                    last_report = now
+                    last_counts = {slot: self._processed(slot) for slot in self.children}
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping worker processes...")
+            self.stop.value = 1
+            for proc, _ in self.children.values():
+                proc.join()
+            total = sum(self._processed(slot) for slot in self.children)
+            elapsed = time.time() - started
+            print(f"🛑 All worker processes stopped. {total} jobs in {elapsed:.1f}s "
+                  f"({total / elapsed if elapsed else 0:.1f} jobs/s)")
+
+    def _report(self, interval, last_counts):
+        rows = []
+        for slot, (proc, _) in sorted(self.children.items()):
+            done = self._processed(slot)
+            rate = (done - last_counts.get(slot, 0)) / interval
+            rows.append(f"P{slot}(pid={proc.pid}): {done} jobs, {rate:.1f}/s")
+        print("📊 " + " | ".join(rows))
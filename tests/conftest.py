@@ -0,0 +1,23 @@
+import os, subprocess, sys
+import pytest
+
+# The modules live at the repository root, next to flam.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in an empty directory, where queue.db, config.json and logs/ are created."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def flam(workdir):
+    """Run `python flam.py <args>` in the test's directory and return the CompletedProcess."""
+    def run(*args, input=None):
+        return subprocess.run([sys.executable, os.path.join(ROOT, "flam.py"), *args], input=input,
+                              capture_output=True, text=True, encoding="utf-8", timeout=60,
+                              env={**os.environ, "PYTHONIOENCODING": "utf-8"})
+    return run
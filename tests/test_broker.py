@@ -0,0 +1,62 @@
+import json, threading, time
+import pytest
+from broker import BrokerClient, BrokerError, RemoteWorker, make_server
+from job_store import JobStore
+
+
+@pytest.fixture
+def broker(workdir, monkeypatch):
+    monkeypatch.setenv("FLAM_BROKER_TOKEN", "s3cret")
+    (workdir / "config.json").write_text(json.dumps({"poll_interval": 0.1, "scheduler": 0}))
+    server = make_server("127.0.0.1", 0, str(workdir / "queue.db"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def address(server):
+    return "%s:%d" % server.server_address
+
+
+def wait_for(check, timeout=30):
+    deadline = time.time() + timeout
+    while not check():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_remote_worker_runs_jobs_through_the_broker(broker, workdir):
+    client = BrokerClient(address(broker), "s3cret")
+    ok = client.enqueue("echo remote-hello")
+    failing = client.enqueue("echo about to fail; exit 3", max_retries=0)
+
+    stop = threading.Event()
+    worker = RemoteWorker(1, stop, address(broker))
+    worker.start()
+    store = JobStore(str(workdir / "queue.db"))
+    try:
+        wait_for(lambda: store.get_job(ok)[2] == "completed" and store.get_job(failing)[2] == "dead")
+    finally:
+        stop.set()
+        worker.join(15)
+
+    assert store.get_job(ok)[10] == 0 and store.get_job(failing)[10] == 3
+    assert store.conn.execute("SELECT error FROM dlq WHERE id=?", (failing,)).fetchone() == ("ExitCode:3",)
+    # Both runs' output was uploaded into the broker's log store
+    broker.broker.store.flush()
+    assert b"remote-hello" in broker.broker.logs.tail(ok, 5)
+    assert b"about to fail" in broker.broker.logs.tail(failing, 5)
+
+
+@pytest.mark.parametrize("token", ["", "wrong"])
+def test_requests_without_the_token_are_refused(broker, workdir, token):
+    with pytest.raises(BrokerError, match="token"):
+        BrokerClient(address(broker), token).enqueue("echo sneaky")
+    assert JobStore(str(workdir / "queue.db")).list_jobs() == []
+
+
+def test_broker_needs_a_token(workdir, monkeypatch):
+    monkeypatch.delenv("FLAM_BROKER_TOKEN", raising=False)
+    with pytest.raises(ValueError, match="broker_token"):
+        make_server("127.0.0.1", 0, str(workdir / "queue.db"))
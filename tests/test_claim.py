@@ -0,0 +1,48 @@
+import multiprocessing, time
+from job_store import JobStore
+
+
+def claim_until_empty(worker_id, barrier, results):
+    store = JobStore()
+    barrier.wait()
+    claimed = []
+    while True:
+        jobs = store.claim(worker_id, n=3)
+        if not jobs:
+            break
+        claimed += [job[0] for job in jobs]
+        # Let the other workers in between claims
+        time.sleep(0.001)
+    results.put(claimed)
+
+
+def test_concurrent_workers_never_claim_the_same_job(workdir):
+    store = JobStore()
+    ids = [store.enqueue(f"echo {i}") for i in range(200)]
+    ctx = multiprocessing.get_context("spawn")
+    barrier, results = ctx.Barrier(4), ctx.Queue()
+    workers = [ctx.Process(target=claim_until_empty, args=(f"w{i}", barrier, results)) for i in range(4)]
+    for p in workers:
+        p.start()
+    claimed = [results.get(timeout=60) for _ in workers]
+    for p in workers:
+        p.join()
+
+    # Every job claimed exactly once
+    assert sorted(job_id for batch in claimed for job_id in batch) == sorted(ids)
+    assert {job[2] for job in store.list_jobs()} == {"processing"}
+
+
+def test_claim_takes_due_jobs_by_priority(workdir):
+    store = JobStore()
+    low = store.enqueue("echo low")
+    high = store.enqueue("echo high", priority=5)
+    store.enqueue("echo later", run_at=time.time() + 3600)
+
+    jobs = store.claim("w1", n=5)
+    assert [job[0] for job in jobs] == [high, low]
+    assert {job[2] for job in jobs} == {"processing"}
+    assert store.claim("w1", n=5) == []
+
+    store.release([low])
+    assert [job[0] for job in store.claim("w2")] == [low]
@@ -0,0 +1,62 @@
+import importlib, json, sys, time
+
+import pytest
+
+from job_store import JobStore
+
+
+@pytest.fixture
+def dashboard(workdir):
+    # dashboard.py opens its stores relative to the working directory at import time
+    sys.modules.pop("dashboard", None)
+    return importlib.import_module("dashboard")
+
+
+def test_jobs_api_pages_newest_first_without_gaps(workdir, dashboard):
+    store = JobStore(str(workdir / "queue.db"))
+    for i in range(7):
+        store.enqueue(f"echo {i}")
+    expected = [j[0] for j in sorted(store.list_jobs(), key=lambda j: (j[5], j[0]), reverse=True)]
+    client, seen, after = dashboard.app.test_client(), [], None
+    while True:
+        page = client.get("/api/jobs?limit=3" + (f"&after={after}" if after else "")).get_json()
+        seen += [job["id"] for job in page["jobs"]]
+        after = page["next"]
+        if after is None:
+            break
+    assert seen == expected
+
+
+def test_summary_is_cached_with_an_etag(workdir, dashboard):
+    JobStore(str(workdir / "queue.db")).enqueue("echo hi")
+    client = dashboard.app.test_client()
+    first = client.get("/api/summary")
+    assert first.get_json()["total"] == 1
+    again = client.get("/api/summary", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+
+
+def test_event_feed_publishes_only_changed_jobs(workdir, dashboard):
+    store = JobStore(str(workdir / "queue.db"))
+    a, b = store.enqueue("echo a"), store.enqueue("echo b")
+    feed = dashboard.EventFeed()
+    feed.since = 0
+    feed.poll()
+    assert {job["id"] for job in json.loads(feed.events[-1][2])} == {a, b}
+
+    seq = feed.seq
+    time.sleep(0.01)
+    store.update_job_state(b, "completed")
+    feed.poll()
+    events = {event: json.loads(data) for s, event, data in feed.events if s > seq}
+    assert [job["id"] for job in events["jobs"]] == [b]
+    assert events["metrics"]["completed"] == 1
+
+
+def test_changed_since_returns_recent_updates(workdir):
+    store = JobStore(str(workdir / "queue.db"))
+    a, b = store.enqueue("echo a"), store.enqueue("echo b")
+    since = time.time()
+    time.sleep(0.01)
+    store.update_job_state(a, "completed")
+    assert [job[0] for job in store.changed_since(since)] == [a]
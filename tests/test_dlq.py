@@ -0,0 +1,103 @@
+import time
+import pytest
+from dlq import DLQ
+from job_store import JobStore
+
+
+@pytest.fixture
+def store(workdir):
+    return JobStore()
+
+
+def kill(store, command, error, **kwargs):
+    """Enqueue a job and move it to the DLQ the way a worker does once its retries are used up."""
+    job_id = store.enqueue(command, **kwargs)
+    store.move_to_dlq(job_id, error)
+    return job_id
+
+
+def test_retry_where_moves_only_matching_jobs(store):
+    exit_1 = kill(store, "make build", "ExitCode:1")
+    exit_2 = kill(store, "make test", "ExitCode:2")
+    timeout = kill(store, "make build", "TimeoutExpired")
+    dlq = DLQ()
+
+    assert dlq.retry_where(error="ExitCode:*", command_prefix="make b") == 1
+    assert store.get_job(exit_1)[2:4] == ("pending", 0)
+    assert [row[0] for row in dlq.list_dlq()] == [exit_2, timeout]
+    assert store.get_job(exit_2)[2] == "dead"
+    assert dlq.retry_where(error="nothing*") == 0
+
+
+def test_retry_where_by_moved_at(store):
+    old = kill(store, "echo old", "ExitCode:1")
+    cutoff = time.time()
+    new = kill(store, "echo new", "ExitCode:1")
+    dlq = DLQ()
+
+    assert dlq.retry_where(since=cutoff) == 1
+    assert store.get_job(new)[2] == "pending"
+    assert [row[0] for row in dlq.list_dlq()] == [old]
+
+
+def test_retry_recreates_an_archived_job(store):
+    job_id = kill(store, "convert a.png", "ExitCode:1", max_retries=7, priority=5, queue="img")
+    # Archived: the row is gone from jobs, only the DLQ copy is left
+    store.conn.execute("DELETE FROM jobs WHERE id=?", (job_id,))
+    store.conn.commit()
+
+    assert DLQ().retry_where(ids=[job_id]) == 1
+    assert store.get_job(job_id)[1:5] == ("convert a.png", "pending", 0, 7)
+    assert store.conn.execute("SELECT queue, priority FROM jobs WHERE id=?", (job_id,)).fetchone() == ("img", 5)
+    assert store.conn.execute("SELECT COUNT(*) FROM dlq").fetchone()[0] == 0
+
+
+def test_purge_where(store):
+    kill(store, "make build", "ExitCode:1")
+    keep = kill(store, "make test", "TimeoutExpired")
+    dlq = DLQ()
+
+    assert dlq.purge_where(error="ExitCode:*") == 1
+    assert [row[0] for row in dlq.list_dlq()] == [keep]
+
+
+def test_iter_dlq_pages(store):
+    ids = [kill(store, f"echo {i}", "ExitCode:1") for i in range(7)]
+    dlq = DLQ()
+    assert [row[0] for row in dlq.iter_dlq(page_size=2)] == ids
+    assert [row[0] for row in dlq.list_dlq(limit=3, after=ids[1])] == ids[2:5]
+
+
+def test_dlq_commands(store, flam):
+    failed = kill(store, "make build", "ExitCode:1")
+    timed_out = kill(store, "make test", "TimeoutExpired")
+
+    listed = flam("dlq", "list", "--error", "Timeout*")
+    assert timed_out in listed.stdout and failed not in listed.stdout
+    assert flam("dlq", "retry-all", "--error", "ExitCode:*").returncode == 0
+    assert store.get_job(failed)[2] == "pending"
+    assert flam("dlq", "purge", "--yes").returncode == 0
+    assert DLQ().list_dlq() == []
+
+
+def test_dlq_commands_reject_a_malformed_date(store, flam):
+    kill(store, "make build", "ExitCode:1")
+    for command in (["list"], ["retry-all"], ["purge", "--yes"]):
+        result = flam("dlq", *command, "--until", "soon")
+        assert "Invalid --since/--until format" in result.stdout and "Traceback" not in result.stderr
+    assert len(DLQ().list_dlq()) == 1
+
+
+def test_dlq_commands_on_a_new_database(workdir, flam):
+    for command in (["list"], ["retry-all"], ["purge", "--yes"]):
+        result = flam("dlq", *command)
+        assert result.returncode == 0 and "Traceback" not in result.stderr
+    assert DLQ().list_dlq() == []
+
+
+def test_dlq_migrates_an_old_database(workdir):
+    from test_job_store import create_v0
+    create_v0("queue.db")
+    assert [row[0] for row in DLQ().list_dlq()] == ["c"]
+    assert DLQ().retry_where(ids=["c"]) == 1
+    assert JobStore().get_job("c")[2] == "pending"
@@ -0,0 +1,105 @@
+import sqlite3
+import pytest
+from job_store import JobStore
+
+
+def test_enqueue_many_commits_chunk_by_chunk(workdir):
+    store = JobStore()
+    jobs = iter(["echo a", {"command": "echo b", "priority": 5, "max_retries": 7}, "echo c"])
+    ids = store.enqueue_many(jobs, chunk_size=2)
+
+    first = next(ids)
+    # The first chunk is committed (visible to other connections) before the rest is read
+    other = sqlite3.connect("queue.db")
+    assert other.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 2
+    assert next(jobs) == "echo c"
+    # The generator stops with the input; "echo c" was taken by the test, not enqueued
+    rest = list(ids)
+
+    rows = {job[1]: job for job in store.list_jobs()}
+    assert [first, *rest] == [rows["echo a"][0], rows["echo b"][0]]
+    assert rows["echo b"][2:5] == ("pending", 0, 7) and rows["echo b"][8] == 5
+
+
+def test_enqueue_batch_command(flam):
+    lines = "\n".join([
+        "echo plain",
+        '{"command": "echo json", "priority": 4, "run_at": "2030-01-01T00:00:00Z"}',
+        "",
+        '{"priority": 2}',
+        "{not json",
+    ])
+    result = flam("enqueue-batch", "--chunk-size", "2", input=lines)
+    assert result.returncode == 0, result.stderr
+    ids = result.stdout.split()
+    assert len(ids) == 2
+    assert "Skipping line 4" in result.stderr and "Skipping line 5" in result.stderr
+
+    rows = sqlite3.connect("queue.db").execute("SELECT id, command, priority, next_run_at FROM jobs").fetchall()
+    by_command = {command: (job_id, priority, run_at) for job_id, command, priority, run_at in rows}
+    assert by_command["echo plain"][:2] == (ids[0], 1)
+    assert by_command["echo json"][:2] == (ids[1], 4) and by_command["echo json"][2] > 0
+
+
+def test_idempotency_keys_collapse_duplicates(workdir):
+    store = JobStore()
+    # ENQUEUE_SQL's ON CONFLICT target needs this unique partial index
+    indexes = {row[1]: (row[2], row[4]) for row in store.conn.execute("PRAGMA index_list(jobs)")}
+    assert indexes["idx_jobs_idempotency"] == (1, 1)
+    first = store.enqueue("echo a", idempotency_key="k1")
+    assert store.enqueue("echo again", idempotency_key="k1") == first
+
+    ids = list(store.enqueue_many([
+        {"command": "echo b", "idempotency_key": "k2"},
+        {"command": "echo a", "idempotency_key": "k1"},
+        "echo c",
+        {"command": "echo b again", "idempotency_key": "k2"},
+    ]))
+    assert ids[1] == first and ids[3] == ids[0]
+    assert sorted(job[1] for job in store.list_jobs()) == ["echo a", "echo b", "echo c"]
+
+
+def test_invalid_rows_raise_instead_of_vanishing(workdir):
+    store = JobStore()
+    with pytest.raises(sqlite3.IntegrityError):
+        store.enqueue(None)
+    with pytest.raises(sqlite3.IntegrityError):
+        list(store.enqueue_many(["echo a", {"command": None}, {"command": "echo k", "idempotency_key": "k"}]))
+    # The whole chunk is rolled back, so no id was handed out for a row that isn't there
+    assert store.list_jobs() == []
+
+
+def test_enqueue_batch_rejects_invalid_jobs(flam):
+    lines = "\n".join([
+        '{"command": null}',
+        '{"command": ""}',
+        '{"command": 42}',
+        '{"python": 7}',
+        '{"python": "tasks:resize", "args": "640"}',
+        '{"command": "echo ok", "idempotency_key": "k"}',
+        '{"command": "echo dup", "idempotency_key": "k"}',
+    ])
+    result = flam("enqueue-batch", input=lines)
+    assert result.returncode == 0, result.stderr
+    assert all(f"Skipping line {n}" in result.stderr for n in range(1, 6))
+    ids = result.stdout.split()
+    assert len(ids) == 2 and ids[0] == ids[1]
+    rows = sqlite3.connect("queue.db").execute("SELECT id, command FROM jobs").fetchall()
+    assert rows == [(ids[0], "echo ok")]
+
+
+def test_cached_results(workdir):
+    store = JobStore()
+    source = store.enqueue("make report", cache=True)
+    store.cache_result(source, 2.5)
+    store.update_job_state(source, "completed", last_duration=2.5, last_exit_code=0)
+
+    again, uncached = store.enqueue("make report", cache=True), store.enqueue("make report")
+    assert store.cached_result(again, ttl=3600) == (source, 0, 2.5)
+    assert store.cached_result(uncached, ttl=3600) is None
+    assert store.cached_result(again, ttl=0) is None
+
+    store.complete_from_cache(again, source, 0)
+    assert store.get_job(again)[2:3] == ("completed",)
+    assert store.evict_cache(max_entries=0, ttl=3600) == 1
+    assert store.cached_result(store.enqueue("make report", cache=True), ttl=3600) is None
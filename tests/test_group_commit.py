@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+from group_commit import GroupWriter
+from instrumentation import COMMITS_TOTAL
+from job_store import JobStore, connect
+from notify import get_wakeup
+
+
+@pytest.fixture
+def writer(workdir):
+    db = str(workdir / "queue.db")
+    JobStore(db)
+    writer = GroupWriter(db, get_wakeup(db), latency=0.5)
+    writer.start()
+    writer.db = db
+    return writer
+
+
+def insert(job_id):
+    def fn(conn):
+        conn.execute("INSERT INTO jobs (id, command, state, created_at, updated_at) VALUES (?, 'true', 'pending', 0, 0)",
+                     (job_id,))
+        return job_id
+    return fn
+
+
+def count(writer):
+    return connect(writer.db).execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+def commits():
+    return COMMITS_TOTAL.series.get((), 0)
+
+
+def test_write_behind_writes_commit_together_on_flush(writer):
+    before = commits()
+    for i in range(50):
+        assert writer.submit(insert(f"j{i}")) is None
+    writer.flush()
+    assert count(writer) == 50
+    assert commits() - before == 1
+
+
+def test_waited_write_returns_its_result_and_commits_queued_writes(writer):
+    writer.submit(insert("behind"))
+    assert writer.submit(insert("waited"), wait=True) == "waited"
+    assert count(writer) == 2
+
+
+def test_failing_write_does_not_sink_its_group(writer):
+    writer.submit(insert("a"))
+    with pytest.raises(sqlite3.IntegrityError):
+        writer.submit(insert("a"), wait=True)
+    assert writer.submit(insert("b"), wait=True) == "b"
+    assert count(writer) == 2
+
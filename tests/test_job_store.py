@@ -0,0 +1,89 @@
+import multiprocessing, sqlite3
+from dlq import DLQ
+from job_store import JobStore, SCHEMA_VERSION
+
+
+def create_v0(path):
+    """queue.db as the first release left it: no user_version, 11 job columns, 7 DLQ columns, no indexes."""
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE jobs (
+        id TEXT PRIMARY KEY, command TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER DEFAULT 0,
+        max_retries INTEGER DEFAULT 3, created_at REAL, updated_at REAL, next_run_at REAL DEFAULT 0,
+        priority INTEGER DEFAULT 1, last_duration REAL DEFAULT 0, last_exit_code INTEGER DEFAULT NULL
+    )''')
+    conn.execute('''CREATE TABLE dlq (
+        id TEXT PRIMARY KEY, command TEXT, attempts INTEGER, max_retries INTEGER,
+        created_at REAL, moved_at REAL, error TEXT
+    )''')
+    conn.executemany("INSERT INTO jobs VALUES (?, ?, ?, ?, 3, ?, ?, ?, ?, ?, ?)", [
+        ("a", "echo a", "completed", 1, 1.0, 2.0, 0, 1, 0.5, 0),
+        ("b", "echo b", "pending", 0, 2.0, 2.0, None, 2, 0, None),
+        ("c", "exit 1", "dead", 4, 3.0, 4.0, 0, 3, 0.25, 1),
+        ("d", "echo d", "processing", 1, 4.0, 4.0, 0, 1, 0, None),
+    ])
+    conn.execute("INSERT INTO dlq VALUES ('c', 'exit 1', 4, 3, 3.0, 4.0, 'ExitCode:1')")
+    conn.commit()
+    conn.close()
+
+
+def test_hot_queries_use_indexes(workdir):
+    assert JobStore().check_query_plans() == {}
+
+
+def test_existing_database_gets_the_indexes(workdir):
+    create_v0("queue.db")
+    store = JobStore()
+    assert store.check_query_plans() == {}
+    # NULL next_run_at would never match the claim query
+    assert [job[0] for job in store.claim("w1", n=5)] == ["b"]
+
+
+def test_migrates_a_version_0_database(workdir):
+    create_v0("queue.db")
+    store = JobStore()
+
+    assert store.conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    job_cols = {r[1] for r in store.conn.execute("PRAGMA table_info(jobs)")}
+    assert {"queue", "idempotency_key", "lease_expires_at", "cpu_user_ms"} <= job_cols
+    dlq_cols = {r[1] for r in store.conn.execute("PRAGMA table_info(dlq)")}
+    assert {"queue", "priority"} <= dlq_cols
+    assert store.conn.execute("SELECT queue, priority FROM dlq WHERE id='c'").fetchone() == ("default", 3)
+    assert store.check_query_plans() == {}
+
+    # The counters are seeded from the existing rows
+    metrics = store.metrics()
+    assert metrics["states"] == {"completed": 1, "pending": 1, "dead": 1, "processing": 1}
+    assert metrics["avg_duration"] == 0.375
+    assert store.conn.execute("SELECT next_run_at FROM jobs WHERE id='b'").fetchone() == (0,)
+    assert store.conn.execute("SELECT lease_expires_at IS NOT NULL FROM jobs WHERE id='d'").fetchone() == (1,)
+    assert [job[0] for job in store.list_jobs()] == ["a", "b", "c", "d"]
+    assert [job[0] for job in store.list_jobs(state="pending")] == ["b"]
+
+    # Opening it again leaves it as it is
+    JobStore()
+    assert store.metrics()["states"] == metrics["states"]
+    assert DLQ().retry_where(ids=["c"]) == 1
+    assert store.get_job("c")[2] == "pending"
+    # The migrated table gets the unique index that enqueue's ON CONFLICT clause names
+    key_id = store.enqueue("echo e", idempotency_key="k")
+    assert store.enqueue("echo f", idempotency_key="k") == key_id
+
+
+def open_and_enqueue(barrier):
+    barrier.wait()
+    JobStore().enqueue("echo hi")
+
+
+def test_concurrent_first_opens(workdir):
+    # Every opener races to create the schema of the same new file
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(8)
+    openers = [ctx.Process(target=open_and_enqueue, args=(barrier,)) for _ in range(8)]
+    for p in openers:
+        p.start()
+    for p in openers:
+        p.join()
+    assert [p.exitcode for p in openers] == [0] * 8
+    store = JobStore()
+    assert store.conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert store.metrics()["states"] == {"pending": 8}
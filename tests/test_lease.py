@@ -0,0 +1,48 @@
+import multiprocessing, os
+from job_store import JobStore, open_store
+from lease import Reaper
+
+
+def test_expired_leases_are_retried_then_dead_lettered(workdir):
+    store = JobStore()
+    retried = store.enqueue("echo a", max_retries=1)
+    dead = store.enqueue("echo b", max_retries=0)
+    kept = store.enqueue("echo c")
+    # Leases that ran out at once, as if every worker died after claiming
+    assert len(store.claim("w1", n=3, lease=-1)) == 3
+    # A heartbeat keeps the third one alive
+    store.extend_leases([kept], lease=60)
+
+    reaper = Reaper(store, {"backoff_base": 2})
+    assert reaper.reap() == 2
+    assert store.get_job(retried)[2:4] == ("pending", 1)
+    assert store.get_job(dead)[2] == "dead"
+    assert store.conn.execute("SELECT error FROM dlq WHERE id=?", (dead,)).fetchone() == ("LeaseExpired",)
+    assert store.get_job(kept)[2] == "processing"
+    # Each expired lease is handled once
+    assert reaper.reap() == 0
+    assert store.expired_leases() == []
+
+
+def reap_and_die(db_path):
+    # Write-behind writes wait a whole second for company, so anything not committed
+    # by the time reap() returns is lost with the process
+    config = {"group_commit_ms": 1000, "backoff_base": 2}
+    Reaper(open_store(db_path, config, group_commit=True), config).reap()
+    os._exit(0)
+
+
+def test_reaper_killed_after_reaping_loses_no_job(workdir):
+    db = str(workdir / "queue.db")
+    store = JobStore(db)
+    retried = store.enqueue("echo a", max_retries=1)
+    dead = store.enqueue("echo b", max_retries=0)
+    store.claim("w1", n=2, lease=-1)
+
+    reaper = multiprocessing.get_context("spawn").Process(target=reap_and_die, args=(db,))
+    reaper.start()
+    reaper.join()
+    assert reaper.exitcode == 0
+    assert store.get_job(retried)[2:4] == ("pending", 1)
+    assert store.get_job(dead)[2] == "dead"
+    assert store.conn.execute("SELECT COUNT(*) FROM dlq").fetchone() == (1,)
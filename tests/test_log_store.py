@@ -0,0 +1,69 @@
+import os, shutil
+import pytest
+from job_store import JobStore
+from log_store import LogStore, MMAP_THRESHOLD, _get_writer
+from output_capture import OutputCapture
+
+
+@pytest.fixture
+def store(workdir):
+    return JobStore()
+
+
+def open_logs(store, workdir, **kwargs):
+    return LogStore(store.conn, log_dir=str(workdir / "logs"), **kwargs)
+
+
+def write_log(logs, job_id, data, compress=False):
+    capture = OutputCapture(job_id, logs.active_path(job_id, compress), compress=compress)
+    capture.feed_stdout(data)
+    logs.append(job_id, capture.close(), compress)
+
+
+def test_logs_round_trip_through_segments(store, workdir):
+    logs = open_logs(store, workdir)
+    plain, zipped = store.enqueue("echo a"), store.enqueue("echo b")
+    write_log(logs, plain, b"line 1\nline 2\nline 3\n")
+    write_log(logs, zipped, b"zipped\n" * 1000, compress=True)
+
+    assert b"".join(logs.iter_chunks(plain)) == b"line 1\nline 2\nline 3\n"
+    assert logs.tail(plain, 2) == b"line 2\nline 3\n"
+    assert b"".join(logs.iter_chunks(zipped)) == b"zipped\n" * 1000
+    # Finished runs leave the active directory for the segment
+    assert os.listdir(workdir / "logs" / "active") == []
+    assert logs.iter_chunks("no-such-job") is None and logs.tail("no-such-job", 5) is None
+
+
+def test_large_records_and_legacy_files(store, workdir):
+    logs = open_logs(store, workdir)
+    job_id = store.enqueue("echo big")
+    data = b"".join(b"%08d\n" % i for i in range(MMAP_THRESHOLD // 9 + 1000))
+    write_log(logs, job_id, data)
+    assert b"".join(logs.iter_chunks(job_id)) == data
+    assert logs.tail(job_id, 1) == data[-9:]
+
+    (workdir / "logs" / "old.log").write_bytes(b"from before segments\n")
+    assert logs.tail("old", 10) == b"from before segments\n"
+
+
+def test_compact_drops_purged_jobs_and_superseded_runs(store, workdir):
+    # Every run starts a new segment
+    logs = open_logs(store, workdir, segment_bytes=1)
+    kept, purged = store.enqueue("echo kept"), store.enqueue("echo purged")
+    write_log(logs, kept, b"run 1\n")
+    write_log(logs, purged, b"purged\n")
+    write_log(logs, kept, b"run 2\n")
+    store.conn.execute("DELETE FROM jobs WHERE id=?", (purged,))
+    store.conn.commit()
+
+    assert logs.compact() == (2, len(b"run 1\n") + len(b"purged\n"))
+    assert logs.tail(kept, 5) == b"run 2\n"
+    assert len(os.listdir(workdir / "logs" / "segments")) == 1
+
+
+def test_one_writer_per_directory_and_sealing_after_removal(store, workdir):
+    assert _get_writer("logs/segments", 1) is _get_writer(str(workdir / "logs" / "segments"), 1)
+    logs = open_logs(store, workdir)
+    write_log(logs, store.enqueue("echo a"), b"a\n")
+    shutil.rmtree(workdir / "logs")
+    _get_writer(logs.seg_dir, logs.segment_bytes).seal()
@@ -0,0 +1,71 @@
+import multiprocessing, random
+import pytest
+import sketch
+from job_store import JobStore
+
+
+def test_sketch_quantiles_are_within_one_percent():
+    rnd = random.Random(7)
+    values = [rnd.lognormvariate(0, 2) for _ in range(10000)]
+    buckets = {}
+    for v in values:
+        b = sketch.bucket_of(v)
+        buckets[b] = buckets.get(b, 0) + 1
+    values.sort()
+    for q, estimate in sketch.quantiles(sorted(buckets.items())).items():
+        exact = values[int(q * (len(values) - 1))]
+        assert estimate == pytest.approx(exact, rel=0.0101)
+    assert sketch.quantiles([]) == {0.5: None, 0.95: None, 0.99: None}
+
+
+def test_counters_follow_every_write(workdir):
+    store = JobStore()
+    ids = [store.enqueue(f"echo {i}") for i in range(5)]
+    store.claim("w1", n=3)
+    store.update_job_state(ids[0], "completed", last_duration=1.0, last_exit_code=0)
+    store.update_job_state(ids[1], "completed", last_duration=3.0, last_exit_code=0)
+    store.update_job_state(ids[2], "dead")
+    store.conn.execute("DELETE FROM jobs WHERE id=?", (ids[4],))
+    store.conn.commit()
+
+    metrics = store.metrics()
+    exact = dict(store.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+    assert {state: n for state, n in metrics["states"].items() if n} == exact
+    assert exact == {"completed": 2, "dead": 1, "pending": 1}
+    assert (metrics["total"], metrics["avg_duration"]) == (4, 2.0)
+    assert metrics["success_rate"] == pytest.approx(200 / 3)
+    assert metrics["duration_pct"][0.5] == pytest.approx(1.0, rel=0.01)
+    # One duration sample per recorded run, one queue-wait sample per claimed job
+    samples = dict(store.conn.execute("SELECT metric, SUM(n) FROM metric_buckets GROUP BY metric"))
+    assert samples == {"duration": 2, "queue_wait": 3}
+
+
+def test_counters_are_seeded_from_an_existing_database(workdir):
+    from test_job_store import create_v0
+    create_v0("queue.db")
+    metrics = JobStore().metrics()
+    assert metrics["states"] == {"completed": 1, "pending": 1, "dead": 1, "processing": 1}
+    assert metrics["avg_duration"] == 0.375
+    # Opening it again doesn't count the rows twice
+    assert JobStore().metrics()["states"] == metrics["states"]
+
+
+def open_store(barrier):
+    barrier.wait()
+    JobStore()
+
+
+def test_concurrent_migrations_seed_the_counters_once(workdir):
+    from test_job_store import create_v0
+    create_v0("queue.db")
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(8)
+    openers = [ctx.Process(target=open_store, args=(barrier,)) for _ in range(8)]
+    for p in openers:
+        p.start()
+    for p in openers:
+        p.join()
+    assert [p.exitcode for p in openers] == [0] * 8
+    store = JobStore()
+    assert store.metrics()["states"] == {"completed": 1, "pending": 1, "dead": 1, "processing": 1}
+    assert store.conn.execute("SELECT SUM(n) FROM metric_buckets WHERE metric='duration'").fetchone() == (2,)
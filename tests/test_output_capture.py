@@ -0,0 +1,42 @@
+import gzip, io, subprocess, sys
+import pytest
+from output_capture import OutputCapture, StreamCap, start_pumps
+
+
+def test_stream_cap_keeps_the_head_and_tail():
+    sink, out = io.BytesIO(), io.BytesIO()
+    cap = StreamCap(sink, 10)
+    for chunk in (b"0123", b"456789", b"abcdefghij"):
+        cap.feed(chunk)
+    cap.finish(out)
+    assert sink.getvalue() == b"01234"
+    assert out.getvalue() == b"\n[... 10 bytes truncated ...]\nfghij"
+    assert cap.total == 20
+
+
+def test_stream_cap_without_a_limit():
+    sink, out = io.BytesIO(), io.BytesIO()
+    cap = StreamCap(sink, 0)
+    cap.feed(b"x" * 100000)
+    cap.finish(out)
+    assert sink.getvalue() == b"x" * 100000 and out.getvalue() == b""
+
+
+def open_capture(job_id, max_bytes, compress):
+    return OutputCapture(job_id, f"{job_id}.log" + (".gz" if compress else ""), max_bytes=max_bytes, compress=compress)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_capture_streams_a_process_into_a_bounded_log(workdir, compress):
+    script = "import sys; sys.stdout.write('x' * 100000 + 'END'); sys.stderr.write('oops')"
+    capture = open_capture("job1", 1000, compress)
+    process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    for t in start_pumps(process, capture):
+        t.join()
+    process.wait()
+    path = capture.close()
+
+    with (gzip.open if compress else open)(path, "rb") as f:
+        data = f.read()
+    assert data == (b"x" * 500 + b"\n[... 99003 bytes truncated ...]\n" + b"x" * 497 + b"END"
+                    + b"\n[stderr]\noops")
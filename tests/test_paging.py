@@ -0,0 +1,62 @@
+import pytest
+from job_store import JobStore
+from shards import ShardedJobStore
+
+
+def in_order(store):
+    """Every job id sorted by (created_at, id), read straight from the tables."""
+    rows = [row for shard in getattr(store, "shards", [store])
+            for row in shard.conn.execute("SELECT created_at, id FROM jobs")]
+    return [job_id for _, job_id in sorted(rows)]
+
+
+def enqueue(store, n):
+    jobs = [{"command": f"echo {i}", "priority": 1 + i % 3} for i in range(n)]
+    return list(store.enqueue_many(jobs, chunk_size=4))
+
+
+@pytest.fixture(params=[1, 3], ids=["single", "sharded"])
+def store(request, workdir):
+    return JobStore() if request.param == 1 else ShardedJobStore(count=request.param)
+
+
+def test_iter_jobs_returns_each_job_once_in_order(store):
+    ids = enqueue(store, 23)
+    expected = in_order(store)
+    assert sorted(expected) == sorted(ids)
+    for page_size in (1, 4, 23, 1000):
+        assert [job[0] for job in store.iter_jobs(page_size=page_size)] == expected
+
+
+def test_limit_and_after_page_through(store):
+    enqueue(store, 23)
+    expected = in_order(store)
+    seen, after = [], None
+    while True:
+        page = [job[0] for job in store.iter_jobs(limit=5, after=after, page_size=2)]
+        if not page:
+            break
+        assert len(page) <= 5
+        seen += page
+        after = page[-1]
+    assert seen == expected
+
+
+def test_filters(store):
+    enqueue(store, 12)
+    store.update_job_state(in_order(store)[0], "completed")
+    assert [job[0] for job in store.iter_jobs(state="completed")] == in_order(store)[:1]
+    high = [job for job in store.iter_jobs(priority=3, page_size=2)]
+    assert len(high) == 4 and {job[8] for job in high} == {3}
+
+
+def test_unknown_after_is_empty(store):
+    enqueue(store, 3)
+    assert list(store.iter_jobs(after="no-such-job")) == []
+
+
+def test_list_rejects_a_malformed_date(workdir, flam):
+    JobStore().enqueue("echo hi")
+    result = flam("list", "--since", "yesterday")
+    assert "Invalid --since/--until format" in result.stdout and "Traceback" not in result.stderr
+    assert "echo hi" in flam("list", "--since", "2000-01-01T00:00:00Z").stdout
@@ -0,0 +1,87 @@
+import signal
+
+import pytest
+
+from output_capture import OutputCapture
+from pytask import TaskPool, encode_task, parse_task
+
+TASKS = '''
+import os, sys
+
+def greet(name, times=1):
+    for _ in range(times):
+        print("hello", name)
+    print("warn", file=sys.stderr)
+
+def fail():
+    raise ValueError("bad input")
+
+def pid():
+    print(os.getpid())
+
+def hang():
+    import time
+    time.sleep(60)
+
+def stubborn():
+    import time
+    while True:
+        try:
+            time.sleep(60)
+        except BaseException:
+            pass
+'''
+
+
+@pytest.fixture
+def pool(workdir):
+    (workdir / "flam_test_tasks.py").write_text(TASKS)
+    return TaskPool(1)
+
+
+def run(pool, job_id, command, timeout=30):
+    capture = OutputCapture(job_id, f"{job_id}.log")
+    result = pool.run(parse_task(command), capture, timeout)
+    return result, open(capture.close(), encoding="utf-8").read()
+
+
+def test_task_commands_round_trip():
+    command = encode_task("pkg.mod:fn", {"w": 100})
+    assert command.startswith("@python ")
+    assert parse_task(command) == ("pkg.mod:fn", {"w": 100})
+    assert parse_task("echo hi") is None
+    with pytest.raises(ValueError):
+        encode_task("no_function")
+
+
+def test_pool_runs_tasks_and_captures_output(pool):
+    result, log = run(pool, "j1", encode_task("flam_test_tasks:greet", {"name": "bob", "times": 2}))
+    assert result[:2] == (0, None)
+    assert log.count("hello bob") == 2 and "warn" in log
+    # The pool process's own usage while it ran the task; its peak before the task is the floor
+    assert len(result[2]) == 6
+    assert result[2][5] is None or result[2][5] <= result[2][2]
+
+
+def test_failures_are_reported_and_the_process_is_reused(pool):
+    _, first = run(pool, "p1", encode_task("flam_test_tasks:pid"))
+    result, log = run(pool, "j2", encode_task("flam_test_tasks:fail"))
+    assert result[:2] == (1, "ValueError: bad input")
+    assert "Traceback" in log
+    _, second = run(pool, "p2", encode_task("flam_test_tasks:pid"))
+    assert first.split()[0] == second.split()[0]
+
+
+def test_timed_out_task_is_interrupted_and_reports_its_usage(pool):
+    _, first = run(pool, "p1", encode_task("flam_test_tasks:pid"))
+    result = run(pool, "j3", encode_task("flam_test_tasks:hang"), timeout=0.5)[0]
+    assert result[:2] == (-signal.SIGALRM, "TimeoutExpired") and result[2] is not None
+    _, second = run(pool, "p2", encode_task("flam_test_tasks:pid"))
+    assert first.split()[0] == second.split()[0]
+
+
+def test_task_ignoring_its_timeout_has_its_process_replaced(pool):
+    result, _ = run(pool, "j3", encode_task("flam_test_tasks:stubborn"), timeout=0.2)
+    assert result is None
+    result, log = run(pool, "j4", encode_task("flam_test_tasks:greet", {"name": "again"}))
+    assert result[:2] == (0, None) and "hello again" in log
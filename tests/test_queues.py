@@ -0,0 +1,70 @@
+import pytest
+from job_store import JobStore, connect, open_store
+from worker import JobHandler
+
+
+@pytest.fixture
+def store(workdir):
+    return JobStore()
+
+
+def queues_of(store, jobs):
+    names = [store.conn.execute("SELECT queue FROM jobs WHERE id=?", (job[0],)).fetchone()[0] for job in jobs]
+    return {q: names.count(q) for q in set(names)}
+
+
+def test_weighted_claims_share_slots_by_weight(store):
+    for _ in store.enqueue_many({"command": f"echo {i}", "queue": q} for q in ("a", "b") for i in range(30)):
+        pass
+    for _ in range(5):
+        assert queues_of(store, store.claim("w1", n=4, queues=[("a", 3), ("b", 1)])) == {"a": 3, "b": 1}
+    # Slots a drained queue can't use go to the others
+    store.conn.execute("DELETE FROM jobs WHERE queue='b' AND state='pending'")
+    store.conn.commit()
+    assert queues_of(store, store.claim("w1", n=4, queues=[("a", 3), ("b", 1)])) == {"a": 4}
+
+
+def test_only_the_named_queues_are_served(store):
+    store.enqueue("echo img", queue="img")
+    plain = store.enqueue("echo plain")
+    assert [job[0] for job in store.claim("w1", n=5, queues=[("default", 1)])] == [plain]
+
+
+def test_in_flight_limits_hold_across_workers(store):
+    for _ in store.enqueue_many([{"command": "convert", "queue": "img"}] * 5 + ["echo"] * 5):
+        pass
+    limits = {"img": 2}
+    first = store.claim("w1", n=10, limits=limits)
+    assert queues_of(store, first) == {"img": 2, "default": 5}
+
+    other = JobStore()
+    assert other.claim("w2", n=10, limits=limits) == []
+    assert other.limited
+
+    img = [job for job in first if queues_of(store, [job]) == {"img": 1}]
+    store.update_job_state(img[0][0], "completed", last_duration=1, last_exit_code=0)
+    assert queues_of(other, other.claim("w2", n=10, limits=limits)) == {"img": 1}
+
+
+class Handler(JobHandler):
+    """Just the outcome path of a worker, over a group-committing store."""
+
+    def __init__(self, store, config):
+        self.worker_id, self.store, self.logs, self.config, self.queues = "w1", store, None, config, None
+
+
+@pytest.mark.parametrize("exit_code, state", [(0, "completed"), (1, "dead")])
+def test_freed_slot_wakes_workers_only_after_it_is_committed(workdir, monkeypatch, exit_code, state):
+    db = str(workdir / "queue.db")
+    # Write-behind writes wait 200 ms for company before they are committed
+    config = {"group_commit_ms": 200, "queue_limits": {"img": 1}}
+    store = open_store(db, config, group_commit=True)
+    job_id = store.enqueue("convert a.png", queue="img", max_retries=0)
+    store.claim("w1", n=1)
+
+    seen = []
+    monkeypatch.setattr(store.wakeup, "notify", lambda: seen.append(
+        connect(db).execute("SELECT state FROM jobs WHERE id=?", (job_id,)).fetchone()[0]))
+    Handler(store, config)._finish_job(job_id, 0, 0, 0.1, exit_code)
+    store.flush()
+    assert seen == [state]
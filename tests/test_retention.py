@@ -0,0 +1,101 @@
+import gzip, json, os, sqlite3, time
+import retention
+from job_store import JobStore
+from retention import COLUMN_NAMES, archive_jobs, collect, reclaim_space
+
+
+def read_archive(archive_dir):
+    rows = []
+    for name in sorted(os.listdir(archive_dir)):
+        # Batches are appended as separate gzip members, read back as one stream
+        with gzip.open(os.path.join(archive_dir, name), "rb") as f:
+            rows += [json.loads(line) for line in f]
+    return rows
+
+
+def test_archive_round_trip(workdir):
+    store = JobStore()
+    ids = [store.enqueue(f"echo {i}") for i in range(5)]
+    store.update_job_state(ids[0], "completed", last_duration=1.5, last_exit_code=0)
+    store.update_job_state(ids[1], "dead")
+    store.update_job_state(ids[2], "completed", last_duration=0.5, last_exit_code=0)
+    store.update_job_state(ids[3], "failed")
+    # Everything but the third job was last touched two hours ago
+    store.conn.execute("UPDATE jobs SET updated_at=? WHERE id != ?", (time.time() - 7200, ids[2]))
+    store.conn.commit()
+    expected = [dict(zip(COLUMN_NAMES, store.get_job(job_id))) for job_id in ids[:2]]
+
+    assert archive_jobs(store, 3600, states=("completed", "dead"), batch_size=1) == 2
+    assert sorted(read_archive("archive"), key=lambda r: r["command"]) == expected
+    assert sorted(job[0] for job in store.list_jobs()) == sorted(ids[2:])
+    assert store.metrics()["states"].get("completed") == 1
+    # Nothing left that old
+    assert archive_jobs(store, 3600, states=("completed", "dead")) == 0
+
+
+def test_reclaim_space_returns_pages_to_the_os(workdir):
+    store = JobStore()
+    for _ in store.enqueue_many("echo " + "x" * 2000 for _ in range(2000)):
+        pass
+    store.conn.execute("DELETE FROM jobs")
+    store.conn.commit()
+    freelist = store.conn.execute("PRAGMA freelist_count").fetchone()[0]
+    assert freelist > 500
+
+    stats = reclaim_space(store, pages=500)
+    assert stats["freed_pages"] == 500 and not stats["wal_busy"]
+    assert store.conn.execute("PRAGMA freelist_count").fetchone()[0] == freelist - 500
+    # The WAL was checkpointed and truncated
+    assert os.path.getsize("queue.db-wal") == 0
+
+
+def test_archive_is_fsynced_before_the_delete_takes_the_lock(workdir, monkeypatch):
+    store = JobStore()
+    ids = [store.enqueue(f"echo {i}") for i in range(3)]
+    for job_id in ids:
+        store.update_job_state(job_id, "completed")
+    store.conn.execute("UPDATE jobs SET updated_at=?", (time.time() - 7200,))
+    store.conn.commit()
+
+    real_fsync = os.fsync
+    def fsync_while_a_worker_writes(fd):
+        real_fsync(fd)
+        # No busy timeout: this fails at once if archive_jobs held the write lock here
+        worker = sqlite3.connect("queue.db", timeout=0)
+        worker.execute("UPDATE jobs SET state='pending', updated_at=? WHERE id=?", (time.time(), ids[0]))
+        worker.commit()
+    monkeypatch.setattr(retention.os, "fsync", fsync_while_a_worker_writes)
+
+    assert archive_jobs(store, 3600) == 2
+    # The job retried after it was written out stays, in its new state
+    assert [job[:3] for job in store.list_jobs()] == [(ids[0], "echo 0", "pending")]
+    assert sorted(row["id"] for row in read_archive("archive")) == sorted(ids)
+
+
+def test_full_vacuum_only_runs_when_asked(workdir):
+    conn = sqlite3.connect("queue.db")
+    conn.execute("CREATE TABLE filler (x)")
+    conn.commit()
+    conn.close()
+    store = JobStore()
+    assert store.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    # The background pass (RetentionThread) calls collect() without vacuum
+    stats = collect(store, {})
+    assert stats["vacuum_needed"] and stats["freed_pages"] == 0
+    assert store.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+
+    assert not reclaim_space(store, vacuum=True)["vacuum_needed"]
+    assert store.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_gc_command_converts_an_old_database_with_vacuum(workdir, flam):
+    conn = sqlite3.connect("queue.db")
+    conn.execute("CREATE TABLE filler (x)")
+    conn.commit()
+    conn.close()
+    JobStore()
+    assert "gc --vacuum" in flam("gc").stdout
+    result = flam("gc", "--vacuum")
+    assert result.returncode == 0 and "gc --vacuum" not in result.stdout
+    assert sqlite3.connect("queue.db").execute("PRAGMA auto_vacuum").fetchone()[0] == 2
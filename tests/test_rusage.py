@@ -0,0 +1,77 @@
+import os, subprocess, sys, threading, time
+import pytest
+import rusage
+from async_worker import AsyncWorker
+from job_store import JobStore
+from pytask import PREFIX
+
+
+@pytest.mark.parametrize("command, template", [
+    ("sleep 2 && echo 'hi'", "sleep N && echo '?'"),
+    ('convert "a b.png" --quality 0.85', "convert '?' --quality N"),
+    ("fetch 3f2b1c4d-0a1b-4c2d-8e9f-00112233aabb", "fetch <uuid>"),
+    (PREFIX + "tasks:resize 640 480", PREFIX + "tasks:resize"),
+])
+def test_template_of(command, template):
+    assert rusage.template_of(command) == template
+
+
+def test_top_commands_groups_by_template():
+    rows = [
+        ("sleep 1", 1.0, 100, 50, 2000, 1, 2, 1900),
+        ("sleep 2", 2.0, 300, 50, 3000, 0, 0, 1500),
+        ("make build", 5.0, 4000, 1000, 90000, 10, 20, 2500),
+        # A run recorded without usage (e.g. a stubborn timed-out task) still counts its wall time
+        ("sleep 3", 3.0, None, None, None, None, None, None),
+    ]
+    top = rusage.top_commands(rows)
+    assert [template for template, _ in top] == ["make build", "sleep N"]
+    sleep = dict(top)["sleep N"]
+    assert (sleep.runs, sleep.wall, sleep.cpu, sleep.io, sleep.max_rss_kb) == (3, 6.0, 0.5, 3, 3000)
+    # "sleep 1" never rose above the memory it inherited; "sleep 2" did
+    assert (sleep.rss_floor_kb, sleep.at_floor) == (1900, 1)
+    assert [t for t, _ in rusage.top_commands(rows, sort="wall", limit=1)] == ["sleep N"]
+
+
+@pytest.mark.skipif(rusage.resource is None, reason="no rusage on this platform")
+def test_wait_returns_the_childs_usage():
+    process = subprocess.Popen([sys.executable, "-c", "sum(range(3_000_000))"])
+    user_ms, sys_ms, rss_kb, _, _, floor = rusage.wait(process, timeout=30, floor=123)
+    assert process.returncode == 0
+    assert user_ms + sys_ms > 0 and rss_kb > 0 and floor == 123
+
+
+@pytest.mark.skipif(rusage.spawn_floor() is None, reason="no inherited RSS floor on this platform")
+def test_a_shell_jobs_max_rss_starts_at_the_spawn_floor():
+    ballast = bytearray(64 * 2**20)
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1
+    floor = rusage.spawn_floor()
+    usage = rusage.wait(subprocess.Popen("true", shell=True), 30, floor)
+    assert rusage.at_floor(usage[2], usage[5])
+    script = "b = bytearray(%d); b[::4096] = b'x' * len(b[::4096])" % ((floor + 64 * 1024) * 1024)
+    usage = rusage.wait(subprocess.Popen([sys.executable, "-c", script]), 30, rusage.spawn_floor())
+    assert not rusage.at_floor(usage[2], usage[5])
+
+
+@pytest.mark.skipif(rusage.resource is None, reason="no rusage on this platform")
+def test_async_worker_records_shell_job_usage(workdir):
+    store = JobStore()
+    busy = store.enqueue(f'"{sys.executable}" -c "sum(range(3_000_000))"', max_retries=0)
+    slow = store.enqueue("sleep 5", max_retries=0)
+    with open("config.json", "w") as f:
+        f.write('{"timeout": 1}')
+    worker = AsyncWorker()
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while worker.processed < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    worker.stop()
+    thread.join(30)
+    rows = {job_id: store.conn.execute("SELECT state, cpu_user_ms, cpu_sys_ms, max_rss_kb FROM jobs WHERE id=?",
+                                       (job_id,)).fetchone() for job_id in (busy, slow)}
+    state, user_ms, sys_ms, rss_kb = rows[busy]
+    assert state == "completed" and user_ms + sys_ms > 0 and rss_kb > 0
+    # The timed-out run is reaped with wait4 too
+    assert rows[slow][0] == "dead" and rows[slow][3] > 0
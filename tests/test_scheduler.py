@@ -0,0 +1,124 @@
+import calendar, time
+import pytest
+from job_store import JobStore
+from scheduler import Cron, Schedules
+from shards import ShardedJobStore
+
+
+def utc(s):
+    return calendar.timegm(time.strptime(s, "%Y-%m-%dT%H:%M"))
+
+
+@pytest.mark.parametrize("expr, after, expected", [
+    ("*/15 * * * *", "2026-10-17T10:07", "2026-10-17T10:15"),
+    # Saturday: the next weekday run is Monday
+    ("0 3 * * mon-fri", "2026-10-17T10:07", "2026-10-19T03:00"),
+    ("0 0 29 2 *", "2026-03-01T00:00", "2028-02-29T00:00"),
+    # Both day fields restricted: a Friday matches before the 1st does
+    ("30 9 1,15 * 5", "2026-10-17T10:07", "2026-10-23T09:30"),
+    # Strictly after, even on a matching minute
+    ("@hourly", "2026-10-17T10:00", "2026-10-17T11:00"),
+    ("0 0 * * 7", "2026-10-17T10:00", "2026-10-18T00:00"),
+    ("0 12 * jan-mar/2 *", "2026-10-17T10:00", "2027-01-01T12:00"),
+])
+def test_next_after(expr, after, expected):
+    assert Cron(expr).next_after(utc(after)) == utc(expected)
+
+
+@pytest.mark.parametrize("expr", ["* * *", "61 * * * *", "*/0 * * * *", "0 0 * foo *", "0 0 30 2 *"])
+def test_invalid_expressions(expr):
+    with pytest.raises(ValueError):
+        Cron(expr)
+
+
+@pytest.fixture
+def store(workdir):
+    return JobStore()
+
+
+def fired_keys(store):
+    return [k for (k,) in store.conn.execute("SELECT idempotency_key FROM jobs ORDER BY next_run_at")]
+
+
+def test_fire_due_enqueues_each_missed_run_once(store):
+    schedules = Schedules(store)
+    schedule_id, first = schedules.add("* * * * *", "echo tick", queue="cron", priority=4)
+    assert schedules.fire_due(first - 1) == 0
+
+    assert schedules.fire_due(first + 120) == 3
+    assert schedules.fire_due(first + 120) == 0
+    assert fired_keys(store) == [f"schedule:{schedule_id}:{int(first + 60 * i)}" for i in range(3)]
+    assert store.conn.execute("SELECT DISTINCT queue, priority, state FROM jobs").fetchall() == [("cron", 4, "pending")]
+    assert schedules.next_fire_at() == first + 180
+
+
+def test_fire_due_after_a_crash_does_not_duplicate(store):
+    schedules = Schedules(store)
+    schedule_id, first = schedules.add("* * * * *", "echo tick")
+    schedules.fire_due(first + 60)
+    # Crash between enqueueing the jobs and advancing the schedule: the old next run is still stored
+    store.conn.execute("UPDATE schedules SET next_fire_at=?", (first,))
+    store.conn.commit()
+
+    # A restarted (or competing) scheduler re-fires the same runs; their keys collapse
+    Schedules(JobStore()).fire_due(first + 60)
+    assert len(fired_keys(store)) == 2
+    assert schedules.next_fire_at() == first + 120
+
+
+def test_racing_scheduler_does_not_move_the_schedule_back(store):
+    schedules, racer = Schedules(store), Schedules(JobStore())
+    _, first = schedules.add("* * * * *", "echo tick")
+    enqueue_many = racer.store.enqueue_many
+
+    def enqueue_then_lose_the_race(jobs):
+        yield from enqueue_many(jobs)
+        # The other scheduler gets further while this one is between its two steps
+        schedules.fire_due(first + 120)
+    racer.store.enqueue_many = enqueue_then_lose_the_race
+
+    racer.fire_due(first + 60)
+    assert len(fired_keys(store)) == 3
+    assert schedules.next_fire_at() == first + 180
+
+
+def test_no_catchup_fires_once(store):
+    schedules = Schedules(store)
+    _, first = schedules.add("*/5 * * * *", "echo once", catchup=False)
+    assert schedules.fire_due(first + 3600) == 1
+    assert schedules.next_fire_at() == first + 3600 + 300
+
+
+def test_fire_due_batches(store):
+    schedules = Schedules(store)
+    firsts = [schedules.add("* * * * *", f"echo {i}")[1] for i in range(3)]
+    now = max(firsts) + 199 * 60
+    assert schedules.fire_due(now, limit=500) == 500
+    assert schedules.fire_due(now, limit=500) == 100
+    assert schedules.fire_due(now, limit=500) == 0
+    assert store.conn.execute("SELECT COUNT(DISTINCT idempotency_key) FROM jobs").fetchone()[0] == 600
+
+
+def test_pause_and_resume(store):
+    schedules = Schedules(store)
+    schedule_id, first = schedules.add("* * * * *", "echo tick")
+    assert schedules.pause(schedule_id)
+    assert schedules.next_fire_at() is None
+    assert schedules.fire_due(first + 600) == 0
+
+    assert schedules.resume(schedule_id)
+    # Runs missed while paused are skipped
+    assert schedules.next_fire_at() > time.time()
+    assert schedules.remove(schedule_id)
+    assert not schedules.remove(schedule_id)
+
+
+def test_sharded_fires_land_once(workdir):
+    store = ShardedJobStore(count=3)
+    schedules = Schedules(store)
+    _, first = schedules.add("* * * * *", "echo tick")
+    schedules.fire_due(first + 600)
+    store.shards[0].conn.execute("UPDATE schedules SET next_fire_at=?", (first,))
+    store.shards[0].conn.commit()
+    schedules.fire_due(first + 600)
+    assert sum(shard.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] for shard in store.shards) == 11
@@ -0,0 +1,47 @@
+import os
+
+from job_store import JobStore
+from shards import ShardedJobStore, shard_paths
+
+
+def test_jobs_spread_over_shards_and_are_each_claimed_once(workdir):
+    store = ShardedJobStore(str(workdir / "queue.db"), count=3)
+    ids = [store.enqueue(f"echo {i}") for i in range(60)]
+    counts = [len(shard.list_jobs()) for shard in store.shards]
+    assert sum(counts) == 60 and all(counts)
+    assert [job[0] for job in store.list_jobs()] == ids
+
+    claimed = []
+    while True:
+        jobs = store.claim("w1", n=7)
+        if not jobs:
+            break
+        claimed += [job[0] for job in jobs]
+        for job in jobs:
+            store.update_job_state(job[0], "completed")
+    assert sorted(claimed) == sorted(ids)
+    assert store.metrics()["completed"] == 60
+
+
+def test_idempotency_keys_meet_in_one_shard(workdir):
+    store = ShardedJobStore(str(workdir / "queue.db"), count=4)
+    first = store.enqueue("echo a", idempotency_key="k1")
+    assert all(store.enqueue("echo a", idempotency_key="k1") == first for _ in range(10))
+    assert len(store.list_jobs()) == 1
+    assert store.get_job(first)[0] == first
+
+
+def test_queue_sharding_keeps_a_queue_together(workdir):
+    store = ShardedJobStore(str(workdir / "queue.db"), count=4, shard_by="queue")
+    for i in range(20):
+        store.enqueue(f"echo {i}", queue="img")
+    assert sorted(len(shard.list_jobs()) for shard in store.shards) == [0, 0, 0, 20]
+
+
+def test_leftover_shards_stay_visible_after_lowering_the_count(workdir):
+    db = str(workdir / "queue.db")
+    assert shard_paths(db, 3)[1:] == [str(workdir / "queue.shard1.db"), str(workdir / "queue.shard2.db")]
+    JobStore(shard_paths(db, 3)[2]).enqueue("echo stranded")
+    store = ShardedJobStore(db, count=2)
+    assert len(store.shards) == 3 and os.path.exists(store.shards[2].db_path)
+    assert [job[1] for job in store.claim("w1", n=5)] == ["echo stranded"]
@@ -0,0 +1,41 @@
+import multiprocessing, os, time
+from job_store import JobStore
+
+
+def enqueue_later(db_path):
+    time.sleep(0.2)
+    JobStore(db_path).enqueue("echo hi")
+
+
+def test_enqueue_wakes_a_listening_process(workdir):
+    db_path = str(workdir / "queue.db")
+    wakeup = JobStore(db_path).wakeup
+    assert wakeup.listen()
+    try:
+        seen = wakeup.generation
+        # Nothing enqueued: the wait runs out
+        assert not wakeup.wait(0.05, seen)
+
+        enqueuer = multiprocessing.get_context("spawn").Process(target=enqueue_later, args=(db_path,))
+        enqueuer.start()
+        start = time.monotonic()
+        assert wakeup.wait(30, seen)
+        assert time.monotonic() - start < 10
+        enqueuer.join()
+    finally:
+        wakeup.close()
+
+
+def test_notify_drops_sockets_of_dead_listeners(workdir):
+    db_path = str(workdir / "queue.db")
+    store = JobStore(db_path)
+    os.makedirs(db_path + ".wakeup", exist_ok=True)
+    stale = os.path.join(db_path + ".wakeup", "999999.sock")
+    open(stale, "w").close()
+    store.enqueue("echo hi")
+    assert not os.path.exists(stale)
+
+
+def test_relative_and_absolute_paths_share_a_wakeup(workdir):
+    from notify import get_wakeup
+    assert get_wakeup("queue.db") is get_wakeup(str(workdir / "queue.db"))
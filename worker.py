@@ -3,151 +3,245 @@ import time
 import subprocess
 import os
 import signal
-from job_store import JobStore
+from collections import deque
+from job_store import open_store
 from config import load_config
+from output_capture import OutputCapture, start_pumps
+from log_store import open_log_store
+from instrumentation import timed, JOBS_TOTAL, QUEUE_WAIT_SECONDS
+from pytask import parse_task, get_pool
+import rusage
 
 
-class Worker(threading.Thread):
-    def __init__(self, worker_id, stop_event):
+def start_background(config, stop_event):
+    """Start the queue-wide background threads one worker process runs: retention and the scheduler."""
+    if config.get("retention_interval", 0) > 0:
+        from retention import RetentionThread
+        RetentionThread(config, stop_event).start()
+    if config.get("scheduler", 1):
+        from scheduler import Scheduler
+        Scheduler(config, stop_event).start()
+
+
+class JobHandler:
+    """
+    Outcome handling shared by the threaded Worker and the asyncio AsyncWorker.
+
+    Subclasses provide worker_id, store (a JobStore), logs (a LogStore), config
+    and queues (a list of (name, weight), or None to serve every queue).
+    """
+
+    # NEW FUNCTION FOR LOGGING 
+    def _open_log(self, job_id):
+        """Start streaming a job's output to its active log file, bounded by log_max_bytes."""
+        compress = bool(self.config.get("log_gzip", False))
+        return OutputCapture(
+            job_id,
+            self.logs.active_path(job_id, compress),
+            max_bytes=self.config.get("log_max_bytes", 0),
+            compress=compress
+        )
+
+    def _close_log(self, capture):
+        """Finish the active log and move it into the segmented log store."""
+        with timed("save_logs"):
+            capture.close()
+            segment, offset, length = self.logs.append(capture.job_id, capture.path, capture.compress)
+        print(f"🗒️ Logs saved to {segment} ({length} bytes)")
+
+    def _finish_job(self, job_id, attempts, max_retries, duration, exit_code, error=None, usage=None):
+        """Record a finished run (and its rusage.py usage): complete it, or hand it to the retry/DLQ path. Returns the outcome."""
+        if exit_code == 0 and error is None:
+            self._remove_from_dlq(job_id)
+            self.store.cache_result(job_id, duration, self.config.get("result_cache_max_entries", 10000),
+                                    self.config.get("result_cache_ttl", 3600))
+            self.store.update_job_state(job_id, "completed", last_duration=duration, last_exit_code=exit_code,
+                                        usage=usage, notify=self._notify_freed_slot())
+            print(f"✅ Job {job_id} completed successfully in {duration:.2f}s")
+            JOBS_TOTAL.inc(outcome="completed")
+            return "completed"
+        self.store.record_run(job_id, duration, exit_code, usage)
+        return self._handle_failure(job_id, attempts, max_retries, error or f"ExitCode:{exit_code}")
+
+    def _use_cached_result(self, job_id):
+        """Complete a cacheable job from a recent successful run of the same command, if there is one."""
+        hit = self.store.cached_result(job_id, self.config.get("result_cache_ttl", 3600))
+        if hit is None:
+            return False
+        source_id, exit_code, _ = hit
+        self.store.complete_from_cache(job_id, source_id, exit_code, notify=self._notify_freed_slot())
+        JOBS_TOTAL.inc(outcome="cached")
+        print(f"♻️ Job {job_id} completed from cached result of {source_id}")
+        return True
+
+    # DEAD LETTER QUEUE HANDLER
+    def _handle_failure(self, job_id, attempts, max_retries, error):
+        """Schedule a retry with backoff, or move the job to the DLQ; returns "retried" or "dead"."""
+        with timed("handle_failure"):
+            attempts += 1
+            base = self.config.get("backoff_base", 2)
+            delay = base ** attempts
+            if attempts > max_retries:
+                self.store.move_to_dlq(job_id, error, notify=self._notify_freed_slot())
+                JOBS_TOTAL.inc(outcome="dead")
+                print(f"☠️ Job {job_id} moved to DLQ after {attempts - 1} retries. error={error}")
+                return "dead"
+            else:
+                self.store.schedule_retry(job_id, attempts, time.time() + delay)
+                JOBS_TOTAL.inc(outcome="retried")
+                print(f"🔁 Job {job_id} failed (attempt {attempts}) — retrying in {delay:.1f}s (error={error})")
+                return "retried"
+
+    def _notify_freed_slot(self):
+        # Workers idling on a queue at its in-flight limit wait for a wakeup instead of polling.
+        # It is sent with the write that frees the slot, once committed, so they can't wake
+        # before a group-commit writer has made the slot visible and go back to sleep.
+        return bool(self.config.get("queue_limits"))
+
+    # REMOVE JOB FROM DLQ IF SUCCESS
+    def _remove_from_dlq(self, job_id):
+        self.store.remove_from_dlq(job_id)
+
+    def _idle_timeout(self, listening):
+        """Sleep until the earliest scheduled job is due, capped so missed wakeups heal."""
+        if listening:
+            timeout = self.config.get("idle_timeout", 30)
+        else:
+            timeout = self.config.get("poll_interval", 1)
+        due = self.store.next_due_at([q for q, _ in self.queues] if self.queues else None)
+        # Due jobs held back by queue limits: wait for a wakeup instead of spinning
+        if due is not None and not self.store.limited:
+            timeout = min(timeout, max(due - time.time(), 0.01))
+        return timeout
+
+
+class Worker(JobHandler, threading.Thread):
+    def __init__(self, worker_id, stop_event, queues=None):
         super().__init__(daemon=True)
         self.worker_id = worker_id
-        self.store = JobStore()
+        self.queues = queues
         self.config = load_config()
+        self.store = open_store(config=self.config, group_commit=True)
+        self.logs = open_log_store(self.store)
+        from lease import get_lease_keeper
+        self.leases = get_lease_keeper(self.store.db_path, self.config)
         self.stop_event = stop_event
+        self.claimed = deque()
+        self.processed = 0
 
     def run(self):
         print(f"🧑‍🏭 Worker-{self.worker_id} started...")
+        self.leases.ensure_running()
+        wakeup = self.store.wakeup
+        listening = wakeup.listen()
 
         while not self.stop_event.is_set():
+            # Read the generation before claiming so an enqueue that lands in
+            # between makes the wait below return immediately.
+            seen = wakeup.generation
             job = self._get_pending_job()
             if not job:
-                time.sleep(self.config.get("poll_interval", 1))
+                wakeup.wait(self._idle_timeout(listening), seen)
                 continue
 
-            job_id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_duration, last_exit_code = job
+            self._run_job(job)
+            self.leases.discard([job[0]])
+            self.processed += 1
 
-            if next_run_at and next_run_at > time.time():
-                time.sleep(0.5)
-                continue
+        # Jobs claimed in the last batch but never started go back to the queue
+        unstarted = [j[0] for j in self.claimed]
+        self.store.release(unstarted)
+        self.leases.discard(unstarted)
+        self.claimed.clear()
+        self.store.flush()
+        print(f"🛑 Worker-{self.worker_id} stopping (graceful)")
 
-            self.store.update_job_state(job_id, "processing")
-            print(f"⚙️ Worker-{self.worker_id} executing: {command}")
+    def _run_job(self, job):
+        job_id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_duration, last_exit_code = job
+        QUEUE_WAIT_SECONDS.observe(max(time.time() - max(created_at or 0, next_run_at or 0), 0))
+        if self._use_cached_result(job_id):
+            return
+        print(f"⚙️ Worker-{self.worker_id} executing: {command}")
 
-            start_time = time.time()
-            try:
+        capture = self._open_log(job_id)
+        start_time = time.time()
+        try:
+            task = parse_task(command)
+            if task is not None:
+                self._run_task(job_id, attempts, max_retries, task, capture, start_time)
+                return
+
+            with timed("spawn"):
+                # The worker's own peak so far, which this child's max RSS will include
+                floor = rusage.spawn_floor()
                 process = subprocess.Popen(
                     command,
                     shell=True,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.PIPE,
-                    text=True,
                     creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == "nt" else 0
                 )
+                # Output is streamed to the log as it arrives instead of buffered by communicate()
+                pumps = start_pumps(process, capture)
 
+            try:
+                with timed("communicate"):
+                    # Reaped with wait4 to get this child's CPU, memory and I/O
+                    usage = rusage.wait(process, self.config.get("timeout", 10), floor)
+                    for t in pumps:
+                        t.join()
+            except subprocess.TimeoutExpired:
+                # Timeout occurred — kill process
+                if os.name == "nt":
+                    process.send_signal(signal.CTRL_BREAK_EVENT)
+                else:
+                    process.terminate()
                 try:
-                    stdout, stderr = process.communicate(timeout=self.config.get("timeout", 10))
+                    usage = rusage.wait(process, 2, floor)
                 except subprocess.TimeoutExpired:
-                    # Timeout occurred — kill process
-                    if os.name == "nt":
-                        process.send_signal(signal.CTRL_BREAK_EVENT)
-                    else:
-                        process.terminate()
-                    try:
-                        process.wait(2)
-                    except subprocess.TimeoutExpired:
-                        process.kill()
-
-                    stdout, stderr = process.communicate()
-                    duration = time.time() - start_time
-                    print(f"⏳ Job {job_id} timed out after {self.config.get('timeout', 10)}s")
-                    self._save_logs(job_id, stdout, stderr)
-                    self._handle_failure(job_id, attempts, max_retries, "TimeoutExpired")
-                    continue
-
-                #  PHASE-D — OUTPUT LOGGING
-                self._save_logs(job_id, stdout, stderr)
-
-                duration = time.time() - start_time
-                exit_code = process.returncode
-
-                if exit_code == 0:
-                    self.store.update_job_state(job_id, "completed", last_duration=duration, last_exit_code=exit_code)
-                    print(f"✅ Job {job_id} completed successfully in {duration:.2f}s")
-                    self._remove_from_dlq(job_id)
-                else:
-                    self.store.conn.execute(
-                        "UPDATE jobs SET last_duration=?, last_exit_code=? WHERE id=?",
-                        (duration, exit_code, job_id)
-                    )
-                    self.store.conn.commit()
-                    self._handle_failure(job_id, attempts, max_retries, f"ExitCode:{exit_code}")
-
-            except Exception as e:
-                duration = time.time() - start_time
-                self.store.conn.execute(
-                    "UPDATE jobs SET last_duration=?, last_exit_code=? WHERE id=?",
-                    (duration, -1, job_id)
-                )
-                self.store.conn.commit()
-                self._handle_failure(job_id, attempts, max_retries, str(e))
-
-            time.sleep(0.2)
-
-        print(f"🛑 Worker-{self.worker_id} stopping (graceful)")
-
-    # NEW FUNCTION FOR LOGGING 
-    def _save_logs(self, job_id, stdout, stderr):
-        """Save stdout/stderr to a log file."""
-        log_dir = "logs"
-        os.makedirs(log_dir, exist_ok=True)
-        log_path = os.path.join(log_dir, f"{job_id}.log")
-        with open(log_path, "w", encoding="utf-8") as f:
-            if stdout:
-                f.write(stdout)
-            if stderr:
-                f.write("\n[stderr]\n" + stderr)
-        print(f"🗒️ Logs saved to {log_path}")
-
-    # DEAD LETTER QUEUE HANDLER
-    def _handle_failure(self, job_id, attempts, max_retries, error):
-        attempts += 1
-        base = self.config.get("backoff_base", 2)
-        delay = base ** attempts
-        if attempts > max_retries:
-            from dlq import DLQ
-            dlq = DLQ()
-            dlq.conn.execute(
-                "INSERT OR REPLACE INTO dlq (id, command, attempts, max_retries, created_at, moved_at, error) "
-                "SELECT id, command, attempts, max_retries, created_at, strftime('%s','now'), ? FROM jobs WHERE id=?",
-                (error, job_id)
-            )
-            dlq.conn.commit()
-            self.store.update_job_state(job_id, "dead")
-            print(f"☠️ Job {job_id} moved to DLQ after {attempts - 1} retries. error={error}")
-        else:
-            next_run = time.time() + delay
-            self.store.conn.execute(
-                "UPDATE jobs SET state=?, attempts=?, updated_at=?, next_run_at=? WHERE id=?",
-                ("pending", attempts, time.time(), next_run, job_id)
-            )
-            self.store.conn.commit()
-            print(f"🔁 Job {job_id} failed (attempt {attempts}) — retrying in {delay:.1f}s (error={error})")
-
-    # REMOVE JOB FROM DLQ IF SUCCESS
-    def _remove_from_dlq(self, job_id):
-        try:
-            from dlq import DLQ
-            dlq = DLQ()
-            dlq.conn.execute("DELETE FROM dlq WHERE id=?", (job_id,))
-            dlq.conn.commit()
-        except Exception:
-            pass
+                    process.kill()
+                    usage = rusage.wait(process, floor=floor)
+
+                for t in pumps:
+                    t.join()
+                print(f"⏳ Job {job_id} timed out after {self.config.get('timeout', 10)}s")
+                self._close_log(capture)
+                # Recorded like any failed run, so `flam.py top` shows what timed-out jobs were doing
+                self._finish_job(job_id, attempts, max_retries, time.time() - start_time, process.returncode,
+                                 error="TimeoutExpired", usage=usage)
+                return
+
+            #  PHASE-D — OUTPUT LOGGING
+            self._close_log(capture)
+
+            duration = time.time() - start_time
+            self._finish_job(job_id, attempts, max_retries, duration, process.returncode, usage=usage)
+
+        except Exception as e:
+            duration = time.time() - start_time
+            capture.close()
+            self._finish_job(job_id, attempts, max_retries, duration, -1, error=str(e))
+
+    def _run_task(self, job_id, attempts, max_retries, task, capture, start_time):
+        """Run a Python task job in this process's prefork pool, with the same outcomes as a shell job."""
+        timeout = self.config.get("timeout", 10)
+        with timed("python_task"):
+            result = get_pool(self.config.get("python_pool_size", 0)).run(task, capture, timeout)
+        self._close_log(capture)
+        if result is None:
+            # Killed after ignoring its timeout: wall time is all there is to record
+            result = -1, "TimeoutExpired", None
+        exit_code, error, usage = result
+        if error == "TimeoutExpired":
+            print(f"⏳ Job {job_id} timed out after {timeout}s")
+        self._finish_job(job_id, attempts, max_retries, time.time() - start_time, exit_code, error, usage)
 
     def _get_pending_job(self):
-        cur = self.store.conn.execute(
-            "SELECT id, command, state, attempts, max_retries, created_at, updated_at, next_run_at, priority, last_duration, last_exit_code "
-            "FROM jobs WHERE state='pending' AND (next_run_at IS NULL OR next_run_at <= ?) "
-            "ORDER BY priority DESC, created_at ASC LIMIT 1",
-            (time.time(),)
-        )
-        return cur.fetchone()
+        """Pop the next claimed job, leasing a fresh batch when the local buffer is empty."""
+        if not self.claimed:
+            batch = self.config.get("claim_batch", 1)
+            jobs = self.store.claim(f"worker-{os.getpid()}-{self.worker_id}", batch, self.queues,
+                                    self.config.get("queue_limits"), self.config.get("lease_timeout", 60))
+            self.leases.add(j[0] for j in jobs)
+            self.claimed.extend(jobs)
+        return self.claimed.popleft() if self.claimed else None